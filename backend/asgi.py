@@ -14,3 +14,8 @@ from django.core.asgi import get_asgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'backend.settings')
 
 application = get_asgi_application()
+
+# Check Google Calendar access once per worker instead of on every request
+from stadium_api.google_client import startup_health_check  # noqa: E402
+
+startup_health_check()
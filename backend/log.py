@@ -0,0 +1,58 @@
+"""Logging handler and formatter referenced from ``settings.LOGGING``."""
+import atexit
+import logging
+import os
+import queue
+from logging.handlers import QueueHandler, QueueListener
+
+# Attributes every LogRecord has; anything else came in through ``extra=``
+RECORD_ATTRS = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime'}
+
+
+class KeyValueFormatter(logging.Formatter):
+    """Format records as one line and append ``extra=`` fields as ``key=value``."""
+
+    def format(self, record):
+        record.message = record.getMessage()
+        if self.usesTime():
+            record.asctime = self.formatTime(record, self.datefmt)
+        line = self.formatMessage(record)
+        fields = [
+            f'{key}={value}'
+            for key, value in record.__dict__.items()
+            if key not in RECORD_ATTRS and value is not None
+        ]
+        if fields:
+            line = f"{line} {' '.join(fields)}"
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            line = f'{line}\n{record.exc_text}'
+        if record.stack_info:
+            line = f'{line}\n{self.formatStack(record.stack_info)}'
+        return line
+
+
+class BackgroundHandler(QueueHandler):
+    """Hand records to a thread that writes them to ``stream`` (stderr by default).
+
+    Records are formatted in the calling thread, but the write to the
+    stream, which can block, happens off the request path.
+    """
+
+    def __init__(self, stream=None):
+        super().__init__(queue.SimpleQueue())
+        self.target = logging.StreamHandler(stream)
+        self._start()
+        atexit.register(self._stop)
+        # Threads do not survive fork(); restart the listener in the child
+        os.register_at_fork(after_in_child=self._start)
+
+    def _start(self):
+        self.queue = queue.SimpleQueue()
+        self.listener = QueueListener(self.queue, self.target)
+        self.listener.start()
+
+    def _stop(self):
+        if self.listener._thread is not None:
+            self.listener.stop()
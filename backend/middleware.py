@@ -1,6 +1,15 @@
+import logging
 import re
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
 from django.conf import settings
 from django.middleware.csrf import CsrfViewMiddleware
+from django.utils.functional import empty
+
+from stadium_api import metrics
+
+request_logger = logging.getLogger('backend.requests')
 
 class CustomCsrfMiddleware(CsrfViewMiddleware):
     def process_view(self, request, callback, callback_args, callback_kwargs):
@@ -8,4 +17,73 @@ class CustomCsrfMiddleware(CsrfViewMiddleware):
         for exempt_url in getattr(settings, 'CSRF_EXEMPT_URLS', []):
             if re.compile(exempt_url).match(request.path_info):
                 return None
-        return super().process_view(request, callback, callback_args, callback_kwargs) 
\ No newline at end of file
+        return super().process_view(request, callback, callback_args, callback_kwargs) 
+
+class RequestTimingMiddleware:
+    """Time each request and say where the time went.
+
+    The request's spans (database, Google, SMTP, rendering; see
+    ``stadium_api.metrics``) go out in a ``Server-Timing`` header, into the
+    request counters behind ``/metrics/``, and into one log line.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        timings, token = metrics.begin_request()
+        started = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            metrics.end_request(token)
+        self.finish(request, response, timings, time.perf_counter() - started)
+        return response
+
+    async def __acall__(self, request):
+        timings, token = metrics.begin_request()
+        started = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            metrics.end_request(token)
+        self.finish(request, response, timings, time.perf_counter() - started)
+        return response
+
+    def finish(self, request, response, timings, elapsed):
+        spans = dict(timings.spans)
+        if settings.SERVER_TIMING_HEADER:
+            entries = [
+                f'{name};dur={seconds * 1000:.1f};desc="{count}"'
+                for name, (count, seconds) in sorted(spans.items())
+            ]
+            entries.append(f'total;dur={elapsed * 1000:.1f}')
+            response['Server-Timing'] = ', '.join(entries)
+
+        match = getattr(request, 'resolver_match', None)
+        route = match.route if match else 'unmatched'
+        metrics.record_request(route, request.method, response.status_code, elapsed)
+
+        if not request_logger.isEnabledFor(logging.INFO):
+            return
+        user = request.__dict__.get('user')
+        # Do not load a lazy session user just to log it
+        if getattr(user, '_wrapped', None) is empty:
+            user = None
+        fields = {
+            'method': request.method,
+            'path': request.path,
+            'status': response.status_code,
+            'duration_ms': round(elapsed * 1000, 1),
+            'user': getattr(user, 'pk', None),
+        }
+        for name, (count, seconds) in spans.items():
+            fields[f'{name}_calls'] = count
+            fields[f'{name}_ms'] = round(seconds * 1000, 1)
+        request_logger.info('request', extra=fields)
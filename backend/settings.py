@@ -22,8 +22,9 @@ load_dotenv()
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
 
-# React App directory - only use if directory exists
-# REACT_APP_DIR = os.path.join(BASE_DIR, 'build')
+# React App directory; its index.html is served for all non-API routes
+# (see stadium_api/views/frontend.py), a placeholder page if it is missing
+REACT_APP_DIR = os.getenv('REACT_APP_DIR', os.path.join(BASE_DIR, 'build'))
 
 # Quick-start development settings - unsuitable for production
 # See https://docs.djangoproject.com/en/5.1/howto/deployment/checklist/
@@ -58,6 +59,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'backend.middleware.RequestTimingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'whitenoise.middleware.WhiteNoiseMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -93,14 +95,34 @@ WSGI_APPLICATION = 'backend.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/5.1/ref/settings/#databases
 
+# The web app runs under ASGI, where Django does not reliably close or reuse
+# persistent connections between async requests, so each request opens and
+# closes its own by default. Long-running workers may set CONN_MAX_AGE.
 DATABASES = {
     'default': dj_database_url.config(
         default='sqlite:///db.sqlite3',
-        conn_max_age=600
+        conn_max_age=int(os.getenv('CONN_MAX_AGE', '0'))
     )
 }
 
 
+# Cache
+# Local memory by default. Point CACHE_BACKEND at a shared backend (e.g.
+# django.core.cache.backends.db.DatabaseCache) so every gunicorn worker sees
+# the same entries.
+CACHES = {
+    'default': {
+        'BACKEND': os.getenv('CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': os.getenv('CACHE_LOCATION', 'stadium-cache'),
+        # Cooldowns, one-time codes and throttle counters live here too, so
+        # keep culling (which drops arbitrary entries) out of reach
+        'OPTIONS': {
+            'MAX_ENTRIES': int(os.getenv('CACHE_MAX_ENTRIES', '100000')),
+        },
+    }
+}
+
+
 # Password validation
 # https://docs.djangoproject.com/en/5.1/ref/settings/#auth-password-validators
 
@@ -120,6 +142,30 @@ AUTH_PASSWORD_VALIDATORS = [
 ]
 
 
+# Password hashing (see stadium_api/hashers.py). PASSWORD_HASHER is the policy
+# for new hashes: 'pbkdf2' (PASSWORD_PBKDF2_ITERATIONS iterations) or 'argon2'
+# (needs argon2-cffi; time cost, memory in KiB, threads). Older hashes keep
+# verifying and are rehashed with the current policy on the next login.
+# manage.py benchmark_hashers reports what each policy costs per login.
+PASSWORD_HASHER = os.getenv('PASSWORD_HASHER', 'pbkdf2')
+PASSWORD_PBKDF2_ITERATIONS = int(os.getenv('PASSWORD_PBKDF2_ITERATIONS', '720000'))
+PASSWORD_ARGON2_TIME_COST = int(os.getenv('PASSWORD_ARGON2_TIME_COST', '2'))
+PASSWORD_ARGON2_MEMORY_COST = int(os.getenv('PASSWORD_ARGON2_MEMORY_COST', '102400'))
+PASSWORD_ARGON2_PARALLELISM = int(os.getenv('PASSWORD_ARGON2_PARALLELISM', '8'))
+PASSWORD_POLICIES = {
+    'pbkdf2': 'stadium_api.hashers.PBKDF2PasswordHasher',
+    'argon2': 'stadium_api.hashers.Argon2PasswordHasher',
+}
+# The first hasher makes new hashes; the rest only verify existing ones
+PASSWORD_HASHERS = [PASSWORD_POLICIES[PASSWORD_HASHER]] + [
+    hasher for policy, hasher in PASSWORD_POLICIES.items() if policy != PASSWORD_HASHER
+] + [
+    'django.contrib.auth.hashers.PBKDF2SHA1PasswordHasher',
+    'django.contrib.auth.hashers.BCryptSHA256PasswordHasher',
+    'django.contrib.auth.hashers.ScryptPasswordHasher',
+]
+
+
 # Internationalization
 # https://docs.djangoproject.com/en/5.1/topics/i18n/
 
@@ -209,11 +255,33 @@ CORS_ALLOW_HEADERS = [
 # REST Framework settings
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'stadium_api.authentication.ClaimsJWTAuthentication',
     ),
     'DEFAULT_PERMISSION_CLASSES': (
         'rest_framework.permissions.AllowAny',
     ),
+    'DEFAULT_RENDERER_CLASSES': (
+        'stadium_api.renderers.TimedJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ),
+    # Sliding-window limits per client IP and per account (see
+    # stadium_api/throttling.py), counted in the shared cache
+    'DEFAULT_THROTTLE_RATES': {
+        'verify_code_ip': os.getenv('THROTTLE_VERIFY_CODE_IP', '30/hour'),
+        'verify_code_account': os.getenv('THROTTLE_VERIFY_CODE_ACCOUNT', '10/hour'),
+        'resend_code_ip': os.getenv('THROTTLE_RESEND_CODE_IP', '10/hour'),
+        'resend_code_account': os.getenv('THROTTLE_RESEND_CODE_ACCOUNT', '5/hour'),
+        'password_reset_ip': os.getenv('THROTTLE_PASSWORD_RESET_IP', '10/hour'),
+        'password_reset_account': os.getenv('THROTTLE_PASSWORD_RESET_ACCOUNT', '5/hour'),
+        'password_reset_confirm_ip': os.getenv('THROTTLE_PASSWORD_RESET_CONFIRM_IP', '30/hour'),
+        'password_reset_confirm_account': os.getenv('THROTTLE_PASSWORD_RESET_CONFIRM_ACCOUNT', '10/hour'),
+        'book_slot_ip': os.getenv('THROTTLE_BOOK_SLOT_IP', '60/min'),
+        'book_slot_account': os.getenv('THROTTLE_BOOK_SLOT_ACCOUNT', '10/min'),
+    },
+    # Proxies in front of the app (1 on Render/Heroku): the client IP is taken
+    # that many hops from the end of X-Forwarded-For, so clients cannot pick
+    # their own. 0 uses the socket address (local development).
+    'NUM_PROXIES': int(os.getenv('NUM_PROXIES', '0' if DEBUG else '1')),
 }
 
 # Google Calendar Settings
@@ -221,30 +289,129 @@ GOOGLE_SERVICE_ACCOUNT_CREDENTIALS = os.getenv('GOOGLE_SERVICE_ACCOUNT_CREDENTIA
 if not GOOGLE_SERVICE_ACCOUNT_CREDENTIALS:
     print("Warning: GOOGLE_SERVICE_ACCOUNT_CREDENTIALS environment variable not set")
 
+# Shared Calendar client (see stadium_api/google_client.py)
+GOOGLE_CALENDAR_HTTP_TIMEOUT = int(os.getenv('GOOGLE_CALENDAR_HTTP_TIMEOUT', '15'))
+GOOGLE_CALENDAR_TOKEN_REFRESH_MARGIN = int(os.getenv('GOOGLE_CALENDAR_TOKEN_REFRESH_MARGIN', '300'))
+# Connections the async client keeps open to Google per event loop
+GOOGLE_CALENDAR_MAX_CONNECTIONS = int(os.getenv('GOOGLE_CALENDAR_MAX_CONNECTIONS', '100'))
+# Verify calendar access once per worker process at startup
+GOOGLE_CALENDAR_HEALTH_CHECK = os.getenv('GOOGLE_CALENDAR_HEALTH_CHECK', 'True').lower() == 'true'
+# Google Calendar quota and circuit breaker (see stadium_api/calendar_quota.py),
+# shared by all workers through the cache: requests per second for the whole
+# project and per calendar, how long a call may wait for quota, retries of
+# quota/5xx/network errors (backoff in seconds, doubled with jitter), and how
+# many failures within BREAKER_WINDOW seconds stop calls for BREAKER_COOLDOWN
+GOOGLE_CALENDAR_QPS = int(os.getenv('GOOGLE_CALENDAR_QPS', '10'))
+GOOGLE_CALENDAR_CALENDAR_QPS = int(os.getenv('GOOGLE_CALENDAR_CALENDAR_QPS', '5'))
+GOOGLE_CALENDAR_QUOTA_WAIT = float(os.getenv('GOOGLE_CALENDAR_QUOTA_WAIT', '5'))
+GOOGLE_CALENDAR_MAX_RETRIES = int(os.getenv('GOOGLE_CALENDAR_MAX_RETRIES', '3'))
+GOOGLE_CALENDAR_RETRY_BACKOFF = float(os.getenv('GOOGLE_CALENDAR_RETRY_BACKOFF', '0.5'))
+GOOGLE_CALENDAR_RETRY_BACKOFF_MAX = float(os.getenv('GOOGLE_CALENDAR_RETRY_BACKOFF_MAX', '8'))
+GOOGLE_CALENDAR_BREAKER_THRESHOLD = int(os.getenv('GOOGLE_CALENDAR_BREAKER_THRESHOLD', '5'))
+GOOGLE_CALENDAR_BREAKER_WINDOW = int(os.getenv('GOOGLE_CALENDAR_BREAKER_WINDOW', '60'))
+GOOGLE_CALENDAR_BREAKER_COOLDOWN = int(os.getenv('GOOGLE_CALENDAR_BREAKER_COOLDOWN', '30'))
+
+# Available-slot cache (see stadium_api/slot_cache.py): seconds an entry is
+# fresh, then how long a stale copy may still be served while it refreshes
+SLOT_CACHE_TTL = int(os.getenv('SLOT_CACHE_TTL', '30'))
+SLOT_CACHE_STALE_TTL = int(os.getenv('SLOT_CACHE_STALE_TTL', '300'))
+
+# Calendar worker (manage.py run_calendar_worker): how often it pushes local
+# bookings and runs an incremental sync of the stadium calendars, in seconds
+CALENDAR_WORKER_INTERVAL = float(os.getenv('CALENDAR_WORKER_INTERVAL', '2'))
+CALENDAR_WORKER_PULL_INTERVAL = float(os.getenv('CALENDAR_WORKER_PULL_INTERVAL', '60'))
+# Failed pushes to Google are retried after CALENDAR_PUSH_BACKOFF seconds,
+# doubling each time up to CALENDAR_PUSH_BACKOFF_MAX; a pending booking is
+# marked failed after CALENDAR_PUSH_MAX_ATTEMPTS tries
+CALENDAR_PUSH_BACKOFF = float(os.getenv('CALENDAR_PUSH_BACKOFF', '2'))
+CALENDAR_PUSH_BACKOFF_MAX = float(os.getenv('CALENDAR_PUSH_BACKOFF_MAX', '300'))
+CALENDAR_PUSH_MAX_ATTEMPTS = int(os.getenv('CALENDAR_PUSH_MAX_ATTEMPTS', '8'))
+# Bulk slot creation and closures (see stadium_api/calendar_batch.py): requests
+# per batch call, pause between calls, and retries of rate-limited requests
+CALENDAR_BATCH_SIZE = int(os.getenv('CALENDAR_BATCH_SIZE', '50'))
+CALENDAR_BATCH_INTERVAL = float(os.getenv('CALENDAR_BATCH_INTERVAL', '1'))
+CALENDAR_BATCH_BACKOFF = float(os.getenv('CALENDAR_BATCH_BACKOFF', '2'))
+CALENDAR_BATCH_MAX_RETRIES = int(os.getenv('CALENDAR_BATCH_MAX_RETRIES', '5'))
+# How far ahead generate_slots and the admin action create match slots
+SLOT_GENERATION_WEEKS = int(os.getenv('SLOT_GENERATION_WEEKS', '8'))
+# Generation queued from the admin is retried after SLOT_GENERATION_BACKOFF
+# seconds, doubling up to SLOT_GENERATION_BACKOFF_MAX, and dropped after
+# SLOT_GENERATION_MAX_ATTEMPTS tries
+SLOT_GENERATION_BACKOFF = float(os.getenv('SLOT_GENERATION_BACKOFF', '60'))
+SLOT_GENERATION_BACKOFF_MAX = float(os.getenv('SLOT_GENERATION_BACKOFF_MAX', '3600'))
+SLOT_GENERATION_MAX_ATTEMPTS = int(os.getenv('SLOT_GENERATION_MAX_ATTEMPTS', '5'))
+# book_slot answers 202 and leaves the Google write to the calendar worker;
+# set BOOKING_ASYNC=False to write to Google before responding instead
+BOOKING_ASYNC = os.getenv('BOOKING_ASYNC', 'True').lower() == 'true'
+# Route the calendar endpoints to the async views (run under an ASGI server,
+# see Procfile); set to False to use the DRF views under WSGI
+CALENDAR_ASYNC_VIEWS = os.getenv('CALENDAR_ASYNC_VIEWS', 'True').lower() == 'true'
+# Longest a client may long-poll a booking's status (?wait=), in seconds
+BOOKING_STATUS_MAX_WAIT = int(os.getenv('BOOKING_STATUS_MAX_WAIT', '20'))
+# Widest date range the calendar/availability/ endpoint serves, in days
+AVAILABILITY_MAX_DAYS = int(os.getenv('AVAILABILITY_MAX_DAYS', '31'))
+# Read paths run an incremental sync first when a calendar is older than this
+CALENDAR_SYNC_MAX_AGE = int(os.getenv('CALENDAR_SYNC_MAX_AGE', '60'))
+# my_bookings refreshes all stadium calendars concurrently with this many
+# threads, giving each calendar at most CALENDAR_FANOUT_TIMEOUT seconds
+CALENDAR_FANOUT_WORKERS = int(os.getenv('CALENDAR_FANOUT_WORKERS', '8'))
+CALENDAR_FANOUT_TIMEOUT = float(os.getenv('CALENDAR_FANOUT_TIMEOUT', '5'))
+# How far ahead a user's bookings are looked up directly in Google for
+# calendars that have not completed their first full sync
+BOOKINGS_HORIZON_DAYS = int(os.getenv('BOOKINGS_HORIZON_DAYS', '90'))
+
+# Push notifications (see stadium_api/calendar_watch.py). The webhook URL must
+# be public HTTPS; channels live for CALENDAR_WATCH_TTL seconds. The calendar
+# worker checks every CALENDAR_WATCH_RENEW_INTERVAL seconds and replaces
+# channels expiring within CALENDAR_WATCH_RENEW_BEFORE seconds.
+CALENDAR_WEBHOOK_URL = os.getenv('CALENDAR_WEBHOOK_URL', 'https://stadiumbackend.onrender.com/calendar/notifications/')
+CALENDAR_WATCH_TTL = int(os.getenv('CALENDAR_WATCH_TTL', str(7 * 24 * 3600)))
+CALENDAR_WATCH_RENEW_INTERVAL = float(os.getenv('CALENDAR_WATCH_RENEW_INTERVAL', '3600'))
+CALENDAR_WATCH_RENEW_BEFORE = float(os.getenv('CALENDAR_WATCH_RENEW_BEFORE', str(48 * 3600)))
+CALENDAR_WATCH_BACKEND = os.getenv('CALENDAR_WATCH_BACKEND', 'stadium_api.calendar_watch.GoogleWatchBackend')
+
+# Request timing (see stadium_api/metrics.py): send Server-Timing headers,
+# seconds between flushes of each process's counters to the shared cache, and
+# the bearer token /metrics/ requires (without one it is only served in DEBUG)
+SERVER_TIMING_HEADER = os.getenv('SERVER_TIMING_HEADER', 'True').lower() == 'true'
+METRICS_FLUSH_INTERVAL = float(os.getenv('METRICS_FLUSH_INTERVAL', '10'))
+METRICS_TOKEN = os.getenv('METRICS_TOKEN', '')
+
+# One-time email codes (see stadium_api/state.py) expire after these many seconds
+VERIFICATION_CODE_TTL = int(os.getenv('VERIFICATION_CODE_TTL', str(24 * 3600)))
+PASSWORD_RESET_CODE_TTL = int(os.getenv('PASSWORD_RESET_CODE_TTL', '3600'))
+
 # Logging configuration
+# Records are written to stderr from a background thread (backend/log.py) as
+# one key=value line each; LOG_LEVEL gates everything, STADIUM_LOG_LEVEL the app
 LOGGING = {
     'version': 1,
     'disable_existing_loggers': False,
+    'formatters': {
+        'key_value': {
+            '()': 'backend.log.KeyValueFormatter',
+            'format': 'time=%(asctime)s level=%(levelname)s logger=%(name)s %(message)s',
+        },
+    },
     'handlers': {
-        'console': {
-            'class': 'logging.StreamHandler',
+        'background': {
+            'class': 'backend.log.BackgroundHandler',
+            'formatter': 'key_value',
         },
     },
     'root': {
-        'handlers': ['console'],
-        'level': 'INFO',
+        'handlers': ['background'],
+        'level': os.getenv('LOG_LEVEL', 'INFO'),
     },
     'loggers': {
         'stadium_api': {
-            'handlers': ['console'],
-            'level': 'DEBUG',
-            'propagate': True,
+            'level': os.getenv('STADIUM_LOG_LEVEL', 'INFO'),
         },
     },
 }
 
 # Email settings
-EMAIL_BACKEND = 'django.core.mail.backends.smtp.EmailBackend'
+EMAIL_BACKEND = 'stadium_api.mail.TimedSMTPBackend'
 EMAIL_HOST = 'smtp.gmail.com'
 EMAIL_PORT = 587
 EMAIL_USE_TLS = True
@@ -254,6 +421,19 @@ DEFAULT_FROM_EMAIL = os.getenv('DEFAULT_FROM_EMAIL', 'Tottenham Stadium <stadium
 EMAIL_TIMEOUT = 30
 EMAIL_USE_SSL = False
 
+# Email worker (manage.py run_email_worker, see stadium_api/email_outbox.py):
+# batch size, idle poll interval in seconds, and retries of failed sends,
+# EMAIL_RETRY_BACKOFF seconds doubling up to EMAIL_RETRY_BACKOFF_MAX. Sent and
+# failed messages are deleted after EMAIL_OUTBOX_RETENTION_DAYS, checked every
+# EMAIL_PURGE_INTERVAL seconds
+EMAIL_WORKER_BATCH_SIZE = int(os.getenv('EMAIL_WORKER_BATCH_SIZE', '50'))
+EMAIL_WORKER_INTERVAL = float(os.getenv('EMAIL_WORKER_INTERVAL', '1'))
+EMAIL_MAX_ATTEMPTS = int(os.getenv('EMAIL_MAX_ATTEMPTS', '5'))
+EMAIL_RETRY_BACKOFF = float(os.getenv('EMAIL_RETRY_BACKOFF', '30'))
+EMAIL_RETRY_BACKOFF_MAX = float(os.getenv('EMAIL_RETRY_BACKOFF_MAX', '3600'))
+EMAIL_OUTBOX_RETENTION_DAYS = int(os.getenv('EMAIL_OUTBOX_RETENTION_DAYS', '7'))
+EMAIL_PURGE_INTERVAL = float(os.getenv('EMAIL_PURGE_INTERVAL', '3600'))
+
 # For debugging email issues
 if DEBUG:
     EMAIL_BACKEND = 'django.core.mail.backends.console.EmailBackend'
@@ -14,3 +14,8 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'backend.settings')
 
 application = get_wsgi_application()
+
+# Check Google Calendar access once per worker instead of on every request
+from stadium_api.google_client import startup_health_check  # noqa: E402
+
+startup_health_check()
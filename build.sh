@@ -8,5 +8,9 @@ pip install -r requirements.txt
 # Collect static files
 python manage.py collectstatic --no-input
 
+# Create the cache table (no-op unless CACHE_BACKEND is the database cache).
+# Migrations write to the cache, so this comes first.
+python manage.py createcachetable
+
 # Run migrations
 python manage.py migrate 
\ No newline at end of file
@@ -1,5 +1,46 @@
-from django.contrib import admin
-from .models import UserProfile
+from itertools import groupby
+
+from django.contrib import admin, messages
+
+from . import calendar_batch
+from .models import Booking, OutboxEmail, Slot, Stadium, UserProfile
+
+
+class StadiumAdmin(admin.ModelAdmin):
+    actions = ['generate_slots']
+
+    @admin.action(description='Generate match slots for the coming weeks')
+    def generate_slots(self, request, queryset):
+        # Thousands of events take minutes to write; the calendar worker does it
+        queued = calendar_batch.request_slot_generation(queryset)
+        self.message_user(
+            request,
+            f'Slot generation queued for {queued} stadiums; the calendar worker will create them shortly',
+            messages.SUCCESS
+        )
+
+
+class SlotAdmin(admin.ModelAdmin):
+    list_display = ['calendar_id', 'start', 'end', 'is_booked', 'needs_push']
+    list_filter = ['calendar_id', 'is_booked']
+    actions = ['delete_free_slots']
+
+    @admin.action(description='Delete selected free slots from Google Calendar')
+    def delete_free_slots(self, request, queryset):
+        rows = queryset.order_by('calendar_id').values_list('calendar_id', 'event_id')
+        for calendar_id, group in groupby(rows, key=lambda row: row[0]):
+            deleted, kept, errors = calendar_batch.delete_slots(calendar_id, [event_id for _, event_id in group])
+            level = messages.WARNING if kept or errors else messages.SUCCESS
+            self.message_user(
+                request,
+                f'{calendar_id}: {deleted} slots deleted, {len(kept)} booked kept, {len(errors)} failed',
+                level
+            )
+
 
 # Register your models here.
 admin.site.register(UserProfile)
+admin.site.register(Stadium, StadiumAdmin)
+admin.site.register(Slot, SlotAdmin)
+admin.site.register(Booking)
+admin.site.register(OutboxEmail)
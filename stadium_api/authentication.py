@@ -0,0 +1,147 @@
+"""JWT authentication that answers reads from the token's own claims.
+
+Tokens issued through ``ClaimsRefreshToken`` carry the user's names, phone
+and verified flag next to the user ID. For safe methods
+``ClaimsJWTAuthentication`` builds a ``TokenUser`` from those signed claims
+instead of loading ``User`` from the database. Writes, and tokens without
+claims (issued before this or to inactive users), still load the user, with
+its profile in the same query.
+
+Each profile has a ``token_version`` that is copied into its tokens as the
+``ver`` claim. ``revoke_tokens()`` bumps it, which rejects every token issued
+before. Reads check the version against a cached copy, so revocation costs
+them a cache lookup rather than a query.
+"""
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import F
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken
+from rest_framework_simplejwt.models import TokenUser
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from .models import UserProfile
+
+VERSION_CLAIM = 'ver'
+VERSION_TTL = 24 * 60 * 60
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+# Cached for users without a profile, whose tokens are never valid
+NO_PROFILE = -1
+
+
+def _version_key(user_id):
+    return f'auth:token_version:{user_id}'
+
+
+def user_claims(user):
+    """Claims describing ``user`` well enough to serve reads without the database."""
+    profile = user.profile
+    return {
+        'username': user.username,
+        'first_name': user.first_name,
+        'last_name': user.last_name,
+        'phone': profile.phone,
+        'verified': profile.is_verified,
+        VERSION_CLAIM: profile.token_version,
+    }
+
+
+class ClaimsRefreshToken(RefreshToken):
+    """Refresh token whose access tokens carry ``user_claims()``."""
+
+    @classmethod
+    def for_user(cls, user):
+        token = super().for_user(user)
+        # Tokens of inactive users stay claim-less, so they keep being checked
+        # against the database until the account is activated
+        if user.is_active and hasattr(user, 'profile'):
+            for claim, value in user_claims(user).items():
+                token[claim] = value
+        return token
+
+
+def token_version(user_id):
+    """The current token version of a user, or NO_PROFILE."""
+    key = _version_key(user_id)
+    version = cache.get(key)
+    if version is None:
+        version = UserProfile.objects.filter(user_id=user_id).values_list('token_version', flat=True).first()
+        if version is None:
+            version = NO_PROFILE
+        cache.set(key, version, timeout=VERSION_TTL)
+    return version
+
+
+def revoke_tokens(user):
+    """Invalidate every token issued to ``user`` so far."""
+    UserProfile.objects.filter(user=user).update(token_version=F('token_version') + 1)
+    # Drop the cached version only once the new one is visible to other workers
+    forget_token_version(user.pk)
+
+
+def forget_token_version(user_id):
+    """Drop the cached version, e.g. after the user was deleted."""
+    transaction.on_commit(lambda: cache.delete(_version_key(user_id)))
+
+
+class ClaimsJWTAuthentication(JWTAuthentication):
+    """JWTAuthentication that skips the user query for reads."""
+    # Methods answered from the token's claims
+    token_user_methods = SAFE_METHODS
+
+    def authenticate(self, request):
+        header = self.get_header(request)
+        if header is None:
+            return None
+        raw_token = self.get_raw_token(header)
+        if raw_token is None:
+            return None
+
+        validated_token = self.get_validated_token(raw_token)
+        if request.method in self.token_user_methods and VERSION_CLAIM in validated_token:
+            return self.get_token_user(validated_token), validated_token
+        return self.get_user(validated_token), validated_token
+
+    def get_token_user(self, validated_token):
+        if api_settings.USER_ID_CLAIM not in validated_token:
+            raise InvalidToken('Token contained no recognizable user identification')
+        user = TokenUser(validated_token)
+        version = token_version(user.id)
+        if version == NO_PROFILE:
+            raise AuthenticationFailed('User not found', code='user_not_found')
+        if validated_token[VERSION_CLAIM] != version:
+            raise AuthenticationFailed('Token has been revoked', code='token_revoked')
+        return user
+
+    def get_user(self, validated_token):
+        try:
+            user_id = validated_token[api_settings.USER_ID_CLAIM]
+        except KeyError:
+            raise InvalidToken('Token contained no recognizable user identification')
+
+        try:
+            user = self.user_model.objects.select_related('profile').get(**{api_settings.USER_ID_FIELD: user_id})
+        except self.user_model.DoesNotExist:
+            raise AuthenticationFailed('User not found', code='user_not_found')
+
+        if not user.is_active:
+            raise AuthenticationFailed('User is inactive', code='user_inactive')
+
+        try:
+            version = user.profile.token_version
+        except UserProfile.DoesNotExist:
+            version = 0
+        # Tokens issued without claims count as version 0
+        if validated_token.get(VERSION_CLAIM, 0) != version:
+            raise AuthenticationFailed('Token has been revoked', code='token_revoked')
+        return user
+
+
+class UserJWTAuthentication(ClaimsJWTAuthentication):
+    """Always loads the full User, for views that need more than the claims.
+
+    Unlike simplejwt's JWTAuthentication it still checks the token version,
+    so revoked tokens are refused here too.
+    """
+    token_user_methods = ()
@@ -0,0 +1,103 @@
+"""Booking and cancelling slots in the local tables.
+
+Shared by the sync and async calendar views. Both operations only touch the
+database; the calendar worker mirrors the result to Google. Requests that
+cannot be honoured raise ``BookingError`` carrying the HTTP status to answer
+with.
+"""
+import logging
+from datetime import timedelta
+
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+
+from . import slot_cache, state
+from .models import Booking, Slot
+from .stadiums import get_stadium
+
+logger = logging.getLogger(__name__)
+
+CANCELLATION_COOLDOWN = timedelta(hours=1)
+
+
+class BookingError(Exception):
+    def __init__(self, message, status_code):
+        super().__init__(message)
+        self.message = message
+        self.status_code = status_code
+
+
+def reserve_slot(user, calendar_id, event_id):
+    """Book a slot for ``user`` and return the new pending Booking."""
+    if get_stadium(calendar_id) is None:
+        raise BookingError('Unknown stadium calendar', 404)
+
+    # Check if user is in cooldown period
+    remaining = state.cooldown_remaining('booking', user.id)
+    if remaining:
+        minutes_left = int(remaining / 60)
+        raise BookingError(
+            f'You recently cancelled a booking. Please wait {minutes_left} minutes before booking again.',
+            400
+        )
+
+    user_name = f"{user.first_name} {user.last_name}".strip() or "Anonymous"
+    # Authentication loaded the profile together with the user
+    user_phone = user.profile.phone or "No phone"
+
+    # The row lock makes concurrent requests for the same slot queue up
+    # here, and the unique constraint on active bookings backs it up.
+    try:
+        with transaction.atomic():
+            slot = Slot.objects.select_for_update().get(calendar_id=calendar_id, event_id=event_id)
+            if slot.is_booked:
+                raise BookingError('This slot is already booked', 409)
+            slot.is_booked = True
+            slot.mark_dirty()
+            slot.save()
+            booking = Booking.objects.create(
+                slot=slot,
+                user=user,
+                user_name=user_name,
+                user_phone=user_phone
+            )
+    except Slot.DoesNotExist:
+        raise BookingError('Slot not found', 404)
+    except IntegrityError:
+        raise BookingError('This slot is already booked', 409)
+
+    slot_cache.invalidate_calendar(calendar_id)
+    logger.info("booking.accepted booking=%s user=%s", booking.id, user.id)
+    return booking
+
+
+def cancel_booking(user, calendar_id, event_id):
+    """Cancel ``user``'s active booking of a slot and return it."""
+    with transaction.atomic():
+        # Lock the booking and its slot so a cancel cannot interleave
+        # with a concurrent booking or cancel of the same slot
+        booking = Booking.objects.select_for_update().select_related('slot').filter(
+            slot__calendar_id=calendar_id,
+            slot__event_id=event_id,
+            status__in=Booking.ACTIVE_STATUSES
+        ).first()
+
+        # Check if booked by this user
+        if booking is None or booking.user_id != user.id:
+            raise BookingError('You can only cancel your own bookings', 403)
+
+        # Free the slot locally; the calendar worker resets the Google event
+        booking.status = 'cancelled'
+        booking.cancelled_at = timezone.now()
+        booking.synced_at = None
+        booking.save()
+        slot = booking.slot
+        slot.is_booked = False
+        slot.mark_dirty()
+        slot.save()
+
+    # Start the user's cooldown before booking again
+    state.start_cooldown('booking', user.id, CANCELLATION_COOLDOWN)
+    slot_cache.invalidate_calendar(calendar_id)
+    logger.info("booking.cancelled booking=%s user=%s", booking.id, user.id)
+    return booking
@@ -0,0 +1,342 @@
+"""Bulk writes to Google Calendar through the batch HTTP endpoint.
+
+Generating a season of match slots or closing a pitch touches hundreds of
+events. ``execute()`` sends them to ``batch/calendar/v3`` in chunks of
+``CALENDAR_BATCH_SIZE`` requests and pauses ``CALENDAR_BATCH_INTERVAL``
+seconds between chunks to stay inside the per-user quota. Each batch call
+goes through ``calendar_quota`` like any other request. Sub-requests that
+were rate limited or hit a server error are retried with backoff and jitter.
+
+Both operations can be re-run after an interruption. Generated slots get
+event IDs derived from their calendar and start time, so repeating a run
+skips the events that already exist. Closures work from the remote listing,
+so repeating one deletes whatever is left.
+"""
+import base64
+import hashlib
+import logging
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+from googleapiclient.errors import HttpError
+
+from . import calendar_quota, intervals, slot_cache
+from .calendar_mirror import is_match_event, slot_fields
+from .calendar_sync import apply_events
+from .google_client import get_calendar_service
+from .models import Slot, Stadium
+
+logger = logging.getLogger(__name__)
+
+def event_id_for(calendar_id, start):
+    """Deterministic Google event ID for a generated slot.
+
+    Event IDs may only use base32hex characters (a-v and 0-9).
+    """
+    digest = hashlib.sha1(f'{calendar_id}|{start.isoformat()}'.encode()).digest()
+    return base64.b32hexencode(digest).decode().rstrip('=').lower()
+
+
+def _execute_chunk(service, chunk):
+    """Send one batch; returns ``{key: response or HttpError}``."""
+    outcomes = {}
+    keys = {}
+
+    def callback(request_id, response, exception):
+        outcomes[keys[request_id]] = exception if exception is not None else response
+
+    batch = service.new_batch_http_request(callback=callback)
+    for i, (key, request) in enumerate(chunk):
+        keys[str(i)] = key
+        batch.add(request, request_id=str(i))
+    calendar_quota.call(None, batch.execute, cost=len(chunk))
+    return outcomes
+
+
+def execute(requests, ok_statuses=(), on_results=None):
+    """Run ``{key: HttpRequest}`` through the batch endpoint.
+
+    Errors whose HTTP status is in ``ok_statuses`` count as success with a
+    None result (e.g. 409 for an insert that already happened). After each
+    chunk, ``on_results`` is called with that chunk's successful results.
+
+    Returns ``(results, errors)``, both dicts keyed like ``requests``.
+    """
+    service = get_calendar_service()
+    size = settings.CALENDAR_BATCH_SIZE
+    results = {}
+    errors = {}
+    pending = list(requests.items())
+    attempt = 0
+    while pending:
+        if attempt:
+            time.sleep(calendar_quota.backoff(attempt - 1, settings.CALENDAR_BATCH_BACKOFF, 60))
+        retry = []
+        for offset in range(0, len(pending), size):
+            if offset:
+                time.sleep(settings.CALENDAR_BATCH_INTERVAL)
+            chunk = pending[offset:offset + size]
+            try:
+                outcomes = _execute_chunk(service, chunk)
+            except HttpError as e:
+                # The batch itself was refused; its requests never ran
+                if not calendar_quota.is_retryable(e):
+                    raise
+                outcomes = {key: e for key, _ in chunk}
+
+            chunk_results = {}
+            for key, request in chunk:
+                outcome = outcomes.get(key)
+                if not isinstance(outcome, HttpError):
+                    chunk_results[key] = outcome
+                elif outcome.resp.status in ok_statuses:
+                    chunk_results[key] = None
+                elif calendar_quota.is_retryable(outcome) and attempt < settings.CALENDAR_BATCH_MAX_RETRIES:
+                    retry.append((key, request))
+                else:
+                    errors[key] = outcome
+            results.update(chunk_results)
+            if on_results and chunk_results:
+                on_results(chunk_results)
+        if retry:
+            logger.warning("calendar.batch_retry requests=%d", len(retry))
+        pending = retry
+        attempt += 1
+    return results, errors
+
+
+def slot_templates(stadium, dates, opening_time=None, closing_time=None, slot_minutes=None):
+    """Grid slots for ``dates`` that do not overlap an existing slot.
+
+    Opening hours and slot length default to the stadium's own.
+    """
+    dates = sorted(dates)
+    if not dates:
+        return []
+    opening_time = opening_time or stadium.opening_time
+    closing_time = closing_time or stadium.closing_time
+    slot_minutes = slot_minutes or stadium.slot_minutes
+    grid = [
+        slot
+        for date in dates
+        for slot in intervals.day_grid(date, opening_time, closing_time, slot_minutes, stadium.tzinfo)
+    ]
+    if not grid:
+        return []
+    existing = Slot.objects.filter(
+        calendar_id=stadium.calendar_id,
+        start__lt=grid[-1][1],
+        end__gt=grid[0][0]
+    ).values_list('start', 'end')
+    return intervals.free(grid, existing)
+
+
+def _slot_body(event_id, start, end, time_zone):
+    return {
+        'id': event_id,
+        'summary': 'match',
+        'description': 'match',
+        'start': {'dateTime': start.isoformat(), 'timeZone': time_zone},
+        'end': {'dateTime': end.isoformat(), 'timeZone': time_zone},
+        'transparency': 'transparent'  # Show as free
+    }
+
+
+def create_slots(stadium, slots):
+    """Create match events for ``[(start, end), ...]`` and mirror them locally.
+
+    Returns ``(created, errors)`` where ``errors`` maps event IDs to the
+    HttpError that stopped them.
+    """
+    calendar_id = stadium.calendar_id
+    service = get_calendar_service()
+    bodies = {}
+    for start, end in slots:
+        event_id = event_id_for(calendar_id, start)
+        bodies[event_id] = _slot_body(event_id, start, end, stadium.time_zone)
+
+    def store(chunk_results):
+        events = [event for event in chunk_results.values() if event is not None]
+        if events:
+            apply_events(calendar_id, events)
+            slot_cache.invalidate_calendar(calendar_id)
+
+    results, errors = execute(
+        {event_id: service.events().insert(calendarId=calendar_id, body=body) for event_id, body in bodies.items()},
+        ok_statuses=(409,),
+        on_results=store
+    )
+
+    # 409: the ID exists, either from an interrupted run or as a deleted
+    # event from an earlier closure. Restore the deleted ones.
+    existing = [event_id for event_id, event in results.items() if event is None]
+    if existing:
+        fetched, fetch_errors = execute({
+            event_id: service.events().get(calendarId=calendar_id, eventId=event_id)
+            for event_id in existing
+        })
+        errors.update(fetch_errors)
+        store(fetched)
+        restored, restore_errors = execute(
+            {
+                event_id: service.events().update(
+                    calendarId=calendar_id,
+                    eventId=event_id,
+                    body=dict(bodies[event_id], status='confirmed')
+                )
+                for event_id, event in fetched.items()
+                if event.get('status') == 'cancelled'
+            },
+            on_results=store
+        )
+        errors.update(restore_errors)
+        results.update(restored)
+
+    created = sum(1 for event in results.values() if event is not None)
+    logger.info("calendar.slots_created calendar=%s created=%d errors=%d", calendar_id, created, len(errors))
+    return created, errors
+
+
+def generate_slots(stadium, start_date, days, opening_time=None, closing_time=None, slot_minutes=None):
+    """Create the stadium's grid of slots for ``days`` days from ``start_date``."""
+    dates = [start_date + timedelta(days=i) for i in range(days)]
+    return create_slots(stadium, slot_templates(stadium, dates, opening_time, closing_time, slot_minutes))
+
+
+def request_slot_generation(stadiums):
+    """Queue slot generation for ``stadiums``; the calendar worker runs it."""
+    return Stadium.objects.filter(pk__in=[stadium.pk for stadium in stadiums]).update(
+        slots_requested_at=timezone.now(),
+        slot_generation_attempts=0
+    )
+
+
+def _retry_generation(stadium, error):
+    """Queue a failed generation again with backoff, or give up on it."""
+    if isinstance(error, calendar_quota.CalendarUnavailable):
+        # Nothing was sent; wait for Google without counting an attempt
+        delay, attempts = error.retry_after, stadium.slot_generation_attempts
+    else:
+        attempts = stadium.slot_generation_attempts + 1
+        if attempts >= settings.SLOT_GENERATION_MAX_ATTEMPTS:
+            logger.error(
+                "calendar.generate_gave_up calendar=%s attempts=%d error=%s",
+                stadium.calendar_id, attempts, error
+            )
+            Stadium.objects.filter(pk=stadium.pk).update(slot_generation_attempts=0)
+            return
+        logger.warning(
+            "calendar.generate_failed calendar=%s attempt=%d error=%s",
+            stadium.calendar_id, attempts, error
+        )
+        delay = calendar_quota.backoff(
+            attempts - 1,
+            settings.SLOT_GENERATION_BACKOFF,
+            settings.SLOT_GENERATION_BACKOFF_MAX
+        )
+    Stadium.objects.filter(pk=stadium.pk).update(
+        slots_requested_at=timezone.now() + timedelta(seconds=delay),
+        slot_generation_attempts=attempts
+    )
+
+
+def generate_requested_slots():
+    """Generate slots for the coming weeks of every queued stadium that is due.
+
+    Stadiums are claimed with ``SKIP LOCKED`` so each is handled by one
+    worker. A run that fails is queued again with exponential backoff, since
+    repeating it is safe, and dropped with an error after
+    ``SLOT_GENERATION_MAX_ATTEMPTS`` tries. Returns how many slots were
+    created.
+    """
+    with transaction.atomic():
+        stadiums = list(
+            Stadium.objects.filter(slots_requested_at__lte=timezone.now()).select_for_update(skip_locked=True)
+        )
+        Stadium.objects.filter(pk__in=[stadium.pk for stadium in stadiums]).update(slots_requested_at=None)
+
+    total = 0
+    for stadium in stadiums:
+        # Tomorrow where the stadium is
+        start = timezone.now().astimezone(stadium.tzinfo).date() + timedelta(days=1)
+        try:
+            created, _ = generate_slots(stadium, start, settings.SLOT_GENERATION_WEEKS * 7)
+        except Exception as e:
+            _retry_generation(stadium, e)
+            continue
+        if stadium.slot_generation_attempts:
+            Stadium.objects.filter(pk=stadium.pk).update(slot_generation_attempts=0)
+        total += created
+    return total
+
+
+def delete_slots(calendar_id, event_ids):
+    """Delete free match events from Google, then their local slots.
+
+    The local rows stay locked while Google deletes the events, so nobody
+    books them meanwhile, and only the slots whose events are gone are
+    dropped: a failed delete leaves both copies in place. Slots that are
+    booked or have unpushed local changes are left alone. Returns
+    ``(deleted, skipped, errors)``; ``skipped`` lists the event IDs that
+    were kept.
+    """
+    event_ids = set(event_ids)
+    service = get_calendar_service()
+    with transaction.atomic():
+        local = Slot.objects.select_for_update().filter(calendar_id=calendar_id, event_id__in=event_ids)
+        skipped = set(
+            local.filter(is_booked=True).values_list('event_id', flat=True)
+        ) | set(
+            local.filter(needs_push=True).values_list('event_id', flat=True)
+        )
+        results, errors = execute(
+            {
+                event_id: service.events().delete(calendarId=calendar_id, eventId=event_id)
+                for event_id in event_ids - skipped
+            },
+            # Already gone
+            ok_statuses=(404, 410)
+        )
+        local.filter(event_id__in=list(results)).delete()
+    slot_cache.invalidate_calendar(calendar_id)
+    if errors:
+        logger.warning("calendar.delete_failed calendar=%s errors=%d", calendar_id, len(errors))
+    logger.info("calendar.slots_deleted calendar=%s deleted=%d kept=%d", calendar_id, len(results), len(skipped))
+    return len(results), sorted(skipped), errors
+
+
+def close_slots(stadium, start, end):
+    """Delete the stadium's free match slots between ``start`` and ``end``.
+
+    The remote calendar is listed, so a closure also catches slots that have
+    not been synced yet. Booked slots are kept and reported in ``skipped``.
+    """
+    service = get_calendar_service()
+    event_ids = []
+    booked = []
+    page_token = None
+    while True:
+        result = service.events().list(
+            calendarId=stadium.calendar_id,
+            timeMin=start.isoformat(),
+            timeMax=end.isoformat(),
+            singleEvents=True,
+            maxResults=250,
+            pageToken=page_token
+        ).execute()
+        for event in result.get('items', []):
+            if not is_match_event(event):
+                continue
+            if slot_fields(event)['is_booked']:
+                booked.append(event['id'])
+            else:
+                event_ids.append(event['id'])
+        page_token = result.get('nextPageToken')
+        if not page_token:
+            break
+
+    deleted, skipped, errors = delete_slots(stadium.calendar_id, event_ids)
+    return deleted, sorted(set(skipped) | set(booked)), errors
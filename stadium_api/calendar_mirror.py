@@ -0,0 +1,324 @@
+"""Push side of the mirror between the local Slot/Booking tables and Google.
+
+Bookings are written to the database first. The calendar worker
+(``manage.py run_calendar_worker``) then pushes dirty slots to their Google
+events, which turns ``pending`` bookings into ``booked`` ones. The dirty
+slots form the work queue: a worker claims a batch with
+``SELECT ... FOR UPDATE SKIP LOCKED`` and leases it for ``PUSH_LEASE``
+seconds, so several workers can run side by side. Failed pushes are retried
+with exponential backoff, and a pending booking whose push keeps failing is
+marked ``failed`` after ``CALENDAR_PUSH_MAX_ATTEMPTS`` tries. While
+``calendar_quota`` reports Google as unavailable, slots are put back without
+using up an attempt. Pulling remote
+changes back is handled by ``calendar_sync``.
+"""
+import asyncio
+import logging
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+from googleapiclient.errors import HttpError
+
+from . import calendar_quota, slot_cache
+from .google_client import get_async_client, get_calendar_service
+from .models import Booking, CalendarSyncState, Slot
+
+logger = logging.getLogger(__name__)
+
+BOOKED_SUMMARY = '🏟️ BOOKED MATCH'
+PUSH_LEASE = 60  # seconds a claimed slot is hidden from other workers
+
+
+def parse_event_time(value):
+    """Return an aware datetime for an event's ``start``/``end`` dict."""
+    raw = value.get('dateTime') or value.get('date')
+    parsed = datetime.fromisoformat(raw.replace('Z', '+00:00'))
+    if timezone.is_naive(parsed):
+        # All-day events only carry a date
+        parsed = timezone.make_aware(parsed)
+    return parsed
+
+
+def private_properties(event):
+    return event.get('extendedProperties', {}).get('private', {})
+
+
+def is_match_event(event):
+    """True for bookable slots: free 'match' events and ones already booked."""
+    return (
+        'match' in event.get('description', '').lower()
+        or BOOKED_SUMMARY in event.get('summary', '')
+        or bool(private_properties(event).get('user_id'))
+    )
+
+
+def slot_fields(event):
+    """Map a remote event onto the Slot columns it owns."""
+    private = private_properties(event)
+    is_booked = bool(private.get('user_id')) or BOOKED_SUMMARY in event.get('summary', '')
+    return {
+        'start': parse_event_time(event['start']),
+        'end': parse_event_time(event['end']),
+        'is_booked': is_booked,
+        'original_color': private.get('original_color', '0') if is_booked else event.get('colorId', '0'),
+        'etag': event.get('etag', ''),
+    }
+
+
+def _booked_body(event, slot, booking):
+    booking_time = booking.created_at.astimezone(dt_timezone.utc)
+    event['extendedProperties'] = event.get('extendedProperties', {})
+    event['extendedProperties']['private'] = {
+        'user_id': str(booking.user_id),
+        'booking_time': booking_time.strftime('%Y-%m-%dT%H:%M:%S.%fZ'),
+        'user_name': booking.user_name,
+        'user_phone': booking.user_phone,
+        'original_color': slot.original_color
+    }
+    event.update({
+        'summary': BOOKED_SUMMARY,
+        'description': (
+            f"📋 BOOKING DETAILS\n"
+            f"───────────────\n"
+            f"👤 Name: {booking.user_name}\n"
+            f"📱 Phone: {booking.user_phone}\n"
+            f"🆔 User ID: {booking.user_id}\n"
+            f"⏰ Booked on: {booking_time:%Y-%m-%d %H:%M:%S} UTC"
+        ),
+        'colorId': '2',  # Green color for booked events
+        'transparency': 'opaque'  # Show as busy
+    })
+    return event
+
+
+def _free_body(event, slot):
+    event.update({
+        'summary': 'match',
+        'description': 'match',
+        'colorId': slot.original_color,
+        'transparency': 'transparent'  # Show as free
+    })
+    event['extendedProperties'] = event.get('extendedProperties', {})
+    event['extendedProperties']['private'] = {}
+    return event
+
+
+class PushConflict(Exception):
+    """The Google event was booked by someone else before our write landed."""
+
+
+def _update_body(slot, event):
+    """Return the body to write to ``event`` for the slot's local state.
+
+    Returns None when there is nothing to write, and raises
+    ``PushConflict`` if the event already belongs to another user.
+    """
+    booking = slot.bookings.filter(status__in=Booking.ACTIVE_STATUSES).first()
+    remote_user_id = private_properties(event).get('user_id')
+    if booking is not None:
+        if remote_user_id and remote_user_id != str(booking.user_id):
+            raise PushConflict(f"event {slot.event_id} is already booked by user {remote_user_id}")
+        return _booked_body(event, slot, booking)
+    if slot.is_booked:
+        # Booked remotely by someone we have no account for; nothing to write.
+        return None
+    return _free_body(event, slot)
+
+
+def _precondition_failed(error):
+    return isinstance(error, HttpError) and error.resp.status == 412
+
+
+def push_slot(slot):
+    """Write a slot's local booking state to its Google event.
+
+    The update carries the slot's stored ``etag`` in ``If-Match`` (or the
+    fetched event's, if none was stored yet), so an event edited on Google
+    since our last sync fails with HTTP 412 instead of being overwritten.
+    On a 412 the event is fetched again, checked for a conflicting booking
+    and written once more against its new etag; a second 412 is left to the
+    worker's retries. Raises ``PushConflict`` if the event already belongs
+    to another user.
+    """
+    service = get_calendar_service()
+    event = service.events().get(calendarId=slot.calendar_id, eventId=slot.event_id).execute()
+    etag = slot.etag or event['etag']
+    for attempt in range(2):
+        body = _update_body(slot, event)
+        if body is None:
+            return event
+        request = service.events().update(
+            calendarId=slot.calendar_id,
+            eventId=slot.event_id,
+            body=body
+        )
+        request.headers['If-Match'] = etag
+        try:
+            return request.execute()
+        except HttpError as e:
+            if attempt or not _precondition_failed(e):
+                raise
+        logger.info("calendar.push_resync slot=%s", slot.pk)
+        event = service.events().get(calendarId=slot.calendar_id, eventId=slot.event_id).execute()
+        etag = event['etag']
+
+
+async def async_push_slot(slot):
+    """``push_slot`` over the async Calendar client."""
+    client = get_async_client()
+    event = await client.get_event(slot.calendar_id, slot.event_id)
+    etag = slot.etag or event['etag']
+    for attempt in range(2):
+        body = await sync_to_async(_update_body)(slot, event)
+        if body is None:
+            return event
+        try:
+            return await client.update_event(slot.calendar_id, slot.event_id, body, etag=etag)
+        except HttpError as e:
+            if attempt or not _precondition_failed(e):
+                raise
+        logger.info("calendar.push_resync slot=%s", slot.pk)
+        event = await client.get_event(slot.calendar_id, slot.event_id)
+        etag = event['etag']
+
+
+def _resolve_conflict(slot, version, error):
+    """Give a contested slot to the remote booking and fail ours."""
+    now = timezone.now()
+    with transaction.atomic():
+        if not Slot.objects.filter(pk=slot.pk, version=version).update(
+            is_booked=True,
+            needs_push=False,
+            push_attempts=0,
+            next_attempt_at=None,
+            last_push_error=str(error),
+            synced_at=now
+        ):
+            # Changed locally while we were pushing; look again next pass.
+            return
+        Booking.objects.filter(slot=slot, status__in=Booking.ACTIVE_STATUSES).update(
+            status='failed',
+            failure_reason='conflict',
+            cancelled_at=now,
+            synced_at=now
+        )
+    # Let the next sync pull the remote booking and its etag.
+    CalendarSyncState.objects.filter(calendar_id=slot.calendar_id).update(last_synced_at=None)
+    slot_cache.invalidate_calendar(slot.calendar_id)
+
+
+def _record_failure(slot, version, error):
+    """Schedule a retry with exponential backoff, or give up on a pending booking."""
+    now = timezone.now()
+    attempts = slot.push_attempts + 1
+    with transaction.atomic():
+        if (
+            attempts >= settings.CALENDAR_PUSH_MAX_ATTEMPTS
+            and slot.bookings.filter(status='pending').exists()
+        ):
+            # Nothing reached Google, so release the slot locally as well.
+            if Slot.objects.filter(pk=slot.pk, version=version).update(
+                is_booked=False,
+                needs_push=False,
+                push_attempts=attempts,
+                next_attempt_at=None,
+                last_push_error=str(error)
+            ):
+                Booking.objects.filter(slot=slot, status='pending').update(
+                    status='failed',
+                    failure_reason='unavailable',
+                    cancelled_at=now
+                )
+                slot_cache.invalidate_calendar(slot.calendar_id)
+            return
+        delay = calendar_quota.backoff(
+            attempts - 1,
+            settings.CALENDAR_PUSH_BACKOFF,
+            settings.CALENDAR_PUSH_BACKOFF_MAX
+        )
+        Slot.objects.filter(pk=slot.pk, version=version).update(
+            push_attempts=attempts,
+            next_attempt_at=now + timedelta(seconds=delay),
+            last_push_error=str(error)
+        )
+
+
+def claim_pending(limit=50, slot_ids=None):
+    """Lease up to ``limit`` due dirty slots to this worker and return them."""
+    now = timezone.now()
+    due = Slot.objects.filter(needs_push=True).filter(
+        Q(next_attempt_at__isnull=True) | Q(next_attempt_at__lte=now)
+    )
+    if slot_ids is not None:
+        due = due.filter(pk__in=slot_ids)
+    with transaction.atomic():
+        slots = list(due.select_for_update(skip_locked=True).order_by('updated_at')[:limit])
+        Slot.objects.filter(pk__in=[slot.pk for slot in slots]).update(
+            next_attempt_at=now + timedelta(seconds=PUSH_LEASE)
+        )
+    return slots
+
+
+def _record_push(slot, version, outcome):
+    """Store the outcome of pushing ``slot``: the updated event or the error.
+
+    Returns 1 if the push succeeded, else 0.
+    """
+    if isinstance(outcome, PushConflict):
+        logger.warning("calendar.push_conflict slot=%s error=%s", slot.pk, outcome)
+        _resolve_conflict(slot, version, outcome)
+        return 0
+    if isinstance(outcome, calendar_quota.CalendarUnavailable):
+        # Nothing was sent; wait for Google without counting an attempt
+        Slot.objects.filter(pk=slot.pk, version=version).update(
+            next_attempt_at=timezone.now() + timedelta(seconds=outcome.retry_after)
+        )
+        return 0
+    if isinstance(outcome, BaseException):
+        logger.warning("calendar.push_failed slot=%s attempt=%s error=%s", slot.pk, slot.push_attempts + 1, outcome)
+        _record_failure(slot, version, outcome)
+        return 0
+
+    now = timezone.now()
+    with transaction.atomic():
+        # Keep the flag if the slot changed again while we were pushing.
+        if Slot.objects.filter(pk=slot.pk, version=version).update(
+            needs_push=False,
+            push_attempts=0,
+            next_attempt_at=None,
+            last_push_error='',
+            etag=outcome.get('etag', ''),
+            synced_at=now
+        ):
+            Booking.objects.filter(slot=slot, status='pending').update(status='booked')
+            Booking.objects.filter(slot=slot, synced_at__isnull=True).update(synced_at=now)
+    return 1
+
+
+def push_pending(limit=50, slot_ids=None):
+    """Push up to ``limit`` due dirty slots to Google and return how many succeeded.
+
+    ``slot_ids`` restricts the push to those slots.
+    """
+    pushed = 0
+    for slot in claim_pending(limit, slot_ids):
+        try:
+            outcome = push_slot(slot)
+        except Exception as e:
+            outcome = e
+        pushed += _record_push(slot, slot.version, outcome)
+    return pushed
+
+
+async def async_push_pending(limit=50, slot_ids=None):
+    """``push_pending`` for async code; the slots are pushed concurrently."""
+    slots = await sync_to_async(claim_pending)(limit, slot_ids)
+    outcomes = await asyncio.gather(*(async_push_slot(slot) for slot in slots), return_exceptions=True)
+    pushed = 0
+    for slot, outcome in zip(slots, outcomes):
+        pushed += await sync_to_async(_record_push)(slot, slot.version, outcome)
+    return pushed
@@ -0,0 +1,231 @@
+"""Rate limiting, retries and a circuit breaker for Google Calendar calls.
+
+Every request to Google goes through ``call()`` (or ``acall()`` from async
+code). State lives in the shared Django cache, so all workers see the same
+limits.
+
+* Rate limits: requests are counted in fixed one-second windows, at most
+  ``GOOGLE_CALENDAR_QPS`` for the whole project and
+  ``GOOGLE_CALENDAR_CALENDAR_QPS`` per calendar. A call only counts once
+  both limits have room; otherwise it waits for the next window, or gives up
+  with ``CalendarUnavailable`` after ``GOOGLE_CALENDAR_QUOTA_WAIT`` seconds.
+* Retries: quota errors (429, 403 rate and quota limits), 5xx responses and network
+  errors are retried with exponential backoff and jitter.
+* Circuit breaker: ``GOOGLE_CALENDAR_BREAKER_THRESHOLD`` failed calls within
+  ``GOOGLE_CALENDAR_BREAKER_WINDOW`` seconds open the breaker. While it is
+  open, calls fail at once with ``CalendarUnavailable`` and readers keep
+  serving the local mirror and cached slots. After
+  ``GOOGLE_CALENDAR_BREAKER_COOLDOWN`` seconds one probe call is let
+  through, and its outcome closes or reopens the breaker.
+"""
+import asyncio
+import hashlib
+import logging
+import random
+import time
+
+import httplib2
+import httpx
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from googleapiclient.errors import HttpError
+
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+BREAKER_KEY = 'gcal:breaker'
+FAILURES_KEY = 'gcal:breaker:failures'
+PROBE_KEY = 'gcal:breaker:probe'
+RATE_LIMIT_REASONS = (b'rateLimitExceeded', b'userRateLimitExceeded', b'quotaExceeded', b'dailyLimitExceeded')
+
+
+class CalendarUnavailable(Exception):
+    """Google Calendar is rate limited or degraded; try again in ``retry_after`` seconds."""
+
+    def __init__(self, retry_after):
+        super().__init__(f'Google Calendar is unavailable, retry in {retry_after:.0f}s')
+        self.retry_after = retry_after
+
+
+def is_retryable(error):
+    """True for quota errors, server errors and network failures."""
+    if isinstance(error, HttpError):
+        status = error.resp.status
+        if status == 429 or status >= 500:
+            return True
+        return status == 403 and any(reason in (error.content or b'') for reason in RATE_LIMIT_REASONS)
+    return isinstance(error, (OSError, httplib2.HttpLib2Error, httpx.TransportError))
+
+
+def backoff(attempt, base, cap):
+    """Exponential backoff for retry ``attempt`` (0-based), with jitter.
+
+    Half the delay is fixed and half random, so retries from many workers
+    spread out without ever coming back immediately.
+    """
+    delay = min(base * 2 ** attempt, cap)
+    return delay / 2 + random.uniform(0, delay / 2)
+
+
+def _take(scope, cost, rate):
+    """Count ``cost`` requests in the current window of ``scope``.
+
+    Returns the window's cache key and 0, or the seconds to wait for the
+    next window; a refused request is not counted.
+    """
+    now = time.time()
+    window = int(now)
+    key = f'gcal:window:{scope}:{window}'
+    cache.add(key, 0, timeout=2)
+    try:
+        used = cache.incr(key, cost)
+    except ValueError:
+        # Expired between add() and incr()
+        cache.set(key, cost, timeout=2)
+        used = cost
+    # A call costing more than a whole window's requests only fits an empty window
+    if used <= rate or used == cost:
+        return key, 0
+    _give_back(key, cost)
+    return key, window + 1 - now
+
+
+def _give_back(key, cost):
+    try:
+        cache.decr(key, cost)
+    except ValueError:
+        # The window is over anyway
+        pass
+
+
+def _try_acquire(calendar_id, cost):
+    """Count a call against both limits; returns 0 or the seconds to wait."""
+    project_key, wait = _take('project', cost, settings.GOOGLE_CALENDAR_QPS)
+    if wait or not calendar_id:
+        return wait
+    scope = hashlib.md5(calendar_id.encode()).hexdigest()
+    _, wait = _take(scope, cost, settings.GOOGLE_CALENDAR_CALENDAR_QPS)
+    if wait:
+        # The call waits, so it must not hold on to the project's share either
+        _give_back(project_key, cost)
+    return wait
+
+
+def _check_breaker():
+    """Raise CalendarUnavailable if the breaker is open.
+
+    Returns True when this caller is the probe after a cooldown.
+    """
+    state = cache.get(BREAKER_KEY)
+    if state is None:
+        return False
+    remaining = state['until'] - time.time()
+    if remaining > 0:
+        raise CalendarUnavailable(remaining)
+    if not cache.add(PROBE_KEY, 1, timeout=settings.GOOGLE_CALENDAR_HTTP_TIMEOUT + 5):
+        # Another caller is already probing
+        raise CalendarUnavailable(1)
+    return True
+
+
+def _record_success(probe):
+    if probe:
+        cache.delete_many([BREAKER_KEY, FAILURES_KEY, PROBE_KEY])
+        logger.info("google.circuit_closed")
+
+
+def _record_failure(probe, error):
+    cache.add(FAILURES_KEY, 0, timeout=settings.GOOGLE_CALENDAR_BREAKER_WINDOW)
+    try:
+        failures = cache.incr(FAILURES_KEY)
+    except ValueError:
+        failures = 1
+    if probe or failures >= settings.GOOGLE_CALENDAR_BREAKER_THRESHOLD:
+        cooldown = settings.GOOGLE_CALENDAR_BREAKER_COOLDOWN
+        cache.set(BREAKER_KEY, {'until': time.time() + cooldown}, timeout=None)
+        cache.delete_many([FAILURES_KEY, PROBE_KEY])
+        logger.error("google.circuit_open cooldown=%s error=%s", cooldown, error)
+
+
+def breaker_remaining():
+    """Seconds the breaker keeps calls away from Google; 0 while it is closed."""
+    state = cache.get(BREAKER_KEY)
+    return max(state['until'] - time.time(), 0) if state is not None else 0
+
+
+def breaker_open():
+    """True while the breaker keeps calls away from Google."""
+    return breaker_remaining() > 0
+
+
+def call(calendar_id, func, cost=1):
+    """Run ``func()`` against Google within the quota and breaker.
+
+    ``calendar_id`` selects the per-calendar limit (None for calls that are
+    not about one calendar); ``cost`` is how many requests ``func`` makes.
+    """
+    probe = _check_breaker()
+    attempt = 0
+    while True:
+        deadline = time.monotonic() + settings.GOOGLE_CALENDAR_QUOTA_WAIT
+        while True:
+            wait = _try_acquire(calendar_id, cost)
+            if not wait:
+                break
+            if time.monotonic() + wait > deadline:
+                raise CalendarUnavailable(wait)
+            time.sleep(wait + random.uniform(0, 0.1))
+
+        try:
+            with metrics.span('google'):
+                result = func()
+        except Exception as e:
+            if not is_retryable(e):
+                # Google answered; the request itself was wrong
+                _record_success(probe)
+                raise
+            if not probe and attempt < settings.GOOGLE_CALENDAR_MAX_RETRIES:
+                delay = backoff(attempt, settings.GOOGLE_CALENDAR_RETRY_BACKOFF, settings.GOOGLE_CALENDAR_RETRY_BACKOFF_MAX)
+                logger.warning("google.call_retry delay=%.1f error=%s", delay, e)
+                time.sleep(delay)
+                attempt += 1
+                continue
+            _record_failure(probe, e)
+            raise
+        _record_success(probe)
+        return result
+
+
+async def acall(calendar_id, func, cost=1):
+    """``call`` for async code; ``func()`` returns an awaitable."""
+    probe = await sync_to_async(_check_breaker, thread_sensitive=False)()
+    attempt = 0
+    while True:
+        deadline = time.monotonic() + settings.GOOGLE_CALENDAR_QUOTA_WAIT
+        while True:
+            wait = await sync_to_async(_try_acquire, thread_sensitive=False)(calendar_id, cost)
+            if not wait:
+                break
+            if time.monotonic() + wait > deadline:
+                raise CalendarUnavailable(wait)
+            await asyncio.sleep(wait + random.uniform(0, 0.1))
+
+        try:
+            with metrics.span('google'):
+                result = await func()
+        except Exception as e:
+            if not is_retryable(e):
+                await sync_to_async(_record_success, thread_sensitive=False)(probe)
+                raise
+            if not probe and attempt < settings.GOOGLE_CALENDAR_MAX_RETRIES:
+                delay = backoff(attempt, settings.GOOGLE_CALENDAR_RETRY_BACKOFF, settings.GOOGLE_CALENDAR_RETRY_BACKOFF_MAX)
+                logger.warning("google.call_retry delay=%.1f error=%s", delay, e)
+                await asyncio.sleep(delay)
+                attempt += 1
+                continue
+            await sync_to_async(_record_failure, thread_sensitive=False)(probe, e)
+            raise
+        await sync_to_async(_record_success, thread_sensitive=False)(probe)
+        return result
@@ -0,0 +1,494 @@
+"""Incremental Google Calendar sync using ``nextSyncToken``.
+
+The first sync of a calendar lists every event and stores the
+``nextSyncToken`` Google returns with the last page; later syncs send that
+token back and only receive the events changed since, deletions included.
+When Google expires a token (HTTP 410) the calendar is fully resynced.
+Changes are upserted into the Slot and Booking tables in bulk.
+
+Run it with ``manage.py sync_calendars`` (e.g. from cron); the calendar
+worker also calls ``sync_all()`` on its pull interval. The ``async_*``
+variants serve the async views and fetch through the async Calendar client.
+"""
+import asyncio
+import contextvars
+import hashlib
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait
+from datetime import timedelta
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import connections, transaction
+from django.utils import timezone
+from googleapiclient.errors import HttpError
+
+from . import slot_cache
+from .calendar_mirror import is_match_event, private_properties, slot_fields
+from .google_client import get_async_client, get_calendar_service
+from .models import Booking, CalendarSyncState, Slot
+from .stadiums import active_stadiums
+
+logger = logging.getLogger(__name__)
+
+SLOT_SYNC_FIELDS = ['start', 'end', 'is_booked', 'original_color', 'etag', 'updated_at']
+SYNC_LOCK_TIMEOUT = 60  # seconds
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _event_list_params(calendar_id, sync_token=None):
+    params = {
+        'calendarId': calendar_id,
+        'singleEvents': True,
+        'maxResults': 2500,
+    }
+    if sync_token:
+        params['syncToken'] = sync_token
+    return params
+
+
+def _user_event_params(calendar_id, user_id, horizon_days=None):
+    if horizon_days is None:
+        horizon_days = settings.BOOKINGS_HORIZON_DAYS
+    now = timezone.now()
+    return {
+        'calendarId': calendar_id,
+        'privateExtendedProperty': f'user_id={user_id}',
+        'timeMin': now.isoformat(),
+        'timeMax': (now + timedelta(days=horizon_days)).isoformat(),
+        'singleEvents': True,
+        'orderBy': 'startTime',
+        'maxResults': 250,
+    }
+
+
+def fetch_events(calendar_id, sync_token=None):
+    """List a calendar's events, or only those changed since ``sync_token``.
+
+    Follows ``nextPageToken`` and returns ``(events, next_sync_token)``.
+    """
+    service = get_calendar_service()
+    params = _event_list_params(calendar_id, sync_token)
+    events = []
+    page_token = None
+    while True:
+        result = service.events().list(pageToken=page_token, **params).execute()
+        events.extend(result.get('items', []))
+        page_token = result.get('nextPageToken')
+        if not page_token:
+            return events, result.get('nextSyncToken')
+
+
+def fetch_user_events(calendar_id, user_id, horizon_days=None):
+    """List a user's upcoming bookings in a calendar, filtered by Google.
+
+    The ``user_id`` private extended property written on booking lets the API
+    do the filtering, and ``timeMax`` bounds the scan to the bookings horizon.
+    """
+    service = get_calendar_service()
+    params = _user_event_params(calendar_id, user_id, horizon_days)
+    events = []
+    page_token = None
+    while True:
+        result = service.events().list(pageToken=page_token, **params).execute()
+        events.extend(result.get('items', []))
+        page_token = result.get('nextPageToken')
+        if not page_token:
+            return events
+
+
+async def _async_list_events(params):
+    params = dict(params)
+    calendar_id = params.pop('calendarId')
+    return await get_async_client().list_events(calendar_id, params)
+
+
+def _reconcile_bookings(calendar_id, remote_private):
+    """Mirror bookings made or cleared directly in Google into Booking rows."""
+    if not remote_private:
+        return
+    slot_ids = dict(
+        Slot.objects.filter(calendar_id=calendar_id, event_id__in=list(remote_private))
+        .values_list('event_id', 'pk')
+    )
+    active = {
+        booking.slot_id: booking
+        for booking in Booking.objects.filter(
+            slot_id__in=slot_ids.values(),
+            status__in=Booking.ACTIVE_STATUSES
+        )
+    }
+    remote_user_ids = {
+        int(private['user_id'])
+        for private in remote_private.values()
+        if str(private.get('user_id', '')).isdigit()
+    }
+    known_users = set(User.objects.filter(pk__in=remote_user_ids).values_list('pk', flat=True))
+
+    now = timezone.now()
+    cancelled = []
+    created = []
+    for event_id, private in remote_private.items():
+        slot_id = slot_ids.get(event_id)
+        if slot_id is None:
+            continue
+        remote_user_id = str(private.get('user_id', ''))
+        booking = active.get(slot_id)
+        if booking is not None and str(booking.user_id) == remote_user_id:
+            continue
+        if booking is not None:
+            booking.status = 'cancelled'
+            booking.cancelled_at = now
+            booking.synced_at = now
+            cancelled.append(booking)
+        if remote_user_id.isdigit() and int(remote_user_id) in known_users:
+            created.append(Booking(
+                slot_id=slot_id,
+                user_id=int(remote_user_id),
+                status='booked',
+                user_name=private.get('user_name', ''),
+                user_phone=private.get('user_phone', ''),
+                synced_at=now
+            ))
+    Booking.objects.bulk_update(cancelled, ['status', 'cancelled_at', 'synced_at'])
+    Booking.objects.bulk_create(created)
+
+
+def apply_events(calendar_id, events, full=False):
+    """Upsert remote events into the local tables and return how many changed.
+
+    Slots with local changes that the worker has not pushed yet keep their
+    local state. After a ``full`` listing, local slots missing from it are
+    removed. Live bookings of removed slots are cancelled, and all bookings
+    stay behind without their slot.
+    """
+    upserts = {}
+    removed = set()
+    for event in events:
+        if event.get('status') == 'cancelled' or not is_match_event(event):
+            removed.add(event['id'])
+        else:
+            upserts[event['id']] = event
+
+    with transaction.atomic():
+        locked = Slot.objects.select_for_update().filter(calendar_id=calendar_id)
+        if not full:
+            locked = locked.filter(event_id__in=list(upserts) + list(removed))
+        existing = dict(locked.values_list('event_id', 'needs_push'))
+        dirty = {event_id for event_id, needs_push in existing.items() if needs_push}
+
+        slots = [
+            Slot(calendar_id=calendar_id, event_id=event_id, **slot_fields(event))
+            for event_id, event in upserts.items()
+            if event_id not in dirty
+        ]
+        Slot.objects.bulk_create(
+            slots,
+            update_conflicts=True,
+            unique_fields=['calendar_id', 'event_id'],
+            update_fields=SLOT_SYNC_FIELDS,
+            batch_size=500
+        )
+
+        if full:
+            removed = set(existing) - set(upserts)
+        removed = (removed & set(existing)) - dirty
+        if removed:
+            gone = Slot.objects.filter(calendar_id=calendar_id, event_id__in=list(removed))
+            now = timezone.now()
+            Booking.objects.filter(slot__in=gone, status__in=Booking.ACTIVE_STATUSES).update(
+                status='cancelled',
+                cancelled_at=now,
+                synced_at=now
+            )
+            gone.delete()
+
+        _reconcile_bookings(calendar_id, {
+            event_id: private_properties(event)
+            for event_id, event in upserts.items()
+            if event_id not in dirty
+        })
+    return len(slots) + len(removed)
+
+
+def _begin_sync(calendar_id, full):
+    state, _ = CalendarSyncState.objects.get_or_create(calendar_id=calendar_id)
+    return state, None if full else state.sync_token
+
+
+def _finish_sync(calendar_id, state, events, sync_token, next_sync_token):
+    changed = apply_events(calendar_id, events, full=not sync_token)
+
+    state.sync_token = next_sync_token or ''
+    state.last_synced_at = timezone.now()
+    if not sync_token:
+        state.last_full_sync_at = state.last_synced_at
+    state.save()
+
+    if changed:
+        slot_cache.invalidate_calendar(calendar_id)
+    return changed
+
+
+def sync_calendar(calendar_id, full=False):
+    """Bring one calendar's local slots up to date and return how many changed."""
+    state, sync_token = _begin_sync(calendar_id, full)
+    try:
+        events, next_sync_token = fetch_events(calendar_id, sync_token)
+    except HttpError as e:
+        if not sync_token or e.resp.status != 410:
+            raise
+        logger.info("calendar.sync_token_expired calendar=%s", calendar_id)
+        sync_token = None
+        events, next_sync_token = fetch_events(calendar_id)
+    return _finish_sync(calendar_id, state, events, sync_token, next_sync_token)
+
+
+async def async_sync_calendar(calendar_id, full=False):
+    """``sync_calendar`` for async code, fetching through the async client."""
+    state, sync_token = await sync_to_async(_begin_sync)(calendar_id, full)
+    try:
+        events, next_sync_token = await _async_list_events(_event_list_params(calendar_id, sync_token))
+    except HttpError as e:
+        if not sync_token or e.resp.status != 410:
+            raise
+        logger.info("calendar.sync_token_expired calendar=%s", calendar_id)
+        sync_token = None
+        events, next_sync_token = await _async_list_events(_event_list_params(calendar_id))
+    return await sync_to_async(_finish_sync)(calendar_id, state, events, sync_token, next_sync_token)
+
+
+def _is_fresh(calendar_id, max_age):
+    if max_age is None:
+        max_age = settings.CALENDAR_SYNC_MAX_AGE
+    last_synced_at = CalendarSyncState.objects.filter(
+        calendar_id=calendar_id
+    ).values_list('last_synced_at', flat=True).first()
+    return bool(last_synced_at) and (timezone.now() - last_synced_at).total_seconds() < max_age
+
+
+def _sync_lock_key(calendar_id):
+    return f'calendar-sync:{hashlib.md5(calendar_id.encode()).hexdigest()}'
+
+
+def sync_locked(calendar_id, full=False):
+    """``sync_calendar`` unless another caller is syncing the calendar.
+
+    Web requests and the calendar worker share the lock, so a calendar is
+    only ever synced by one of them at a time. Returns None when the lock
+    was taken, else how many slots changed.
+    """
+    lock_key = _sync_lock_key(calendar_id)
+    if not cache.add(lock_key, 1, timeout=SYNC_LOCK_TIMEOUT):
+        return None
+    try:
+        return sync_calendar(calendar_id, full=full)
+    finally:
+        cache.delete(lock_key)
+
+
+def sync_if_stale(calendar_id, max_age=None):
+    """Sync a calendar whose last sync is older than ``max_age`` seconds.
+
+    Only one caller at a time syncs a given calendar; concurrent callers
+    return straight away and read whatever is already stored locally.
+    """
+    if _is_fresh(calendar_id, max_age):
+        return 0
+    return sync_locked(calendar_id) or 0
+
+
+async def async_sync_if_stale(calendar_id, max_age=None):
+    """``sync_if_stale`` for async code."""
+    if await sync_to_async(_is_fresh)(calendar_id, max_age):
+        return 0
+
+    lock_key = _sync_lock_key(calendar_id)
+    if not await cache.aadd(lock_key, 1, timeout=SYNC_LOCK_TIMEOUT):
+        return 0
+    try:
+        return await async_sync_calendar(calendar_id)
+    finally:
+        await cache.adelete(lock_key)
+
+
+def _get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=settings.CALENDAR_FANOUT_WORKERS,
+                thread_name_prefix='calendar-sync'
+            )
+        return _executor
+
+
+def _sync_in_thread(calendar_id, user_id):
+    try:
+        if user_id is not None:
+            return refresh_for_user(calendar_id, user_id)
+        return sync_if_stale(calendar_id)
+    finally:
+        # Pool threads must not keep their own database connections open.
+        connections.close_all()
+
+
+def _sync_errors(futures, done):
+    errors = {}
+    for future, calendar_id in futures.items():
+        if future not in done:
+            errors[calendar_id] = 'timeout'
+        elif future.exception() is not None:
+            logger.warning("calendar.sync_failed calendar=%s error=%s", calendar_id, future.exception())
+            errors[calendar_id] = 'unavailable'
+        else:
+            errors[calendar_id] = None
+    return errors
+
+
+def sync_many_if_stale(calendar_ids, timeout=None, user_id=None):
+    """Run ``sync_if_stale`` for several calendars concurrently.
+
+    With ``user_id`` each calendar is refreshed with ``refresh_for_user``
+    instead.
+
+    Returns ``{calendar_id: error}`` where ``error`` is None on success,
+    'unavailable' if the sync failed, or 'timeout' if it was still running
+    after ``timeout`` seconds (it carries on in the background).
+    """
+    if timeout is None:
+        timeout = settings.CALENDAR_FANOUT_TIMEOUT
+    executor = _get_executor()
+    # Copy the context so the request's timing spans see the Google calls
+    futures = {
+        executor.submit(contextvars.copy_context().run, _sync_in_thread, calendar_id, user_id): calendar_id
+        for calendar_id in calendar_ids
+    }
+    done, _ = wait(futures, timeout=timeout)
+    return _sync_errors(futures, done)
+
+
+async def async_sync_many_if_stale(calendar_ids, timeout=None, user_id=None):
+    """``sync_many_if_stale`` as tasks on the running event loop."""
+    if timeout is None:
+        timeout = settings.CALENDAR_FANOUT_TIMEOUT
+    if not calendar_ids:
+        return {}
+    futures = {
+        asyncio.ensure_future(
+            async_refresh_for_user(calendar_id, user_id) if user_id is not None
+            else async_sync_if_stale(calendar_id)
+        ): calendar_id
+        for calendar_id in calendar_ids
+    }
+    done, _ = await asyncio.wait(futures, timeout=timeout)
+    return _sync_errors(futures, done)
+
+
+def _store_user_events(calendar_id, events):
+    changed = apply_events(calendar_id, events)
+    if changed:
+        slot_cache.invalidate_calendar(calendar_id)
+    return changed
+
+
+def sync_user_bookings(calendar_id, user_id):
+    """Import one user's upcoming bookings from a calendar."""
+    return _store_user_events(calendar_id, fetch_user_events(calendar_id, user_id))
+
+
+def _has_sync_token(calendar_id):
+    return CalendarSyncState.objects.filter(
+        calendar_id=calendar_id
+    ).exclude(sync_token='').exists()
+
+
+def _user_sync_key(calendar_id, user_id):
+    return f'calendar-user-sync:{hashlib.md5(calendar_id.encode()).hexdigest()}:{user_id}'
+
+
+def _user_sync_timeout(max_age):
+    return settings.CALENDAR_SYNC_MAX_AGE if max_age is None else max_age
+
+
+def refresh_for_user(calendar_id, user_id, max_age=None):
+    """Refresh what a user's bookings page needs from one calendar.
+
+    Calendars that already have a sync token get a cheap incremental sync.
+    A calendar that was never fully synced would need a full download first,
+    so only the user's own upcoming events are fetched and the full sync is
+    left to the calendar worker. Either way Google is asked at most once
+    per ``max_age`` seconds: such a calendar has no ``last_synced_at`` to go
+    by, so a cache entry per user marks the last fetch and also keeps
+    concurrent requests from repeating it.
+    """
+    if _has_sync_token(calendar_id):
+        return sync_if_stale(calendar_id, max_age)
+
+    key = _user_sync_key(calendar_id, user_id)
+    if not cache.add(key, 1, timeout=_user_sync_timeout(max_age)):
+        return 0
+    try:
+        return sync_user_bookings(calendar_id, user_id)
+    except Exception:
+        # Let the next request try again
+        cache.delete(key)
+        raise
+
+
+async def async_refresh_for_user(calendar_id, user_id, max_age=None):
+    """``refresh_for_user`` for async code."""
+    if await sync_to_async(_has_sync_token)(calendar_id):
+        return await async_sync_if_stale(calendar_id, max_age)
+
+    key = _user_sync_key(calendar_id, user_id)
+    if not await cache.aadd(key, 1, timeout=_user_sync_timeout(max_age)):
+        return 0
+    try:
+        events, _ = await _async_list_events(_user_event_params(calendar_id, user_id))
+        return await sync_to_async(_store_user_events)(calendar_id, events)
+    except Exception:
+        await cache.adelete(key)
+        raise
+
+
+def mark_stale(calendar_id):
+    """Flag a calendar for an incremental sync and drop its cached slots."""
+    CalendarSyncState.objects.filter(calendar_id=calendar_id).update(last_synced_at=None)
+    slot_cache.invalidate_calendar(calendar_id)
+
+
+def sync_notified():
+    """Sync the calendars flagged by ``mark_stale`` since their last sync."""
+    changed = 0
+    flagged = CalendarSyncState.objects.filter(last_synced_at__isnull=True).values_list('calendar_id', flat=True)
+    for calendar_id in flagged:
+        try:
+            changed += sync_if_stale(calendar_id)
+        except Exception:
+            logger.exception("calendar.sync_failed calendar=%s", calendar_id)
+    return changed
+
+
+def sync_all(full=False):
+    """Sync every stadium calendar; one failing calendar does not stop the rest.
+
+    A calendar that a web request is syncing right now is skipped.
+    """
+    changed = 0
+    for stadium in active_stadiums():
+        try:
+            result = sync_locked(stadium.calendar_id, full=full)
+        except Exception:
+            logger.exception("calendar.sync_failed calendar=%s", stadium.calendar_id)
+            continue
+        if result is None:
+            logger.info("calendar.sync_skipped calendar=%s reason=locked", stadium.calendar_id)
+        else:
+            changed += result
+    return changed
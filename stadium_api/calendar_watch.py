@@ -0,0 +1,166 @@
+"""Google Calendar push notifications (``events.watch`` channels).
+
+Each stadium calendar has a watch channel pointing at the
+``calendar/notifications/`` webhook. A notification only says "something in
+this calendar changed", so the webhook flags that calendar for an incremental
+sync and drops its cached slots; the calendar worker or the next read does
+the sync. Channels expire, so ``manage.py renew_watch_channels`` should run
+daily to open replacements before that happens.
+
+The backend that talks to Google is set by ``CALENDAR_WATCH_BACKEND``.
+``LocalWatchBackend`` stands in for Google in tests and local development.
+"""
+import hmac
+import logging
+import secrets
+import uuid
+from datetime import datetime, timedelta, timezone as dt_timezone
+from functools import lru_cache
+
+from django.conf import settings
+from django.urls import reverse
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from . import calendar_sync
+from .google_client import get_calendar_service
+from .models import CalendarWatchChannel
+from .stadiums import active_stadiums
+
+logger = logging.getLogger(__name__)
+
+
+class GoogleWatchBackend:
+    """Opens and stops channels through the Calendar API."""
+
+    def watch(self, calendar_id, channel_id, token, address, ttl):
+        return get_calendar_service().events().watch(
+            calendarId=calendar_id,
+            body={
+                'id': channel_id,
+                'type': 'web_hook',
+                'address': address,
+                'token': token,
+                'params': {'ttl': str(ttl)},
+            }
+        ).execute()
+
+    def stop(self, channel_id, resource_id):
+        get_calendar_service().channels().stop(
+            body={'id': channel_id, 'resourceId': resource_id}
+        ).execute()
+
+
+class LocalWatchBackend:
+    """In-process stand-in for Google, for tests and local development.
+
+    ``watch`` registers channels without calling Google and ``notify`` posts
+    to the webhook with the same headers Google sends.
+    """
+
+    def __init__(self):
+        self.channels = {}
+
+    def watch(self, calendar_id, channel_id, token, address, ttl):
+        resource_id = uuid.uuid4().hex
+        expiration = timezone.now() + timedelta(seconds=ttl)
+        self.channels[channel_id] = {'calendar_id': calendar_id, 'resource_id': resource_id, 'messages': 0}
+        return {
+            'id': channel_id,
+            'resourceId': resource_id,
+            'expiration': str(int(expiration.timestamp() * 1000)),
+        }
+
+    def stop(self, channel_id, resource_id):
+        self.channels.pop(channel_id, None)
+
+    def notify(self, calendar_id, resource_state='exists', client=None):
+        """Deliver a notification for the calendar's newest channel."""
+        from django.test import Client
+
+        channel = CalendarWatchChannel.objects.filter(calendar_id=calendar_id).latest('expiration')
+        registered = self.channels.setdefault(channel.channel_id, {'messages': 0})
+        registered['messages'] += 1
+        client = client or Client()
+        return client.post(
+            reverse('calendar-notifications'),
+            secure=True,
+            HTTP_HOST='localhost',
+            HTTP_X_GOOG_CHANNEL_ID=channel.channel_id,
+            HTTP_X_GOOG_CHANNEL_TOKEN=channel.token,
+            HTTP_X_GOOG_RESOURCE_ID=channel.resource_id,
+            HTTP_X_GOOG_RESOURCE_STATE=resource_state,
+            HTTP_X_GOOG_MESSAGE_NUMBER=str(registered['messages']),
+        )
+
+
+@lru_cache(maxsize=None)
+def get_backend():
+    return import_string(settings.CALENDAR_WATCH_BACKEND)()
+
+
+def open_channel(calendar_id, ttl=None):
+    """Start watching a calendar and store the new channel."""
+    channel_id = str(uuid.uuid4())
+    token = secrets.token_urlsafe(32)
+    result = get_backend().watch(
+        calendar_id,
+        channel_id,
+        token,
+        settings.CALENDAR_WEBHOOK_URL,
+        ttl or settings.CALENDAR_WATCH_TTL
+    )
+    return CalendarWatchChannel.objects.create(
+        calendar_id=calendar_id,
+        channel_id=channel_id,
+        resource_id=result['resourceId'],
+        token=token,
+        expiration=datetime.fromtimestamp(int(result['expiration']) / 1000, tz=dt_timezone.utc)
+    )
+
+
+def close_channel(channel):
+    """Stop a channel at Google (best effort) and forget it."""
+    try:
+        get_backend().stop(channel.channel_id, channel.resource_id)
+    except Exception as e:
+        logger.warning("watch.stop_failed channel=%s error=%s", channel.channel_id, e)
+    channel.delete()
+
+
+def renew_channels(renew_before):
+    """Make sure every stadium calendar has a channel valid past ``renew_before``.
+
+    The replacement is opened before older channels are stopped, so there is
+    no gap in notifications. Returns the channels that were opened.
+    """
+    cutoff = timezone.now() + renew_before
+    opened = []
+    for stadium in active_stadiums():
+        channels = list(
+            CalendarWatchChannel.objects.filter(calendar_id=stadium.calendar_id).order_by('-expiration')
+        )
+        if channels and channels[0].expiration > cutoff:
+            stale = channels[1:]
+        else:
+            opened.append(open_channel(stadium.calendar_id))
+            stale = channels
+        for channel in stale:
+            close_channel(channel)
+    return opened
+
+
+def handle_notification(channel_id, token, resource_id, resource_state):
+    """Process one webhook delivery; returns False if it failed verification."""
+    channel = CalendarWatchChannel.objects.filter(channel_id=channel_id).first()
+    if channel is None:
+        # Most likely a channel we already replaced; nothing to do.
+        logger.info("watch.unknown_channel channel=%s", channel_id)
+        return True
+    if not hmac.compare_digest(channel.token, token or '') or channel.resource_id != resource_id:
+        logger.warning("watch.bad_token channel=%s", channel_id)
+        return False
+    if resource_state != 'sync':
+        # 'sync' only confirms a new channel; anything else means events changed.
+        calendar_sync.mark_stale(channel.calendar_id)
+    return True
@@ -0,0 +1,120 @@
+"""Database-backed outbox for outgoing email.
+
+Requests call ``enqueue()``, which only inserts an OutboxEmail row, so an SMTP
+outage never holds up a web worker. ``manage.py run_email_worker`` keeps one
+authenticated SMTP connection open and drains the table in batches. A worker
+claims a batch with ``SELECT ... FOR UPDATE SKIP LOCKED`` and leases it for
+``SEND_LEASE`` seconds, so more than one worker can run. Failed messages are
+retried with exponential backoff and marked ``failed`` after
+``EMAIL_MAX_ATTEMPTS`` tries.
+
+Bodies carry verification and password-reset codes, so a sent message's
+body is blanked, and ``purge_old()`` deletes sent and failed rows after
+``EMAIL_OUTBOX_RETENTION_DAYS``.
+"""
+import logging
+import smtplib
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.mail import EmailMessage
+from django.db import transaction
+from django.utils import timezone
+
+from .models import OutboxEmail
+
+logger = logging.getLogger(__name__)
+
+SEND_LEASE = 120  # seconds a claimed message is hidden from other workers
+
+
+def enqueue(subject, body, recipients, from_email=None):
+    """Queue an email for the email worker and return its OutboxEmail row."""
+    return OutboxEmail.objects.create(
+        subject=subject,
+        body=body,
+        from_email=from_email or settings.DEFAULT_FROM_EMAIL,
+        recipients=list(recipients)
+    )
+
+
+def claim_batch(limit):
+    """Lease up to ``limit`` due messages to this worker and return them."""
+    now = timezone.now()
+    with transaction.atomic():
+        batch = list(
+            OutboxEmail.objects.select_for_update(skip_locked=True)
+            .filter(status='pending', next_attempt_at__lte=now)
+            .order_by('next_attempt_at')[:limit]
+        )
+        OutboxEmail.objects.filter(pk__in=[email.pk for email in batch]).update(
+            next_attempt_at=now + timedelta(seconds=SEND_LEASE)
+        )
+    return batch
+
+
+def _record_failure(email, error):
+    email.attempts += 1
+    email.last_error = str(error)
+    if email.attempts >= settings.EMAIL_MAX_ATTEMPTS:
+        email.status = 'failed'
+        logger.error("email.gave_up email=%s recipients=%s error=%s", email.pk, ','.join(email.recipients), error)
+    else:
+        delay = min(
+            settings.EMAIL_RETRY_BACKOFF * 2 ** (email.attempts - 1),
+            settings.EMAIL_RETRY_BACKOFF_MAX
+        )
+        email.next_attempt_at = timezone.now() + timedelta(seconds=delay)
+        logger.warning("email.send_failed email=%s attempt=%s error=%s", email.pk, email.attempts, error)
+    email.save(update_fields=['attempts', 'last_error', 'status', 'next_attempt_at'])
+
+
+def send_batch(connection, limit=None):
+    """Send one batch of due messages over ``connection``; returns how many were sent.
+
+    The connection is opened if needed and left open for the next batch. If
+    the server drops it, it is reopened once and the message is retried.
+    """
+    batch = claim_batch(limit or settings.EMAIL_WORKER_BATCH_SIZE)
+    if not batch:
+        return 0
+    # The backend only keeps connections open across sends if we opened them.
+    connection.open()
+    sent = 0
+    for email in batch:
+        message = EmailMessage(
+            email.subject,
+            email.body,
+            email.from_email,
+            email.recipients,
+            connection=connection
+        )
+        try:
+            try:
+                message.send()
+            except smtplib.SMTPServerDisconnected:
+                # The server dropped the idle connection; reconnect once.
+                connection.close()
+                connection.open()
+                message.send()
+        except Exception as e:
+            _record_failure(email, e)
+            continue
+        email.status = 'sent'
+        email.sent_at = timezone.now()
+        # Do not keep the codes around once they are delivered
+        email.body = ''
+        email.save(update_fields=['status', 'sent_at', 'body'])
+        sent += 1
+    return sent
+
+
+def purge_old(days=None):
+    """Delete sent and failed messages older than ``days``; returns how many."""
+    if days is None:
+        days = settings.EMAIL_OUTBOX_RETENTION_DAYS
+    cutoff = timezone.now() - timedelta(days=days)
+    deleted, _ = OutboxEmail.objects.filter(status__in=['sent', 'failed'], created_at__lt=cutoff).delete()
+    if deleted:
+        logger.info("email.purged count=%s days=%s", deleted, days)
+    return deleted
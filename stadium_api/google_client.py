@@ -0,0 +1,290 @@
+"""Process-wide Google Calendar client shared by the calendar views.
+
+Building a discovery client is expensive: the service-account JSON has to be
+parsed, the discovery document loaded and an access token minted. This module
+does that once per worker process and hands every thread its own
+``Resource`` bound to a long-lived HTTP connection, while credentials and the
+discovery document are shared.
+
+Async code uses ``get_async_client()`` instead, which talks to the REST API
+directly over a pooled ``httpx.AsyncClient`` with the same credentials.
+
+Requests from both clients go through ``calendar_quota``, which rate-limits,
+retries and circuit-breaks them.
+"""
+import asyncio
+import json
+import logging
+import os
+import re
+import threading
+import weakref
+from datetime import datetime, timedelta
+from urllib.parse import quote, unquote
+
+import google_auth_httplib2
+import httplib2
+import httpx
+import requests
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from google.auth.transport.requests import Request
+from google.oauth2 import service_account
+from googleapiclient.discovery import build_from_document
+from googleapiclient.discovery_cache import get_static_doc
+from googleapiclient.errors import HttpError
+from googleapiclient.http import HttpRequest
+
+from . import calendar_quota
+
+logger = logging.getLogger(__name__)
+
+SCOPES = ['https://www.googleapis.com/auth/calendar']
+CALENDAR_API_URL = 'https://www.googleapis.com/calendar/v3/'
+CALENDAR_ID_RE = re.compile(r'calendars/([^/?]+)')
+
+
+def calendar_id_from_uri(uri):
+    """The calendar a request URI is about, or None."""
+    match = CALENDAR_ID_RE.search(uri)
+    return unquote(match.group(1)) if match else None
+
+
+def load_credentials_info():
+    """Parse the service-account JSON from settings."""
+    creds_json = settings.GOOGLE_SERVICE_ACCOUNT_CREDENTIALS
+    if not creds_json:
+        raise ValueError("Google service account credentials not found in environment")
+    try:
+        return json.loads(creds_json)
+    except json.JSONDecodeError:
+        raise ValueError("Invalid service account credentials format")
+
+
+class QuotaHttpRequest(HttpRequest):
+    """``HttpRequest`` that executes through the shared quota and breaker."""
+
+    def execute(self, http=None, num_retries=0):
+        return calendar_quota.call(
+            calendar_id_from_uri(self.uri),
+            lambda: super(QuotaHttpRequest, self).execute(http=http, num_retries=num_retries)
+        )
+
+
+class CalendarClient:
+    """Long-lived Calendar API client, safe to share between threads.
+
+    httplib2 connections are not thread-safe, so each thread lazily gets its
+    own ``Resource`` and ``Http``; those are then reused for every request the
+    thread serves. Token refresh is serialized behind a lock and happens
+    ``refresh_margin`` seconds before expiry so requests never pay for it.
+    """
+
+    def __init__(self, credentials_info, scopes=SCOPES, timeout=None, refresh_margin=300):
+        try:
+            self.credentials = service_account.Credentials.from_service_account_info(
+                credentials_info,
+                scopes=scopes
+            )
+        except Exception as e:
+            raise ValueError(f"Failed to create service account credentials: {str(e)}")
+        self.service_account_email = credentials_info.get('client_email')
+        self.pid = os.getpid()
+        self._timeout = timeout
+        self._refresh_margin = timedelta(seconds=refresh_margin)
+        self._refresh_lock = threading.Lock()
+        self._refresh_session = requests.Session()
+        self._local = threading.local()
+        self._discovery_doc = get_static_doc('calendar', 'v3')
+
+    @property
+    def service(self):
+        """Return this thread's Calendar resource, building it on first use."""
+        self.ensure_fresh_token()
+        service = getattr(self._local, 'service', None)
+        if service is None:
+            service = build_from_document(
+                self._discovery_doc,
+                http=self._build_http(),
+                requestBuilder=QuotaHttpRequest
+            )
+            self._local.service = service
+        return service
+
+    def _build_http(self):
+        return google_auth_httplib2.AuthorizedHttp(
+            self.credentials,
+            http=httplib2.Http(timeout=self._timeout)
+        )
+
+    def token_expiring(self):
+        expiry = self.credentials.expiry
+        if not self.credentials.token or expiry is None:
+            return True
+        return expiry - self._refresh_margin <= datetime.utcnow()
+
+    def ensure_fresh_token(self):
+        """Refresh the shared access token if it is missing or about to expire."""
+        if not self.token_expiring():
+            return
+        with self._refresh_lock:
+            # Another thread may have refreshed while we waited for the lock.
+            if self.token_expiring():
+                self.credentials.refresh(Request(session=self._refresh_session))
+                logger.info("google.token_refreshed expires=%s", self.credentials.expiry)
+
+    def health_check(self):
+        """Verify the service account can reach its calendars."""
+        calendars = self.service.calendarList().list().execute()
+        items = calendars.get('items', [])
+        logger.info(
+            "google.client_ready account=%s calendars=%d",
+            self.service_account_email,
+            len(items)
+        )
+        return items
+
+
+class AsyncCalendarClient:
+    """Calendar API client for async views, over a pooled ``httpx.AsyncClient``.
+
+    It borrows the credentials of a ``CalendarClient``, so both share one
+    access token, and keeps up to ``max_connections`` connections to Google
+    open for concurrent requests. Errors are raised as ``HttpError`` just
+    like the sync client's, so callers handle both the same way.
+    """
+
+    def __init__(self, client, timeout=None, max_connections=100):
+        self.client = client
+        self._http = httpx.AsyncClient(
+            base_url=CALENDAR_API_URL,
+            timeout=timeout,
+            limits=httpx.Limits(
+                max_connections=max_connections,
+                max_keepalive_connections=max_connections
+            )
+        )
+
+    async def _auth_headers(self):
+        if self.client.token_expiring():
+            # The refresh is blocking I/O; keep it off the event loop.
+            await sync_to_async(self.client.ensure_fresh_token, thread_sensitive=False)()
+        return {'Authorization': f'Bearer {self.client.credentials.token}'}
+
+    async def request(self, method, path, params=None, json=None, headers=None):
+        async def send():
+            request_headers = await self._auth_headers()
+            request_headers.update(headers or {})
+            response = await self._http.request(method, path, params=params, json=json, headers=request_headers)
+            if response.is_error:
+                raise HttpError(
+                    httplib2.Response({'status': response.status_code}),
+                    response.content,
+                    uri=str(response.url)
+                )
+            return response.json()
+
+        return await calendar_quota.acall(calendar_id_from_uri(path), send)
+
+    @staticmethod
+    def _events_path(calendar_id, event_id=None):
+        path = f"calendars/{quote(calendar_id, safe='')}/events"
+        if event_id:
+            path += f"/{quote(event_id, safe='')}"
+        return path
+
+    async def list_events(self, calendar_id, params):
+        """List events, following ``nextPageToken``.
+
+        Returns ``(events, next_sync_token)`` like ``calendar_sync.fetch_events``.
+        """
+        events = []
+        page_token = None
+        while True:
+            page_params = dict(params, pageToken=page_token) if page_token else params
+            result = await self.request('GET', self._events_path(calendar_id), params=page_params)
+            events.extend(result.get('items', []))
+            page_token = result.get('nextPageToken')
+            if not page_token:
+                return events, result.get('nextSyncToken')
+
+    async def get_event(self, calendar_id, event_id):
+        return await self.request('GET', self._events_path(calendar_id, event_id))
+
+    async def update_event(self, calendar_id, event_id, body, etag=None):
+        """Replace an event; with ``etag`` the write only applies to that version."""
+        headers = {'If-Match': etag} if etag else None
+        return await self.request('PUT', self._events_path(calendar_id, event_id), json=body, headers=headers)
+
+    async def aclose(self):
+        await self._http.aclose()
+
+
+_client = None
+_client_lock = threading.Lock()
+# An httpx.AsyncClient is tied to the event loop it was created on.
+_async_clients = weakref.WeakKeyDictionary()
+
+
+def get_client():
+    """Return the worker's shared ``CalendarClient``, creating it on first use."""
+    global _client
+    client = _client
+    # A client inherited through fork() would share sockets with the parent.
+    if client is None or client.pid != os.getpid():
+        with _client_lock:
+            client = _client
+            if client is None or client.pid != os.getpid():
+                client = CalendarClient(
+                    load_credentials_info(),
+                    timeout=settings.GOOGLE_CALENDAR_HTTP_TIMEOUT,
+                    refresh_margin=settings.GOOGLE_CALENDAR_TOKEN_REFRESH_MARGIN,
+                )
+                _client = client
+    return client
+
+
+def get_calendar_service():
+    """Return a Calendar API resource backed by the shared client."""
+    return get_client().service
+
+
+def get_async_client():
+    """Return the running event loop's ``AsyncCalendarClient``."""
+    loop = asyncio.get_running_loop()
+    client = get_client()
+    async_client = _async_clients.get(loop)
+    if async_client is None or async_client.client is not client:
+        async_client = AsyncCalendarClient(
+            client,
+            timeout=settings.GOOGLE_CALENDAR_HTTP_TIMEOUT,
+            max_connections=settings.GOOGLE_CALENDAR_MAX_CONNECTIONS,
+        )
+        _async_clients[loop] = async_client
+    return async_client
+
+
+def reset_client():
+    """Drop the shared client, e.g. after rotating credentials."""
+    global _client
+    with _client_lock:
+        _client = None
+
+
+def startup_health_check():
+    """Check calendar access once when a worker process boots.
+
+    Failures are logged rather than raised so a Google outage never stops the
+    rest of the API from starting.
+    """
+    if not settings.GOOGLE_CALENDAR_HEALTH_CHECK:
+        return None
+    if not settings.GOOGLE_SERVICE_ACCOUNT_CREDENTIALS:
+        logger.warning("google.health_check_skipped reason=no_credentials")
+        return False
+    try:
+        get_client().health_check()
+        return True
+    except Exception:
+        logger.exception("google.health_check_failed")
+        return False
@@ -0,0 +1,31 @@
+"""Password hashers whose cost is set in settings.
+
+``PASSWORD_HASHER`` picks the policy used for new hashes: PBKDF2-SHA256
+with ``PASSWORD_PBKDF2_ITERATIONS`` iterations, or Argon2 (requires
+``argon2-cffi``) with the ``PASSWORD_ARGON2_*`` costs. Hashes made under any
+other configured hasher or cost still verify. At the next successful login,
+Django's ``check_password`` rewrites them with the current policy, so
+changing the cost upgrades accounts as their users sign in.
+"""
+from django.conf import settings
+from django.contrib.auth import hashers
+
+
+class PBKDF2PasswordHasher(hashers.PBKDF2PasswordHasher):
+    @property
+    def iterations(self):
+        return settings.PASSWORD_PBKDF2_ITERATIONS
+
+
+class Argon2PasswordHasher(hashers.Argon2PasswordHasher):
+    @property
+    def time_cost(self):
+        return settings.PASSWORD_ARGON2_TIME_COST
+
+    @property
+    def memory_cost(self):
+        return settings.PASSWORD_ARGON2_MEMORY_COST
+
+    @property
+    def parallelism(self):
+        return settings.PASSWORD_ARGON2_PARALLELISM
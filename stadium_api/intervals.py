@@ -0,0 +1,75 @@
+"""Interval arithmetic for slot availability.
+
+Intervals are half-open ``(start, end)`` pairs of aware datetimes. Busy time
+is parsed once, sorted and merged into disjoint intervals; each candidate slot
+is then checked with a binary search instead of against every event, so
+filtering ``m`` slots against ``n`` events costs O((n + m) log n). Two
+intervals overlap when each starts before the other ends, which also covers
+events that fully contain a slot.
+"""
+from bisect import bisect_right
+from datetime import datetime, timedelta
+
+
+def merge(intervals):
+    """Sort ``intervals`` and merge the ones that overlap or touch."""
+    merged = []
+    for start, end in sorted(intervals):
+        if merged and start <= merged[-1][1]:
+            if end > merged[-1][1]:
+                merged[-1][1] = end
+        else:
+            merged.append([start, end])
+    return [(start, end) for start, end in merged]
+
+
+class BusyIntervals:
+    """Merged busy time answering overlap queries in O(log n)."""
+
+    def __init__(self, intervals):
+        merged = merge(intervals)
+        self.starts = [start for start, _ in merged]
+        # Merged intervals are disjoint, so their ends are sorted too
+        self.ends = [end for _, end in merged]
+
+    def __len__(self):
+        return len(self.starts)
+
+    def overlaps(self, start, end):
+        """True if any busy time falls inside ``[start, end)``."""
+        # The first busy interval ending after ``start`` is the only candidate
+        i = bisect_right(self.ends, start)
+        return i < len(self.starts) and self.starts[i] < end
+
+
+def free(candidates, busy, key=None):
+    """Keep the candidates that do not overlap ``busy``.
+
+    ``busy`` is a BusyIntervals or any iterable of intervals. ``key`` maps a
+    candidate to its ``(start, end)``; by default candidates are intervals.
+    """
+    if not isinstance(busy, BusyIntervals):
+        busy = BusyIntervals(busy)
+    if key is None:
+        key = lambda candidate: candidate
+    return [candidate for candidate in candidates if not busy.overlaps(*key(candidate))]
+
+
+def day_grid(date, opening_time, closing_time, slot_minutes, tz):
+    """Cut one day's opening hours into back-to-back slots.
+
+    A ``closing_time`` at or before ``opening_time`` means closing after
+    midnight. A trailing remainder shorter than a slot is dropped.
+    """
+    slot_length = timedelta(minutes=slot_minutes)
+    start = datetime.combine(date, opening_time, tzinfo=tz)
+    closing = datetime.combine(date, closing_time, tzinfo=tz)
+    if closing <= start:
+        closing += timedelta(days=1)
+
+    slots = []
+    while start + slot_length <= closing:
+        slots.append((start, start + slot_length))
+        start += slot_length
+    return slots
+
@@ -0,0 +1,16 @@
+"""Email backend that records SMTP time in ``metrics``."""
+from django.core.mail.backends.smtp import EmailBackend
+
+from . import metrics
+
+
+class TimedSMTPBackend(EmailBackend):
+    """The SMTP backend with a span per connection and per message sent."""
+
+    def open(self):
+        with metrics.span('smtp_connect'):
+            return super().open()
+
+    def _send(self, email_message):
+        with metrics.span('smtp'):
+            return super()._send(email_message)
@@ -0,0 +1,67 @@
+import os
+from time import perf_counter
+
+from django.conf import settings
+from django.contrib.auth.hashers import get_hashers
+from django.core.management.base import BaseCommand
+from django.utils.module_loading import import_string
+
+PASSWORD = 'correct horse battery staple'
+
+
+def logins_per_second(hasher, seconds, **encode_options):
+    """How many password checks one core does per second with ``hasher``."""
+    encoded = hasher.encode(PASSWORD, hasher.salt(), **encode_options)
+    checks = 0
+    started = perf_counter()
+    while True:
+        hasher.verify(PASSWORD, encoded)
+        checks += 1
+        elapsed = perf_counter() - started
+        if elapsed >= seconds:
+            return checks / elapsed
+
+
+class Command(BaseCommand):
+    help = 'Measures logins per second per core for each password hashing policy'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--seconds', type=float, default=2, help='How long to time each policy')
+        parser.add_argument(
+            '--iterations', type=int, nargs='*', default=[],
+            help='Extra PBKDF2 iteration counts to try, e.g. --iterations 260000 390000'
+        )
+
+    def handle(self, *args, **options):
+        seconds = options['seconds']
+        cores = os.cpu_count() or 1
+        preferred = get_hashers()[0].algorithm
+        self.stdout.write(f'Current policy: {settings.PASSWORD_HASHER} ({cores} cores)')
+
+        policies = []
+        for policy, path in settings.PASSWORD_POLICIES.items():
+            hasher = import_string(path)()
+            if policy == 'pbkdf2':
+                label = f'pbkdf2 {hasher.iterations} iterations'
+            else:
+                label = (
+                    f'argon2 time={hasher.time_cost} memory={hasher.memory_cost}KiB '
+                    f'parallelism={hasher.parallelism}'
+                )
+            policies.append((label, hasher, {}))
+        pbkdf2 = import_string(settings.PASSWORD_POLICIES['pbkdf2'])()
+        for iterations in options['iterations']:
+            policies.append((f'pbkdf2 {iterations} iterations', pbkdf2, {'iterations': iterations}))
+
+        for label, hasher, encode_options in policies:
+            try:
+                rate = logins_per_second(hasher, seconds, **encode_options)
+            except ValueError as e:
+                # The hasher's library is not installed
+                self.stdout.write(f'{label}: skipped ({e})')
+                continue
+            marker = ' *' if hasher.algorithm == preferred and not encode_options else ''
+            self.stdout.write(
+                f'{label}{marker}: {1000 / rate:.1f} ms per login, '
+                f'{rate:.1f} logins/s per core, ~{rate * cores:.0f} logins/s on {cores} cores'
+            )
@@ -0,0 +1,35 @@
+from datetime import datetime, timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+
+from stadium_api import calendar_batch
+from stadium_api.stadiums import get_stadium
+
+
+def parse_date(value):
+    return datetime.strptime(value, '%Y-%m-%d').date()
+
+
+class Command(BaseCommand):
+    help = 'Deletes the free match slots of a stadium over a date range (e.g. a pitch closure); safe to re-run'
+
+    def add_arguments(self, parser):
+        parser.add_argument('calendar', help='Calendar ID of the stadium to close')
+        parser.add_argument('start', type=parse_date, help='First closed day (YYYY-MM-DD)')
+        parser.add_argument('end', type=parse_date, help='Last closed day (YYYY-MM-DD, inclusive)')
+
+    def handle(self, *args, **options):
+        stadium = get_stadium(options['calendar'])
+        if stadium is None:
+            raise CommandError(f"Unknown stadium calendar: {options['calendar']}")
+        if options['end'] < options['start']:
+            raise CommandError('end must not be before start')
+
+        start = datetime.combine(options['start'], datetime.min.time(), tzinfo=stadium.tzinfo)
+        end = datetime.combine(options['end'] + timedelta(days=1), datetime.min.time(), tzinfo=stadium.tzinfo)
+        deleted, kept, errors = calendar_batch.close_slots(stadium, start, end)
+        self.stdout.write(f'{stadium.name}: {deleted} slots deleted, {len(errors)} failed')
+        if kept:
+            self.stdout.write(f'Kept {len(kept)} booked slots: {", ".join(kept)}')
+        for event_id, error in errors.items():
+            self.stderr.write(f'  {event_id}: {error}')
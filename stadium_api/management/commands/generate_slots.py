@@ -0,0 +1,52 @@
+from datetime import date, datetime, timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from stadium_api import calendar_batch
+from stadium_api.stadiums import active_stadiums, get_stadium
+
+
+def parse_date(value):
+    return datetime.strptime(value, '%Y-%m-%d').date()
+
+
+def parse_time(value):
+    return datetime.strptime(value, '%H:%M').time()
+
+
+class Command(BaseCommand):
+    help = 'Creates recurring match slots in the stadium calendars through batch requests; safe to re-run'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--calendar', help='Only generate slots for this calendar ID')
+        parser.add_argument('--start', type=parse_date, help='First day (YYYY-MM-DD, default tomorrow)')
+        parser.add_argument('--weeks', type=int, default=settings.SLOT_GENERATION_WEEKS,
+                            help='Number of weeks to fill')
+        parser.add_argument('--opening', type=parse_time, help="Opening time (HH:MM, default the stadium's)")
+        parser.add_argument('--closing', type=parse_time, help="Closing time (HH:MM, default the stadium's)")
+        parser.add_argument('--slot-minutes', type=int, help="Slot length (default the stadium's)")
+        parser.add_argument('--dry-run', action='store_true', help='Only count the slots that would be created')
+
+    def handle(self, *args, **options):
+        if options['calendar']:
+            stadium = get_stadium(options['calendar'])
+            if stadium is None:
+                raise CommandError(f"Unknown stadium calendar: {options['calendar']}")
+            stadiums = [stadium]
+        else:
+            stadiums = active_stadiums()
+
+        start = options['start'] or date.today() + timedelta(days=1)
+        dates = [start + timedelta(days=i) for i in range(options['weeks'] * 7)]
+        for stadium in stadiums:
+            slots = calendar_batch.slot_templates(
+                stadium, dates, options['opening'], options['closing'], options['slot_minutes']
+            )
+            if options['dry_run']:
+                self.stdout.write(f'{stadium.name}: {len(slots)} slots to create')
+                continue
+            created, errors = calendar_batch.create_slots(stadium, slots)
+            self.stdout.write(f'{stadium.name}: {created} slots created, {len(errors)} failed')
+            for event_id, error in errors.items():
+                self.stderr.write(f'  {event_id}: {error}')
@@ -0,0 +1,20 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from stadium_api import calendar_watch
+
+
+class Command(BaseCommand):
+    help = 'Opens Google Calendar watch channels for stadium calendars before the current ones expire'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--renew-before', type=float, default=settings.CALENDAR_WATCH_RENEW_BEFORE / 3600,
+                            help='Renew channels expiring within this many hours')
+
+    def handle(self, *args, **options):
+        opened = calendar_watch.renew_channels(timedelta(hours=options['renew_before']))
+        for channel in opened:
+            self.stdout.write(f'Opened channel {channel.channel_id} for {channel.calendar_id} (expires {channel.expiration})')
+        self.stdout.write(f'{len(opened)} channels renewed')
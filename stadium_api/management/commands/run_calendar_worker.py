@@ -0,0 +1,64 @@
+import logging
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from stadium_api import calendar_batch, calendar_mirror, calendar_sync, calendar_watch
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = 'Pushes local bookings to Google Calendar and syncs stadium calendar changes back'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help='Run a single push/pull cycle and exit')
+        parser.add_argument('--interval', type=float, default=settings.CALENDAR_WORKER_INTERVAL,
+                            help='Seconds to sleep between push cycles')
+        parser.add_argument('--pull-interval', type=float, default=settings.CALENDAR_WORKER_PULL_INTERVAL,
+                            help='Seconds between incremental syncs of the stadium calendars')
+        parser.add_argument('--renew-interval', type=float, default=settings.CALENDAR_WATCH_RENEW_INTERVAL,
+                            help='Seconds between checks for watch channels that need renewing')
+
+    def renew_channels(self):
+        try:
+            opened = calendar_watch.renew_channels(timedelta(seconds=settings.CALENDAR_WATCH_RENEW_BEFORE))
+        except Exception:
+            # e.g. Google is unreachable; the next check tries again
+            logger.exception("watch.renew_failed")
+            return
+        if opened:
+            self.stdout.write(f'Renewed {len(opened)} watch channels')
+
+    def handle(self, *args, **options):
+        last_pull = None
+        last_renew = None
+        while True:
+            if last_renew is None or time.monotonic() - last_renew >= options['renew_interval']:
+                # Channels expire after CALENDAR_WATCH_TTL; without this, push notifications stop
+                self.renew_channels()
+                last_renew = time.monotonic()
+
+            if last_pull is None or time.monotonic() - last_pull >= options['pull_interval']:
+                changed = calendar_sync.sync_all()
+                last_pull = time.monotonic()
+                if changed:
+                    self.stdout.write(f'Synced {changed} changed slots')
+
+            notified = calendar_sync.sync_notified()
+            if notified:
+                self.stdout.write(f'Synced {notified} changed slots after push notifications')
+
+            pushed = calendar_mirror.push_pending()
+            if pushed:
+                self.stdout.write(f'Pushed {pushed} slots to Google Calendar')
+
+            generated = calendar_batch.generate_requested_slots()
+            if generated:
+                self.stdout.write(f'Generated {generated} slots requested from the admin')
+
+            if options['once']:
+                return
+            time.sleep(options['interval'])
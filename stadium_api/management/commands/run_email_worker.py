@@ -0,0 +1,51 @@
+import logging
+import time
+
+from django.conf import settings
+from django.core.mail import get_connection
+from django.core.management.base import BaseCommand
+
+from stadium_api import email_outbox
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = 'Sends queued outbox emails over a single long-lived SMTP connection'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help='Send one batch and exit')
+        parser.add_argument('--interval', type=float, default=settings.EMAIL_WORKER_INTERVAL,
+                            help='Seconds to sleep when the outbox is empty')
+
+    def purge(self):
+        try:
+            email_outbox.purge_old()
+        except Exception:
+            logger.exception("email.purge_failed")
+
+    def handle(self, *args, **options):
+        connection = get_connection()
+        last_purge = None
+        try:
+            while True:
+                if last_purge is None or time.monotonic() - last_purge >= settings.EMAIL_PURGE_INTERVAL:
+                    self.purge()
+                    last_purge = time.monotonic()
+                try:
+                    sent = email_outbox.send_batch(connection)
+                except Exception:
+                    # e.g. the SMTP server is unreachable; the claimed
+                    # messages become due again once their lease expires
+                    logger.exception("email.batch_failed")
+                    connection.close()
+                    sent = 0
+                if sent:
+                    self.stdout.write(f'Sent {sent} emails')
+
+                if options['once']:
+                    return
+                if not sent:
+                    time.sleep(options['interval'])
+        finally:
+            connection.close()
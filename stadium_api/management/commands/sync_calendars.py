@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+
+from stadium_api import calendar_sync
+from stadium_api.stadiums import active_stadiums
+
+
+class Command(BaseCommand):
+    help = 'Pulls changed Google Calendar events into the local slot tables using sync tokens'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--full', action='store_true', help='Ignore stored sync tokens and resync everything')
+        parser.add_argument('--calendar', help='Only sync this calendar ID')
+
+    def handle(self, *args, **options):
+        calendar_ids = [options['calendar']] if options['calendar'] else [stadium.calendar_id for stadium in active_stadiums()]
+        for calendar_id in calendar_ids:
+            changed = calendar_sync.sync_locked(calendar_id, full=options['full'])
+            if changed is None:
+                self.stdout.write(f'{calendar_id}: skipped, another sync is running')
+            else:
+                self.stdout.write(f'{calendar_id}: {changed} slots changed')
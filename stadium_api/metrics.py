@@ -0,0 +1,181 @@
+"""Per-request timing spans and Prometheus-style counters.
+
+``backend.middleware.RequestTimingMiddleware`` opens a ``Timings`` for each
+request in a context variable. Code that waits on something records a span
+into it through ``span()``. Spans are kept for database queries (an execute
+wrapper installed on every connection), Google Calendar calls
+(``calendar_quota``), SMTP (``mail.TimedSMTPBackend``) and response
+rendering. The middleware turns a request's spans into a ``Server-Timing``
+header.
+
+Every span and request is also added to this process's counters. A
+background thread writes them to the shared cache every
+``METRICS_FLUSH_INTERVAL`` seconds, so requests never wait on it. Each process
+owns one cache entry holding all of its cumulative totals, written with a
+single ``set``. The entry is numbered from an atomic ``cache.incr``, so no
+process reads and rewrites another's data. ``/metrics/`` adds the entries of
+all web and worker processes together.
+"""
+import atexit
+import contextvars
+import logging
+import os
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import close_old_connections
+from django.db.backends.signals import connection_created
+
+logger = logging.getLogger(__name__)
+
+PROCESSES_KEY = 'metrics:processes'
+
+_current = contextvars.ContextVar('request_timings', default=None)
+# Set while flushing, so the flush's own cache queries are not counted
+_flushing = threading.local()
+
+
+class Timings:
+    """Count and total duration of each kind of span in one request."""
+
+    def __init__(self):
+        self.spans = defaultdict(lambda: [0, 0.0])
+        self._lock = threading.Lock()
+
+    def add(self, name, seconds):
+        with self._lock:
+            span = self.spans[name]
+            span[0] += 1
+            span[1] += seconds
+
+
+def begin_request():
+    """Start collecting spans for the current request; returns a reset token."""
+    timings = Timings()
+    return timings, _current.set(timings)
+
+
+def end_request(token):
+    _current.reset(token)
+
+
+def _process_key(number):
+    return f'metrics:process:{number}'
+
+
+class Counters:
+    """This process's cumulative counters and the thread that flushes them."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._reset()
+        atexit.register(self.flush)
+        # Threads do not survive fork(); the child starts its own counters
+        os.register_at_fork(after_in_child=self._reset)
+
+    def _reset(self):
+        self.totals = defaultdict(float)
+        self.number = None
+        self.dirty = False
+        self._thread = None
+
+    def add(self, name, labels, value):
+        with self._lock:
+            self.totals[(name, tuple(sorted(labels.items())))] += value
+            self.dirty = True
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='metrics-flush', daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            time.sleep(settings.METRICS_FLUSH_INTERVAL)
+            try:
+                self.flush()
+            except Exception:
+                logger.exception("metrics.flush_failed")
+            finally:
+                # Do not keep a database connection open between flushes
+                close_old_connections()
+
+    def flush(self):
+        with self._lock:
+            if not self.dirty:
+                return
+            totals = dict(self.totals)
+            self.dirty = False
+        _flushing.active = True
+        try:
+            if self.number is None:
+                cache.add(PROCESSES_KEY, 0, timeout=None)
+                self.number = cache.incr(PROCESSES_KEY)
+            cache.set(_process_key(self.number), totals, timeout=None)
+        finally:
+            _flushing.active = False
+
+
+counters = Counters()
+
+
+def record(name, seconds):
+    """Add a span to the current request (if any) and to the counters."""
+    timings = _current.get()
+    if timings is not None:
+        timings.add(name, seconds)
+    counters.add('stadium_span_calls_total', {'span': name}, 1)
+    counters.add('stadium_span_seconds_total', {'span': name}, seconds)
+
+
+@contextmanager
+def span(name):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(name, time.perf_counter() - started)
+
+
+def record_request(route, method, status, seconds):
+    labels = {'route': route, 'method': method, 'status': str(status)}
+    counters.add('stadium_requests_total', labels, 1)
+    counters.add('stadium_request_seconds_total', labels, seconds)
+
+
+def _time_query(execute, sql, params, many, context):
+    if getattr(_flushing, 'active', False):
+        return execute(sql, params, many, context)
+    with span('db'):
+        return execute(sql, params, many, context)
+
+
+def _install_db_wrapper(sender, connection, **kwargs):
+    if _time_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_time_query)
+
+
+connection_created.connect(_install_db_wrapper)
+
+
+def render_prometheus():
+    """All flushed counters in the Prometheus text exposition format."""
+    counters.flush()
+    processes = cache.get(PROCESSES_KEY) or 0
+    totals = defaultdict(float)
+    for process_totals in cache.get_many([_process_key(n) for n in range(1, processes + 1)]).values():
+        for series, value in process_totals.items():
+            totals[series] += value
+    lines = []
+    for name in sorted({name for name, _ in totals}):
+        lines.append(f'# TYPE {name} counter')
+        for (series_name, labels), value in sorted(totals.items()):
+            if series_name != name:
+                continue
+            if not name.endswith('_seconds_total'):
+                value = int(value)
+            label_text = ','.join(f'{label}="{label_value}"' for label, label_value in labels)
+            lines.append(f'{name}{{{label_text}}} {value}')
+    return '\n'.join(lines) + '\n'
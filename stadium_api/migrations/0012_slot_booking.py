@@ -0,0 +1,74 @@
+# Generated by Django 5.0 on 2026-10-17 01:30
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stadium_api', '0011_remove_calendar_settings'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Booking',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('status', models.CharField(choices=[('booked', 'Booked'), ('cancelled', 'Cancelled')], default='booked', max_length=20)),
+                ('user_name', models.CharField(blank=True, max_length=150)),
+                ('user_phone', models.CharField(blank=True, max_length=20)),
+                ('cancelled_at', models.DateTimeField(blank=True, null=True)),
+                ('synced_at', models.DateTimeField(blank=True, null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='bookings', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'ordering': ['-created_at'],
+            },
+        ),
+        migrations.CreateModel(
+            name='Slot',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('calendar_id', models.CharField(max_length=255)),
+                ('event_id', models.CharField(max_length=255)),
+                ('start', models.DateTimeField()),
+                ('end', models.DateTimeField()),
+                ('is_booked', models.BooleanField(default=False)),
+                ('original_color', models.CharField(default='0', max_length=10)),
+                ('etag', models.CharField(blank=True, max_length=64)),
+                ('needs_push', models.BooleanField(default=False)),
+                ('version', models.PositiveIntegerField(default=0)),
+                ('push_attempts', models.PositiveIntegerField(default=0)),
+                ('last_push_error', models.TextField(blank=True)),
+                ('synced_at', models.DateTimeField(blank=True, null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'ordering': ['start'],
+                'indexes': [models.Index(fields=['calendar_id', 'start'], name='slot_calendar_start_idx'), models.Index(condition=models.Q(('needs_push', True)), fields=['needs_push'], name='slot_needs_push_idx')],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='slot',
+            constraint=models.UniqueConstraint(fields=('calendar_id', 'event_id'), name='unique_slot_event'),
+        ),
+        migrations.AddField(
+            model_name='booking',
+            name='slot',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='bookings', to='stadium_api.slot'),
+        ),
+        migrations.AddIndex(
+            model_name='booking',
+            index=models.Index(fields=['user', 'status'], name='booking_user_status_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='booking',
+            index=models.Index(fields=['status'], name='booking_status_idx'),
+        ),
+    ]
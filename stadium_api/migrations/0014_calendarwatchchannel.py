@@ -0,0 +1,25 @@
+# Generated by Django 5.0 on 2026-10-17 01:33
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stadium_api', '0013_calendarsyncstate'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CalendarWatchChannel',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('calendar_id', models.CharField(db_index=True, max_length=255)),
+                ('channel_id', models.CharField(max_length=64, unique=True)),
+                ('resource_id', models.CharField(max_length=255)),
+                ('token', models.CharField(max_length=64)),
+                ('expiration', models.DateTimeField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+    ]
@@ -0,0 +1,47 @@
+# Generated by Django 5.0 on 2026-10-17 01:36
+
+import datetime
+from django.db import migrations, models
+
+
+# The stadiums that used to be hard-coded in the calendar views
+INITIAL_STADIUMS = [
+    ('Main Field', '433adde78c577df19c67e7d18b2e932c8aa5b60b05098687a13a227712510f5d@group.calendar.google.com'),
+    ('Academy Stadium', 'c0981f9f07e185a73808a13deb4e2648915ff7f9a28cfe35bb212ff87115a435@group.calendar.google.com'),
+    ('FG Field', 'a233987f0f4b9c95f17c3abf7055ab3287b7765b2c24c02968360fe68a3f2071@group.calendar.google.com'),
+]
+
+
+def create_initial_stadiums(apps, schema_editor):
+    Stadium = apps.get_model('stadium_api', 'Stadium')
+    for name, calendar_id in INITIAL_STADIUMS:
+        Stadium.objects.get_or_create(calendar_id=calendar_id, defaults={'name': name})
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stadium_api', '0014_calendarwatchchannel'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Stadium',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=200)),
+                ('calendar_id', models.CharField(max_length=255, unique=True)),
+                ('opening_time', models.TimeField(default=datetime.time(9, 0))),
+                ('closing_time', models.TimeField(default=datetime.time(21, 0))),
+                ('slot_minutes', models.PositiveIntegerField(default=60)),
+                ('time_zone', models.CharField(default='Africa/Tunis', max_length=64)),
+                ('is_active', models.BooleanField(default=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'ordering': ['id'],
+            },
+        ),
+        migrations.RunPython(create_initial_stadiums, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 5.0 on 2026-10-17 01:37
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stadium_api', '0015_stadium'),
+    ]
+
+    operations = [
+        migrations.AddConstraint(
+            model_name='booking',
+            constraint=models.UniqueConstraint(condition=models.Q(('status', 'booked')), fields=('slot',), name='unique_active_booking_per_slot'),
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 5.0 on 2026-10-17 01:39
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stadium_api', '0016_booking_unique_active_slot'),
+    ]
+
+    operations = [
+        migrations.RemoveConstraint(
+            model_name='booking',
+            name='unique_active_booking_per_slot',
+        ),
+        migrations.AddField(
+            model_name='slot',
+            name='next_attempt_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AlterField(
+            model_name='booking',
+            name='status',
+            field=models.CharField(choices=[('pending', 'Pending'), ('booked', 'Booked'), ('cancelled', 'Cancelled'), ('failed', 'Failed')], default='pending', max_length=20),
+        ),
+        migrations.AddConstraint(
+            model_name='booking',
+            constraint=models.UniqueConstraint(condition=models.Q(('status__in', ['pending', 'booked'])), fields=('slot',), name='unique_active_booking_per_slot'),
+        ),
+    ]
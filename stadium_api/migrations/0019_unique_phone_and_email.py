@@ -0,0 +1,76 @@
+# Generated by Django 5.0 on 2026-10-17 01:46
+
+from collections import defaultdict
+
+from django.db import migrations, models
+
+
+def clear_duplicates(apps, schema_editor):
+    """Make existing rows fit the new unique phone and email indexes.
+
+    Registration used to store a missing phone as '', which the rebuilt
+    unique column would count as a value; blank phones become NULL, which it
+    lets repeat. A phone shared by several profiles stays with the oldest
+    one and is cleared on the others. An email shared case-insensitively is
+    cleared on accounts that never verified it; if more than one verified
+    account still shares an email, the migration stops and lists them to be
+    resolved by hand.
+    """
+    UserProfile = apps.get_model('stadium_api', 'UserProfile')
+    User = apps.get_model('auth', 'User')
+
+    UserProfile.objects.filter(phone__regex=r'^\s*$').update(phone=None)
+
+    by_phone = defaultdict(list)
+    for pk, phone in UserProfile.objects.exclude(phone__isnull=True).order_by('pk').values_list('pk', 'phone'):
+        by_phone[phone].append(pk)
+    for phone, pks in by_phone.items():
+        if len(pks) > 1:
+            print(f'\n  Cleared duplicate phone {phone} on profiles {pks[1:]} (kept on {pks[0]})')
+            UserProfile.objects.filter(pk__in=pks[1:]).update(phone=None)
+
+    by_email = defaultdict(list)
+    users = User.objects.exclude(email='').order_by('pk').values_list('pk', 'email', 'profile__is_verified')
+    for pk, email, is_verified in users:
+        by_email[email.lower()].append((pk, bool(is_verified)))
+    conflicts = []
+    for email, accounts in by_email.items():
+        if len(accounts) < 2:
+            continue
+        verified = [pk for pk, is_verified in accounts if is_verified]
+        # Keep the verified account, or the oldest one if none is
+        keep = verified or [accounts[0][0]]
+        cleared = [pk for pk, _ in accounts if pk not in keep]
+        if cleared:
+            print(f'\n  Cleared duplicate email {email} on unverified users {cleared}')
+            User.objects.filter(pk__in=cleared).update(email='')
+        if len(keep) > 1:
+            conflicts.append(f'{email}: users {keep}')
+    if conflicts:
+        raise RuntimeError(
+            'Several verified users share an email (ignoring case); '
+            'change all but one before migrating:\n  ' + '\n  '.join(conflicts)
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stadium_api', '0018_outboxemail'),
+        ('auth', '0012_alter_user_first_name_max_length'),
+    ]
+
+    operations = [
+        migrations.RunPython(clear_duplicates, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='userprofile',
+            name='phone',
+            field=models.CharField(blank=True, max_length=20, null=True, unique=True),
+        ),
+        # auth.User cannot carry our constraints, so index it directly.
+        # Blank emails are left out so accounts without one still work.
+        migrations.RunSQL(
+            "CREATE UNIQUE INDEX auth_user_email_lower_uniq ON auth_user (LOWER(email)) WHERE email <> ''",
+            reverse_sql="DROP INDEX auth_user_email_lower_uniq",
+        ),
+    ]
@@ -0,0 +1,66 @@
+# Generated by Django 5.0 on 2026-10-17 02:03
+
+import hashlib
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import migrations
+from django.utils import timezone
+
+# booking_service.CANCELLATION_COOLDOWN when these columns were dropped
+CANCELLATION_COOLDOWN = timedelta(hours=1)
+
+
+# The cache layout of stadium_api.state at the time of this migration, kept
+# here so later changes to that module cannot break it
+def store_code(purpose, user_id, code, ttl):
+    digest = hashlib.sha256(str(code).encode()).hexdigest()
+    cache.set_many({
+        f'state:code:{purpose}:{user_id}:{digest}': time.time() + ttl,
+        f'state:code:{purpose}:{user_id}': digest,
+    }, timeout=ttl)
+
+
+def start_cooldown(scope, user_id, duration):
+    seconds = duration.total_seconds()
+    cache.set(f'state:cooldown:{scope}:{user_id}', time.time() + seconds, timeout=seconds)
+
+
+def copy_state_to_cache(apps, schema_editor):
+    """Carry codes already emailed and cooldowns in progress over to the cache.
+
+    The cache must be the shared one the app uses (run createcachetable
+    before migrate for DatabaseCache). The profile column did not record
+    which kind of code it held: unverified users get it as their
+    verification code, verified ones as a password-reset code.
+    """
+    UserProfile = apps.get_model('stadium_api', 'UserProfile')
+    now = timezone.now()
+    for profile in UserProfile.objects.exclude(verification_code__isnull=True).exclude(verification_code=''):
+        if profile.is_verified:
+            store_code('password_reset', profile.user_id, profile.verification_code, getattr(settings, 'PASSWORD_RESET_CODE_TTL', 3600))
+        else:
+            store_code('verify', profile.user_id, profile.verification_code, getattr(settings, 'VERIFICATION_CODE_TTL', 24 * 3600))
+    for profile in UserProfile.objects.filter(last_cancellation__gt=now - CANCELLATION_COOLDOWN):
+        start_cooldown('booking', profile.user_id, profile.last_cancellation + CANCELLATION_COOLDOWN - now)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stadium_api', '0020_userprofile_token_version'),
+    ]
+
+    operations = [
+        migrations.RunPython(copy_state_to_cache, migrations.RunPython.noop),
+        migrations.RemoveField(
+            model_name='userprofile',
+            name='last_cancellation',
+        ),
+        migrations.RemoveField(
+            model_name='userprofile',
+            name='verification_code',
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.0 on 2026-10-17 02:21
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stadium_api', '0021_move_codes_and_cooldowns_to_cache'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='stadium',
+            name='slots_requested_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
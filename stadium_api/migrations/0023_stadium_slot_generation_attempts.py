@@ -0,0 +1,18 @@
+# Generated by Django 5.0 on 2026-10-17 02:33
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stadium_api', '0022_stadium_slots_requested_at'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='stadium',
+            name='slot_generation_attempts',
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
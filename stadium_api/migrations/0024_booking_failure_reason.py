@@ -0,0 +1,18 @@
+# Generated by Django 5.0 on 2026-10-17 02:41
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stadium_api', '0023_stadium_slot_generation_attempts'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='booking',
+            name='failure_reason',
+            field=models.CharField(blank=True, choices=[('conflict', 'Booked by someone else'), ('unavailable', 'Calendar unavailable')], max_length=20),
+        ),
+    ]
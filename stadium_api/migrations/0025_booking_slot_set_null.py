@@ -0,0 +1,19 @@
+# Generated by Django 5.0 on 2026-10-17 02:44
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stadium_api', '0024_booking_failure_reason'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='booking',
+            name='slot',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='bookings', to='stadium_api.slot'),
+        ),
+    ]
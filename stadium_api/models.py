@@ -1,25 +1,248 @@
-from django.db import models
+from datetime import time
+from zoneinfo import ZoneInfo
+
+from django.db import models, transaction
+from django.utils import timezone
 from django.contrib.auth.models import User
 from django.db.models.signals import post_save
 from django.dispatch import receiver
 
 class UserProfile(models.Model):
     user = models.OneToOneField(User, on_delete=models.CASCADE, related_name='profile')
-    phone = models.CharField(max_length=20, blank=True, null=True)
-    verification_code = models.CharField(max_length=6, blank=True, null=True)
+    phone = models.CharField(max_length=20, blank=True, null=True, unique=True)
     is_verified = models.BooleanField(default=False)
-    last_cancellation = models.DateTimeField(null=True, blank=True)
+    # Copied into JWTs; bumping it revokes them (see stadium_api.authentication)
+    token_version = models.PositiveIntegerField(default=0)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
     def __str__(self):
         return f"{self.user.username}'s profile"
 
+    def set_fields(self, **fields):
+        """Assign ``fields`` and save only the ones whose value changed.
+
+        Returns True if anything was written.
+        """
+        changed = [name for name, value in fields.items() if getattr(self, name) != value]
+        if not changed:
+            return False
+        for name in changed:
+            setattr(self, name, fields[name])
+        self.save(update_fields=changed + ['updated_at'])
+        return True
+
+
+def create_user_with_profile(username, email, password, profile=None, **extra_fields):
+    """Create a user and its profile: one password hash and one INSERT each.
+
+    ``profile`` holds initial UserProfile fields. Both rows are written in
+    one transaction, so a failed profile insert leaves no user behind.
+    """
+    profile = dict(profile or {})
+    # Blank phones are stored as NULL, which the unique index lets repeat
+    profile['phone'] = profile.get('phone') or None
+    user = User(username=username, email=email, **extra_fields)
+    user.clean()  # normalizes username and email like create_user()
+    user.set_password(password)
+    # Tells create_user_profile the profile is created here
+    user._creates_own_profile = True
+    with transaction.atomic():
+        user.save()
+        UserProfile.objects.create(user=user, **profile)
+    return user
+
+
+class Stadium(models.Model):
+    """A bookable pitch and the Google calendar holding its match slots."""
+    name = models.CharField(max_length=200)
+    calendar_id = models.CharField(max_length=255, unique=True)
+    opening_time = models.TimeField(default=time(9, 0))
+    closing_time = models.TimeField(default=time(21, 0))
+    slot_minutes = models.PositiveIntegerField(default=60)
+    time_zone = models.CharField(max_length=64, default='Africa/Tunis')
+    is_active = models.BooleanField(default=True)
+    # Set by the admin; the calendar worker generates the stadium's slots once
+    # this time has passed, and pushes it back after a failed attempt
+    slots_requested_at = models.DateTimeField(null=True, blank=True)
+    slot_generation_attempts = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        ordering = ['id']
+
+    def __str__(self):
+        return self.name
+
+    @property
+    def tzinfo(self):
+        return ZoneInfo(self.time_zone)
+
+
+class Slot(models.Model):
+    """Local mirror of a bookable 'match' event in a stadium calendar.
+
+    This row, not the Google event, is the source of truth for whether the
+    slot is booked. ``needs_push`` marks rows whose state still has to be
+    written back to Google Calendar by the calendar worker; ``version`` lets
+    the worker tell whether the row changed while it was pushing. Failed
+    pushes are retried with backoff; ``next_attempt_at`` is when the slot is
+    due again.
+    """
+    calendar_id = models.CharField(max_length=255)
+    event_id = models.CharField(max_length=255)
+    start = models.DateTimeField()
+    end = models.DateTimeField()
+    is_booked = models.BooleanField(default=False)
+    original_color = models.CharField(max_length=10, default='0')
+    etag = models.CharField(max_length=64, blank=True)
+    needs_push = models.BooleanField(default=False)
+    version = models.PositiveIntegerField(default=0)
+    push_attempts = models.PositiveIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(null=True, blank=True)
+    last_push_error = models.TextField(blank=True)
+    synced_at = models.DateTimeField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        ordering = ['start']
+        constraints = [
+            models.UniqueConstraint(fields=['calendar_id', 'event_id'], name='unique_slot_event'),
+        ]
+        indexes = [
+            models.Index(fields=['calendar_id', 'start'], name='slot_calendar_start_idx'),
+            models.Index(fields=['needs_push'], name='slot_needs_push_idx', condition=models.Q(needs_push=True)),
+        ]
+
+    def __str__(self):
+        return f"{self.calendar_id} {self.start:%Y-%m-%d %H:%M}"
+
+    def mark_dirty(self):
+        """Flag the slot for the calendar worker after a local change."""
+        self.needs_push = True
+        self.version += 1
+        self.push_attempts = 0
+        self.next_attempt_at = None
+
+
+class Booking(models.Model):
+    """A user's booking of a slot.
+
+    New bookings start out ``pending`` and become ``booked`` once the
+    calendar worker has written them to Google, or ``failed`` if that
+    write could not be made. ``failure_reason`` says why: the event was
+    booked on Google by someone else, or Google could not be reached.
+    ``slot`` is cleared rather than the booking deleted when its event
+    disappears from the calendar, so the booking's history is kept.
+    """
+    STATUS_CHOICES = [
+        ('pending', 'Pending'),
+        ('booked', 'Booked'),
+        ('cancelled', 'Cancelled'),
+        ('failed', 'Failed'),
+    ]
+    ACTIVE_STATUSES = ('pending', 'booked')
+    FAILURE_REASONS = [
+        ('conflict', 'Booked by someone else'),
+        ('unavailable', 'Calendar unavailable'),
+    ]
+
+    slot = models.ForeignKey(Slot, on_delete=models.SET_NULL, null=True, related_name='bookings')
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='bookings')
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
+    failure_reason = models.CharField(max_length=20, choices=FAILURE_REASONS, blank=True)
+    user_name = models.CharField(max_length=150, blank=True)
+    user_phone = models.CharField(max_length=20, blank=True)
+    cancelled_at = models.DateTimeField(null=True, blank=True)
+    synced_at = models.DateTimeField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['user', 'status'], name='booking_user_status_idx'),
+            models.Index(fields=['status'], name='booking_status_idx'),
+        ]
+        constraints = [
+            # A slot (calendar_id, event_id) can hold only one live booking.
+            models.UniqueConstraint(
+                fields=['slot'],
+                condition=models.Q(status__in=['pending', 'booked']),
+                name='unique_active_booking_per_slot'
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.user.username} - {self.slot} ({self.status})"
+
+
+class CalendarSyncState(models.Model):
+    """Google ``nextSyncToken`` bookkeeping for one stadium calendar."""
+    calendar_id = models.CharField(max_length=255, unique=True)
+    sync_token = models.TextField(blank=True)
+    last_synced_at = models.DateTimeField(null=True, blank=True)
+    last_full_sync_at = models.DateTimeField(null=True, blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.calendar_id} (synced {self.last_synced_at})"
+
+
+class CalendarWatchChannel(models.Model):
+    """An ``events.watch`` push-notification channel on a stadium calendar."""
+    calendar_id = models.CharField(max_length=255, db_index=True)
+    channel_id = models.CharField(max_length=64, unique=True)
+    resource_id = models.CharField(max_length=255)
+    token = models.CharField(max_length=64)
+    expiration = models.DateTimeField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.calendar_id} channel {self.channel_id} (expires {self.expiration})"
+
+
+class OutboxEmail(models.Model):
+    """An email waiting for (or done with) delivery by the email worker.
+
+    Views only insert rows here; ``manage.py run_email_worker`` sends them
+    over one long-lived SMTP connection and retries failures with backoff.
+    """
+    STATUS_CHOICES = [
+        ('pending', 'Pending'),
+        ('sent', 'Sent'),
+        ('failed', 'Failed'),
+    ]
+
+    subject = models.CharField(max_length=255)
+    body = models.TextField()
+    from_email = models.CharField(max_length=255)
+    recipients = models.JSONField(default=list)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
+    attempts = models.PositiveIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    sent_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ['created_at']
+        indexes = [
+            models.Index(
+                fields=['next_attempt_at'],
+                name='outbox_pending_idx',
+                condition=models.Q(status='pending')
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.subject} -> {', '.join(self.recipients)} ({self.status})"
+
+
 @receiver(post_save, sender=User)
 def create_user_profile(sender, instance, created, **kwargs):
-    if created:
+    # Fallback for users created elsewhere, e.g. createsuperuser or the admin
+    if created and not getattr(instance, '_creates_own_profile', False):
         UserProfile.objects.create(user=instance)
-
-@receiver(post_save, sender=User)
-def save_user_profile(sender, instance, **kwargs):
-    instance.profile.save()
@@ -0,0 +1,11 @@
+from rest_framework.renderers import JSONRenderer
+
+from . import metrics
+
+
+class TimedJSONRenderer(JSONRenderer):
+    """JSONRenderer that records rendering time in ``metrics``."""
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        with metrics.span('serialize'):
+            return super().render(data, accepted_media_type, renderer_context)
@@ -1,6 +1,10 @@
 from rest_framework import serializers
 from django.contrib.auth.models import User
-from .models import UserProfile
+from django.contrib.auth.validators import UnicodeUsernameValidator
+from django.db.models import Q
+from django.db.models.functions import Lower
+from .authentication import revoke_tokens
+from .models import UserProfile, create_user_with_profile
 from django.db import transaction
 from django.core.mail import send_mail
 from django.conf import settings
@@ -10,22 +14,60 @@ import logging
 
 logger = logging.getLogger(__name__)
 
+CONFLICT_MESSAGES = {
+    'username': "Username already exists",
+    'email': "Email already exists",
+    'phone': "Phone number already exists",
+}
+
+def normalize_phone(value):
+    """Keep only the digits of a phone number; None if there are none."""
+    cleaned_phone = ''.join(filter(str.isdigit, str(value or '')))
+    return cleaned_phone or None
+
+def find_conflicts(username=None, email=None, phone=None, exclude_user_id=None):
+    """Return which of username, email and phone are already taken.
+
+    One query covers all three; emails compare case-insensitively. The
+    unique indexes on these columns still catch concurrent sign-ups.
+    """
+    query = Q()
+    if username:
+        query |= Q(username=username)
+    if email:
+        # Same expression and condition as auth_user_email_lower_uniq, so the index is used
+        query |= Q(email_lower=email.lower()) & ~Q(email='')
+    if phone:
+        query |= Q(profile__phone=phone)
+    if not query:
+        return set()
+
+    matches = User.objects.alias(email_lower=Lower('email')).filter(query)
+    if exclude_user_id is not None:
+        matches = matches.exclude(pk=exclude_user_id)
+
+    conflicts = set()
+    for taken_username, taken_email, taken_phone in matches.values_list('username', 'email', 'profile__phone'):
+        if username and taken_username == username:
+            conflicts.add('username')
+        if email and taken_email.lower() == email.lower():
+            conflicts.add('email')
+        if phone and taken_phone == phone:
+            conflicts.add('phone')
+    return conflicts
+
 class UserProfileSerializer(serializers.ModelSerializer):
     class Meta:
         model = UserProfile
         fields = ('phone',)
+        extra_kwargs = {
+            # Checked together with username and email in UserSerializer.validate
+            'phone': {'validators': []}
+        }
 
     def validate_phone(self, value):
-        if not value:  # If phone is empty or None
-            return value
-            
         # Clean the phone number (remove spaces, dashes, etc.)
-        cleaned_phone = ''.join(filter(str.isdigit, str(value)))
-        
-        # Check if phone number exists
-        if UserProfile.objects.filter(phone=cleaned_phone).exists():
-            raise serializers.ValidationError("This phone number is already registered")
-        return cleaned_phone
+        return normalize_phone(value)
 
 class UserSerializer(serializers.ModelSerializer):
     profile = UserProfileSerializer(required=False)  # Nested serializer for profile
@@ -39,7 +81,9 @@ class UserSerializer(serializers.ModelSerializer):
             'password': {'write_only': True},
             'email': {'required': True},
             'first_name': {'required': False},
-            'last_name': {'required': False}
+            'last_name': {'required': False},
+            # Uniqueness is checked in validate() rather than by its own query
+            'username': {'validators': [UnicodeUsernameValidator()]}
         }
 
     def validate_email(self, value):
@@ -49,43 +93,33 @@ class UserSerializer(serializers.ModelSerializer):
             validate_email(value)
         except ValidationError:
             raise serializers.ValidationError("Enter a valid email address.")
-            
-        if User.objects.filter(email=value).exists():
-            raise serializers.ValidationError("This email is already registered.")
         return value
 
     def validate(self, data):
-        # Add any additional validation here
-        if 'profile' in data and data['profile']:
-            phone = data['profile'].get('phone')
-            if phone:
-                # Clean the phone number
-                cleaned_phone = ''.join(filter(str.isdigit, str(phone)))
-                if UserProfile.objects.filter(phone=cleaned_phone).exists():
-                    raise serializers.ValidationError({
-                        "profile": {"phone": ["This phone number is already registered."]}
-                    })
-                # Update the phone number with cleaned version
-                data['profile']['phone'] = cleaned_phone
+        profile = data.get('profile') or {}
+        conflicts = find_conflicts(
+            username=data.get('username'),
+            email=data.get('email'),
+            phone=profile.get('phone'),
+            exclude_user_id=self.instance.pk if self.instance else None
+        )
+        if conflicts:
+            errors = {
+                field: [CONFLICT_MESSAGES[field]]
+                for field in ('username', 'email')
+                if field in conflicts
+            }
+            if 'phone' in conflicts:
+                errors['profile'] = {'phone': [CONFLICT_MESSAGES['phone']]}
+            raise serializers.ValidationError(errors)
         return data
 
-    @transaction.atomic
     def create(self, validated_data):
-        profile_data = validated_data.pop('profile', {})
-        password = validated_data.pop('password')
-        
-        # Create user
-        user = User.objects.create_user(**validated_data)
-        user.set_password(password)
-        user.save()
-
-        # Update profile with phone if provided
-        if profile_data:
-            profile = user.profile
-            profile.phone = profile_data.get('phone')
-            profile.save()
-
-        return user
+        profile_data = dict(validated_data.pop('profile', None) or {})
+        # Profile fields may also be passed to save(), e.g. is_verified
+        if 'is_verified' in validated_data:
+            profile_data['is_verified'] = validated_data.pop('is_verified')
+        return create_user_with_profile(profile=profile_data, **validated_data)
 
     @transaction.atomic
     def update(self, instance, validated_data):
@@ -100,13 +134,12 @@ class UserSerializer(serializers.ModelSerializer):
             instance.set_password(password)
         
         instance.save()
+        if password:
+            revoke_tokens(instance)
 
-        # Update profile
-        if profile_data:
-            profile = instance.profile
-            if 'phone' in profile_data:
-                profile.phone = profile_data['phone']
-            profile.save()
+        # Update profile, writing it only if the phone actually changed
+        if profile_data and 'phone' in profile_data:
+            instance.profile.set_fields(phone=profile_data['phone'])
 
         return instance
 
@@ -1,11 +1,18 @@
-from django.db.models.signals import post_migrate
+import logging
+
+from django.db.models.signals import post_delete, post_migrate, post_save
 from django.dispatch import receiver
 from django.contrib.auth.models import User
-from django.db import DEFAULT_DB_ALIAS
+from django.db import DEFAULT_DB_ALIAS, transaction
+from . import authentication, stadiums
+from .models import Stadium, UserProfile
+
+logger = logging.getLogger(__name__)
 
 @receiver(post_migrate)
 def create_superuser(sender, **kwargs):
-    if kwargs.get('using', DEFAULT_DB_ALIAS) != DEFAULT_DB_ALIAS:
+    # post_migrate is sent once per app; check once per migrate run
+    if sender.name != 'stadium_api' or kwargs.get('using', DEFAULT_DB_ALIAS) != DEFAULT_DB_ALIAS:
         return
     
     # Create superuser only if no superuser exists
@@ -15,6 +22,22 @@ def create_superuser(sender, **kwargs):
             email='admin@admin.com',
             password='admin'
         )
-        print('Superuser created successfully')
+        logger.info("auth.superuser_created username=%s", 'admin')
     else:
-        print('Superuser already exists') 
\ No newline at end of file
+        logger.info("auth.superuser_exists")
+
+@receiver(post_save, sender=Stadium)
+@receiver(post_delete, sender=Stadium)
+def invalidate_stadium_index(sender, **kwargs):
+    # After commit, or another process could reload the old rows under the new version
+    transaction.on_commit(stadiums.invalidate)
+
+@receiver(post_save, sender=User)
+def revoke_inactive_user_tokens(sender, instance, created, **kwargs):
+    # Reads trust token claims, so deactivating an account must revoke them
+    if not created and not instance.is_active:
+        authentication.revoke_tokens(instance)
+
+@receiver(post_delete, sender=UserProfile)
+def forget_token_version(sender, instance, **kwargs):
+    authentication.forget_token_version(instance.user_id)
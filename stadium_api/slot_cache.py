@@ -0,0 +1,90 @@
+"""Read-through cache of available slots keyed by (calendar_id, date).
+
+Entries are fresh for ``SLOT_CACHE_TTL`` seconds and then kept for another
+``SLOT_CACHE_STALE_TTL`` seconds. Once an entry goes stale exactly one caller
+refreshes it (guarded by a ``cache.add`` lock) while everyone else keeps
+getting the stale copy. Writes to a calendar bump its generation number,
+which orphans every cached date for that calendar at once. While Google is
+degraded (``calendar_quota.breaker_open()``) stale entries are served
+without a refresh, since it could not bring in remote changes anyway.
+"""
+import hashlib
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+
+from . import calendar_quota
+
+LOCK_TIMEOUT = 15  # seconds; longer than any sane Google round-trip
+COLD_MISS_WAIT = 5  # seconds to wait for another caller's refresh
+
+
+def _calendar_key(calendar_id):
+    return hashlib.md5(calendar_id.encode()).hexdigest()
+
+
+def _generation_key(calendar_id):
+    return f'slots:gen:{_calendar_key(calendar_id)}'
+
+
+def _generation(calendar_id):
+    key = _generation_key(calendar_id)
+    generation = cache.get(key)
+    if generation is None:
+        # Seed from the clock so an evicted counter never revives old entries.
+        cache.add(key, time.time_ns(), timeout=None)
+        generation = cache.get(key)
+    return generation
+
+
+def _entry_key(calendar_id, date_str, generation):
+    return f'slots:{_calendar_key(calendar_id)}:{date_str}:{generation}'
+
+
+def _store(key, slots):
+    ttl = settings.SLOT_CACHE_TTL
+    cache.set(
+        key,
+        {'slots': slots, 'fresh_until': time.time() + ttl},
+        timeout=ttl + settings.SLOT_CACHE_STALE_TTL
+    )
+
+
+def get_slots(calendar_id, date_str, loader):
+    """Return cached slots for a calendar day, calling ``loader()`` on a miss."""
+    key = _entry_key(calendar_id, date_str, _generation(calendar_id))
+    entry = cache.get(key)
+    if entry is not None and entry['fresh_until'] > time.time():
+        return entry['slots']
+    if entry is not None and calendar_quota.breaker_open():
+        return entry['slots']
+
+    lock_key = f'{key}:lock'
+    if cache.add(lock_key, 1, timeout=LOCK_TIMEOUT):
+        try:
+            slots = loader()
+            _store(key, slots)
+            return slots
+        finally:
+            cache.delete(lock_key)
+
+    # Someone else is refreshing this entry.
+    if entry is not None:
+        return entry['slots']
+    deadline = time.time() + COLD_MISS_WAIT
+    while time.time() < deadline:
+        time.sleep(0.05)
+        entry = cache.get(key)
+        if entry is not None:
+            return entry['slots']
+    return loader()
+
+
+def invalidate_calendar(calendar_id):
+    """Drop every cached date for a calendar after one of its events changed."""
+    key = _generation_key(calendar_id)
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.set(key, time.time_ns(), timeout=None)
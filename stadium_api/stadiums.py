@@ -0,0 +1,69 @@
+"""Per-process index of the stadiums served by the booking API.
+
+Stadium rows rarely change, so each process loads the active ones once and
+answers lookups from dicts. Once a transaction saving or deleting a Stadium
+commits, the index is cleared in that process and a version number in the
+shared cache is bumped; other processes compare against it at most every
+``CHECK_INTERVAL`` seconds and reload when it moved.
+"""
+import threading
+import time
+
+from django.core.cache import cache
+
+VERSION_KEY = 'stadiums:version'
+CHECK_INTERVAL = 5  # seconds
+
+
+class StadiumIndex:
+    def __init__(self, stadiums, version):
+        self.stadiums = stadiums
+        self.version = version
+        self.checked_at = time.monotonic()
+        self.by_calendar_id = {stadium.calendar_id: stadium for stadium in stadiums}
+
+
+_index = None
+_lock = threading.Lock()
+
+
+def _load():
+    from .models import Stadium
+
+    version = cache.get(VERSION_KEY)
+    return StadiumIndex(list(Stadium.objects.filter(is_active=True)), version)
+
+
+def get_index():
+    """Return the current index, reloading it if another process changed it."""
+    global _index
+    index = _index
+    if index is not None and time.monotonic() - index.checked_at < CHECK_INTERVAL:
+        return index
+    with _lock:
+        index = _index
+        if index is None or cache.get(VERSION_KEY) != index.version:
+            index = _index = _load()
+        else:
+            index.checked_at = time.monotonic()
+        return index
+
+
+def invalidate():
+    """Drop this process's index and tell the other processes to reload."""
+    global _index
+    with _lock:
+        _index = None
+    try:
+        cache.incr(VERSION_KEY)
+    except ValueError:
+        cache.set(VERSION_KEY, time.time_ns(), timeout=None)
+
+
+def active_stadiums():
+    return get_index().stadiums
+
+
+def get_stadium(calendar_id):
+    """Return the active stadium for a calendar ID, or None if it is not ours."""
+    return get_index().by_calendar_id.get(calendar_id)
@@ -0,0 +1,86 @@
+"""Short-lived per-user state in the shared cache: cooldowns and one-time codes.
+
+Cooldowns and email codes only matter for minutes or hours, so they live in
+the Django cache with a TTL instead of on ``UserProfile``. That makes checking
+them a single cache lookup, with no row locks. Like the rest of the shared
+state, this only works across workers when ``CACHE_BACKEND`` is a shared
+backend. Local memory is fine for tests and one-process development.
+
+A code is stored under a key derived from its own hash, with its expiry time
+as the value. Checking a code reads that value, refuses it once expired, and
+then deletes the key. ``cache.delete()`` reports whether this call removed the
+key, so when two requests race for one code only one of them wins. The expiry
+is checked explicitly because ``DatabaseCache`` lets ``delete()`` succeed on
+expired rows. A pointer to the current code is kept so that issuing a new
+code discards the previous one.
+"""
+import hashlib
+import secrets
+import time
+
+from django.core.cache import cache
+
+CODE_DIGITS = 6
+
+
+def _cooldown_key(scope, user_id):
+    return f'state:cooldown:{scope}:{user_id}'
+
+
+def start_cooldown(scope, user_id, duration):
+    """Hold ``user_id`` off ``scope`` for ``duration`` (a timedelta)."""
+    seconds = duration.total_seconds()
+    cache.set(_cooldown_key(scope, user_id), time.time() + seconds, timeout=seconds)
+
+
+def cooldown_remaining(scope, user_id):
+    """Seconds left in the user's cooldown for ``scope``; 0 when there is none."""
+    until = cache.get(_cooldown_key(scope, user_id))
+    if until is None:
+        return 0
+    return max(until - time.time(), 0)
+
+
+def _code_key(purpose, user_id, digest):
+    return f'state:code:{purpose}:{user_id}:{digest}'
+
+
+def _pointer_key(purpose, user_id):
+    return f'state:code:{purpose}:{user_id}'
+
+
+def _digest(code):
+    return hashlib.sha256(str(code).encode()).hexdigest()
+
+
+def store_code(purpose, user_id, code, ttl):
+    """Make ``code`` the user's one-time code for ``purpose`` for ``ttl`` seconds.
+
+    Any code stored earlier for the same purpose and user stops working.
+    """
+    digest = _digest(code)
+    previous = cache.get(_pointer_key(purpose, user_id))
+    if previous and previous != digest:
+        cache.delete(_code_key(purpose, user_id, previous))
+    cache.set_many({
+        _code_key(purpose, user_id, digest): time.time() + ttl,
+        _pointer_key(purpose, user_id): digest,
+    }, timeout=ttl)
+
+
+def issue_code(purpose, user_id, ttl):
+    """Create and store a numeric one-time code valid for ``ttl`` seconds."""
+    code = ''.join(secrets.choice('0123456789') for _ in range(CODE_DIGITS))
+    store_code(purpose, user_id, code, ttl)
+    return code
+
+
+def consume_code(purpose, user_id, code):
+    """Check and use up a code; True only for the one request that used it."""
+    if not code:
+        return False
+    key = _code_key(purpose, user_id, _digest(code))
+    expires_at = cache.get(key)
+    if expires_at is None or expires_at <= time.time():
+        return False
+    return bool(cache.delete(key))
@@ -1,3 +1,891 @@
-from django.test import TestCase
+import gzip
+import os
+import tempfile
+import time
+from datetime import date, datetime, time as clock_time, timedelta
+from zoneinfo import ZoneInfo
+from unittest import mock
 
-# Create your tests here.
+from unittest import skipUnless
+from importlib.util import find_spec
+
+import httplib2
+from django.conf import settings
+from django.contrib.auth.hashers import identify_hasher, make_password
+from django.core.cache import cache
+from django.core import mail
+from django.core.management import call_command
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.utils import timezone
+from googleapiclient.errors import HttpError
+from rest_framework.test import APIClient, APIRequestFactory, force_authenticate
+
+from . import calendar_batch, calendar_mirror, calendar_quota, intervals, calendar_sync, calendar_watch, email_outbox, metrics, stadiums, state, throttling
+from .authentication import ClaimsRefreshToken, revoke_tokens
+from .models import Booking, CalendarSyncState, CalendarWatchChannel, OutboxEmail, Slot, Stadium, create_user_with_profile
+from .views import calendar_views, frontend
+
+CALENDAR_ID = 'test-pitch@group.calendar.google.com'
+
+
+def make_user(username):
+    return create_user_with_profile(
+        username, f'{username}@example.com', 'correct horse battery staple',
+        profile={'is_verified': True}
+    )
+
+
+def api_client():
+    return APIClient(SERVER_NAME='localhost')
+
+
+def bearer(user):
+    return f'Bearer {ClaimsRefreshToken.for_user(user).access_token}'
+
+
+def client_for(user):
+    client = api_client()
+    client.credentials(HTTP_AUTHORIZATION=bearer(user))
+    return client
+
+
+# Production settings redirect plain HTTP to HTTPS
+@override_settings(SECURE_SSL_REDIRECT=False)
+class StateTestCase(TestCase):
+    """Cooldowns, codes and throttle counters live in the cache; start each test clean."""
+
+    def setUp(self):
+        cache.clear()
+
+    def create_stadium(self):
+        # The stadium index is refreshed once the transaction commits
+        with self.captureOnCommitCallbacks(execute=True):
+            return Stadium.objects.create(name='Test Pitch', calendar_id=CALENDAR_ID)
+
+
+@override_settings(BOOKING_ASYNC=True)
+class BookingTests(StateTestCase):
+    def setUp(self):
+        super().setUp()
+        self.create_stadium()
+        start = timezone.now() + timedelta(days=1)
+        self.slot = Slot.objects.create(
+            calendar_id=CALENDAR_ID,
+            event_id='match1',
+            start=start,
+            end=start + timedelta(hours=1)
+        )
+        self.alice = make_user('alice')
+        self.bob = make_user('bob')
+        self.payload = {'calendar_id': CALENDAR_ID, 'event_id': 'match1'}
+
+    def book(self, user):
+        return client_for(user).post('/calendar/book_slot/', self.payload, format='json')
+
+    def test_booking_is_accepted_and_queued_for_google(self):
+        response = self.book(self.alice)
+        self.assertEqual(response.status_code, 202)
+        self.slot.refresh_from_db()
+        self.assertTrue(self.slot.is_booked)
+        self.assertTrue(self.slot.needs_push)
+
+    def test_double_booking_returns_409(self):
+        self.assertEqual(self.book(self.alice).status_code, 202)
+        response = self.book(self.bob)
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(Booking.objects.filter(slot=self.slot).count(), 1)
+
+    def test_only_the_owner_can_cancel(self):
+        self.book(self.alice)
+        response = client_for(self.bob).post('/calendar/cancel_booking/', self.payload, format='json')
+        self.assertEqual(response.status_code, 403)
+
+    def book_and_push(self, error):
+        with self.settings(BOOKING_ASYNC=False), \
+                mock.patch.object(calendar_mirror, 'push_slot', side_effect=error), \
+                mock.patch.object(calendar_mirror, 'async_push_slot', new_callable=mock.AsyncMock, side_effect=error):
+            return self.book(self.alice)
+
+    def test_slot_taken_on_google_returns_409(self):
+        response = self.book_and_push(calendar_mirror.PushConflict('booked by user 7'))
+        self.assertEqual(response.status_code, 409)
+        booking = Booking.objects.get(slot=self.slot)
+        self.assertEqual((booking.status, booking.failure_reason), ('failed', 'conflict'))
+
+    @override_settings(CALENDAR_PUSH_MAX_ATTEMPTS=1)
+    def test_google_failing_after_every_retry_returns_503(self):
+        response = self.book_and_push(http_error(500))
+        self.assertEqual(response.status_code, 503)
+        self.assertIn('Retry-After', response)
+        booking = Booking.objects.get(slot=self.slot)
+        self.assertEqual((booking.status, booking.failure_reason), ('failed', 'unavailable'))
+        self.slot.refresh_from_db()
+        self.assertFalse(self.slot.is_booked)
+
+    def test_open_breaker_returns_503_and_keeps_the_booking_queued(self):
+        cache.set(calendar_quota.BREAKER_KEY, {'until': time.time() + 30}, timeout=None)
+        response = self.book(self.alice)
+        self.assertEqual(response.status_code, 503)
+        self.assertTrue(1 <= int(response['Retry-After']) <= 30)
+        self.assertEqual(response.json()['booking']['status'], 'pending')
+        self.assertIn('status_url', response.json())
+
+    def test_pending_status_answers_202_with_retry_after(self):
+        booking_id = self.book(self.alice).json()['booking']['booking_id']
+        response = client_for(self.alice).get(f'/calendar/bookings/{booking_id}/')
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(response['Retry-After'], '1')
+
+        Booking.objects.filter(pk=booking_id).update(status='booked')
+        response = client_for(self.alice).get(f'/calendar/bookings/{booking_id}/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['booking']['status'], 'booked')
+
+    def test_sync_status_view_does_not_wait(self):
+        booking_id = self.book(self.alice).json()['booking']['booking_id']
+        request = APIRequestFactory().get(f'/calendar/bookings/{booking_id}/', {'wait': 20})
+        force_authenticate(request, user=self.alice)
+        started = time.monotonic()
+        response = calendar_views.booking_status(request, booking_id)
+        self.assertLess(time.monotonic() - started, 1)
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(response['Retry-After'], '1')
+
+    def test_cancelling_starts_a_cooldown(self):
+        self.book(self.alice)
+        response = client_for(self.alice).post('/calendar/cancel_booking/', self.payload, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.slot.refresh_from_db()
+        self.assertFalse(self.slot.is_booked)
+
+        response = self.book(self.alice)
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('recently cancelled', response.json()['error'])
+        # Other users can take the freed slot meanwhile
+        self.assertEqual(self.book(self.bob).status_code, 202)
+
+
+class CodeTests(StateTestCase):
+    def test_code_is_used_up_by_the_first_check(self):
+        code = state.issue_code('verify', 1, ttl=60)
+        self.assertTrue(state.consume_code('verify', 1, code))
+        self.assertFalse(state.consume_code('verify', 1, code))
+
+    def test_wrong_code_purpose_or_user_is_refused(self):
+        code = state.issue_code('verify', 1, ttl=60)
+        self.assertFalse(state.consume_code('password_reset', 1, code))
+        self.assertFalse(state.consume_code('verify', 2, code))
+        self.assertFalse(state.consume_code('verify', 1, ''))
+
+    def test_new_code_replaces_the_previous_one(self):
+        state.store_code('verify', 1, '111111', ttl=60)
+        state.store_code('verify', 1, '222222', ttl=60)
+        self.assertFalse(state.consume_code('verify', 1, '111111'))
+        self.assertTrue(state.consume_code('verify', 1, '222222'))
+
+    def test_expired_code_is_refused(self):
+        code = state.issue_code('verify', 1, ttl=60)
+        # The cache entry may outlive its TTL (e.g. DatabaseCache), so the
+        # stored expiry is what counts
+        with mock.patch('stadium_api.state.time') as clock:
+            clock.time.return_value = time.time() + 61
+            self.assertFalse(state.consume_code('verify', 1, code))
+
+    def test_verify_code_endpoint_refuses_an_expired_code(self):
+        user = create_user_with_profile('carol', 'carol@example.com', 'correct horse battery staple')
+        code = state.issue_code('verify', user.id, ttl=60)
+        client = api_client()
+        with mock.patch('stadium_api.state.time') as clock:
+            clock.time.return_value = time.time() + 61
+            response = client.post('/auth/verify-code/', {'userId': user.id, 'code': code}, format='json')
+        self.assertEqual(response.status_code, 400)
+        user.profile.refresh_from_db()
+        self.assertFalse(user.profile.is_verified)
+
+        response = client.post('/auth/verify-code/', {'userId': user.id, 'code': code}, format='json')
+        self.assertEqual(response.status_code, 200)
+        user.profile.refresh_from_db()
+        self.assertTrue(user.profile.is_verified)
+
+
+class TokenRevocationTests(StateTestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = make_user('dave')
+        self.client = client_for(self.user)
+
+    def revoke(self):
+        # The cached version is dropped once the transaction commits
+        with self.captureOnCommitCallbacks(execute=True):
+            revoke_tokens(self.user)
+
+    def test_revoked_token_is_refused_on_reads_answered_from_claims(self):
+        self.assertEqual(self.client.get('/calendar/my_bookings/').status_code, 200)
+        self.revoke()
+        self.assertEqual(self.client.get('/calendar/my_bookings/').status_code, 401)
+
+    def test_revoked_token_is_refused_where_the_full_user_is_loaded(self):
+        self.assertEqual(self.client.get('/users/me/').status_code, 200)
+        self.revoke()
+        self.assertEqual(self.client.get('/users/me/').status_code, 401)
+
+    def test_new_token_works_after_revocation(self):
+        self.revoke()
+        self.user.profile.refresh_from_db()
+        self.assertEqual(client_for(self.user).get('/users/me/').status_code, 200)
+
+    def test_deactivating_the_user_revokes_its_tokens(self):
+        self.user.is_active = False
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.save()
+        self.assertEqual(self.client.get('/calendar/my_bookings/').status_code, 401)
+
+
+@override_settings(CALENDAR_WATCH_BACKEND='stadium_api.calendar_watch.LocalWatchBackend')
+class WatchNotificationTests(StateTestCase):
+    def setUp(self):
+        super().setUp()
+        calendar_watch.get_backend.cache_clear()
+        self.addCleanup(calendar_watch.get_backend.cache_clear)
+        self.backend = calendar_watch.get_backend()
+        self.channel = calendar_watch.open_channel(CALENDAR_ID)
+        self.sync_state = CalendarSyncState.objects.create(calendar_id=CALENDAR_ID, last_synced_at=timezone.now())
+
+    def post(self, token):
+        return self.client.post(
+            '/calendar/notifications/',
+            secure=True,
+            HTTP_HOST='localhost',
+            HTTP_X_GOOG_CHANNEL_ID=self.channel.channel_id,
+            HTTP_X_GOOG_CHANNEL_TOKEN=token,
+            HTTP_X_GOOG_RESOURCE_ID=self.channel.resource_id,
+            HTTP_X_GOOG_RESOURCE_STATE='exists',
+        )
+
+    def test_notification_flags_the_calendar_for_sync(self):
+        response = self.backend.notify(CALENDAR_ID, client=self.client)
+        self.assertEqual(response.status_code, 200)
+        self.sync_state.refresh_from_db()
+        self.assertIsNone(self.sync_state.last_synced_at)
+
+    def test_sync_message_does_not_flag_the_calendar(self):
+        self.backend.notify(CALENDAR_ID, resource_state='sync', client=self.client)
+        self.sync_state.refresh_from_db()
+        self.assertIsNotNone(self.sync_state.last_synced_at)
+
+    def test_bad_token_is_rejected(self):
+        response = self.post('not-the-token')
+        self.assertEqual(response.status_code, 403)
+        self.sync_state.refresh_from_db()
+        self.assertIsNotNone(self.sync_state.last_synced_at)
+
+    def test_missing_token_is_rejected(self):
+        response = self.post('')
+        self.assertEqual(response.status_code, 403)
+
+
+@override_settings(CALENDAR_WATCH_BACKEND='stadium_api.calendar_watch.LocalWatchBackend')
+class WatchRenewalTests(StateTestCase):
+    def setUp(self):
+        super().setUp()
+        calendar_watch.get_backend.cache_clear()
+        self.addCleanup(calendar_watch.get_backend.cache_clear)
+        self.create_stadium()
+
+    def run_worker_once(self):
+        with mock.patch.object(calendar_sync, 'sync_all', return_value=0), \
+                mock.patch.object(calendar_sync, 'sync_notified', return_value=0), \
+                mock.patch('stadium_api.calendar_mirror.push_pending', return_value=0), \
+                mock.patch.object(calendar_batch, 'generate_requested_slots', return_value=0):
+            call_command('run_calendar_worker', '--once', stdout=mock.Mock())
+
+    def test_calendar_worker_opens_and_renews_channels(self):
+        self.run_worker_once()
+        channel = CalendarWatchChannel.objects.get(calendar_id=CALENDAR_ID)
+
+        # A channel close to expiring is replaced and the old one stopped
+        CalendarWatchChannel.objects.filter(pk=channel.pk).update(expiration=timezone.now() + timedelta(hours=1))
+        self.run_worker_once()
+        renewed = CalendarWatchChannel.objects.get(calendar_id=CALENDAR_ID)
+        self.assertNotEqual(renewed.channel_id, channel.channel_id)
+        self.assertGreater(renewed.expiration, timezone.now() + timedelta(days=2))
+
+    def test_renewal_failure_does_not_stop_the_worker(self):
+        with mock.patch.object(calendar_watch, 'renew_channels', side_effect=RuntimeError('no credentials')):
+            self.run_worker_once()
+        self.assertFalse(CalendarWatchChannel.objects.exists())
+
+
+@skipUnless(settings.CALENDAR_ASYNC_VIEWS, 'the async calendar views are not routed')
+class AsyncCalendarViewTests(StateTestCase):
+    def setUp(self):
+        super().setUp()
+        self.stadium = self.create_stadium()
+        start = timezone.now() + timedelta(days=1)
+        self.slot = Slot.objects.create(
+            calendar_id=CALENDAR_ID,
+            event_id='match1',
+            start=start,
+            end=start + timedelta(hours=1)
+        )
+        self.user = make_user('erin')
+        self.headers = {'Authorization': bearer(self.user)}
+
+    async def test_booking_status_reloads_a_cold_stadium_index(self):
+        booking = await Booking.objects.acreate(slot=self.slot, user=self.user, status='booked')
+        # As after another process edited a stadium
+        stadiums._index = None
+        response = await self.async_client.get(f'/calendar/bookings/{booking.id}/', headers=self.headers)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['booking']['stadiumName'], 'Test Pitch')
+
+    async def test_available_slots_syncs_before_reading_the_cache(self):
+        date = self.slot.start.astimezone(self.stadium.tzinfo).date()
+        with mock.patch.object(calendar_sync, 'async_sync_if_stale', return_value=0) as async_sync, \
+                mock.patch.object(calendar_sync, 'sync_if_stale') as blocking_sync:
+            response = await self.async_client.get(
+                '/calendar/available_slots/',
+                {'date': date.isoformat(), 'calendar_id': CALENDAR_ID},
+                headers=self.headers
+            )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()['slots']), 1)
+        async_sync.assert_awaited_once_with(CALENDAR_ID)
+        blocking_sync.assert_not_called()
+
+
+class SlotMaintenanceTests(StateTestCase):
+    def setUp(self):
+        super().setUp()
+        self.stadium = self.create_stadium()
+
+    def make_slot(self, event_id, **fields):
+        start = timezone.now() + timedelta(days=1)
+        return Slot.objects.create(
+            calendar_id=CALENDAR_ID, event_id=event_id, start=start, end=start + timedelta(hours=1), **fields
+        )
+
+    @mock.patch.object(calendar_batch, 'get_calendar_service')
+    def test_delete_keeps_the_local_slot_when_google_refuses(self, _service):
+        for event_id in ('gone', 'stuck'):
+            self.make_slot(event_id)
+        self.make_slot('booked', is_booked=True)
+        with mock.patch.object(calendar_batch, 'execute', return_value=({'gone': None}, {'stuck': Exception()})) as execute:
+            deleted, skipped, errors = calendar_batch.delete_slots(CALENDAR_ID, ['gone', 'stuck', 'booked'])
+        self.assertEqual(set(execute.call_args.args[0]), {'gone', 'stuck'})
+        self.assertEqual((deleted, skipped, list(errors)), (1, ['booked'], ['stuck']))
+        self.assertEqual(
+            set(Slot.objects.values_list('event_id', flat=True)),
+            {'stuck', 'booked'}
+        )
+
+    def test_generation_starts_tomorrow_in_the_stadium_time_zone(self):
+        calendar_batch.request_slot_generation([self.stadium])
+        with mock.patch.object(calendar_batch, 'generate_slots', return_value=(3, {})) as generate:
+            self.assertEqual(calendar_batch.generate_requested_slots(), 3)
+        tomorrow = timezone.now().astimezone(self.stadium.tzinfo).date() + timedelta(days=1)
+        self.assertEqual(generate.call_args.args[1], tomorrow)
+        self.stadium.refresh_from_db()
+        self.assertIsNone(self.stadium.slots_requested_at)
+
+    @override_settings(SLOT_GENERATION_MAX_ATTEMPTS=2)
+    def test_failed_generation_backs_off_then_gives_up(self):
+        calendar_batch.request_slot_generation([self.stadium])
+        with mock.patch.object(calendar_batch, 'generate_slots', side_effect=RuntimeError('no credentials')):
+            calendar_batch.generate_requested_slots()
+            self.stadium.refresh_from_db()
+            self.assertEqual(self.stadium.slot_generation_attempts, 1)
+            self.assertGreater(self.stadium.slots_requested_at, timezone.now())
+
+            # Not due yet, so the next pass leaves it alone
+            self.assertEqual(calendar_batch.generate_requested_slots(), 0)
+            self.assertEqual(calendar_batch.generate_slots.call_count, 1)
+
+            Stadium.objects.filter(pk=self.stadium.pk).update(slots_requested_at=timezone.now())
+            calendar_batch.generate_requested_slots()
+        self.stadium.refresh_from_db()
+        self.assertIsNone(self.stadium.slots_requested_at)
+        self.assertEqual(self.stadium.slot_generation_attempts, 0)
+
+
+class StadiumIndexTests(StateTestCase):
+    def test_index_is_refreshed_only_after_commit(self):
+        self.assertIsNone(stadiums.get_stadium(CALENDAR_ID))
+        with self.captureOnCommitCallbacks() as callbacks:
+            Stadium.objects.create(name='Test Pitch', calendar_id=CALENDAR_ID)
+            # Still the index loaded before the edit
+            self.assertIsNone(stadiums.get_stadium(CALENDAR_ID))
+        for callback in callbacks:
+            callback()
+        self.assertEqual(stadiums.get_stadium(CALENDAR_ID).name, 'Test Pitch')
+
+
+TUNIS = ZoneInfo('Africa/Tunis')
+
+
+def at(hour, minute=0, day=1):
+    return datetime(2024, 6, day, hour, minute, tzinfo=TUNIS)
+
+
+class IntervalTests(SimpleTestCase):
+    def test_merge_joins_overlapping_and_touching_intervals(self):
+        merged = intervals.merge([(at(12), at(13)), (at(9), at(10)), (at(10), at(11)), (at(12, 30), at(12, 45))])
+        self.assertEqual(merged, [(at(9), at(11)), (at(12), at(13))])
+
+    def test_overlap_is_half_open(self):
+        busy = intervals.BusyIntervals([(at(10), at(11)), (at(14), at(16))])
+        self.assertTrue(busy.overlaps(at(10, 30), at(11, 30)))
+        self.assertTrue(busy.overlaps(at(13), at(17)))  # covers a busy interval
+        self.assertTrue(busy.overlaps(at(14, 30), at(15)))  # inside one
+        self.assertFalse(busy.overlaps(at(11), at(12)))  # starts as one ends
+        self.assertFalse(busy.overlaps(at(9), at(10)))  # ends as one starts
+        self.assertFalse(busy.overlaps(at(17), at(18)))
+        self.assertFalse(intervals.BusyIntervals([]).overlaps(at(9), at(10)))
+
+    def test_free_matches_a_pairwise_check(self):
+        busy = [(at(9, 30), at(10, 15)), (at(13), at(15)), (at(14), at(14, 30)), (at(20), at(23))]
+        grid = intervals.day_grid(date(2024, 6, 1), clock_time(9), clock_time(21), 60, TUNIS)
+        expected = [
+            (start, end) for start, end in grid
+            if not any(start < busy_end and busy_start < end for busy_start, busy_end in busy)
+        ]
+        self.assertEqual(intervals.free(grid, busy), expected)
+        self.assertEqual(
+            [start.hour for start, _ in expected],
+            [11, 12, 15, 16, 17, 18, 19]
+        )
+
+    def test_free_with_a_key(self):
+        slots = [{'start': at(9), 'end': at(10)}, {'start': at(10), 'end': at(11)}]
+        free = intervals.free(slots, [(at(9, 30), at(9, 45))], key=lambda slot: (slot['start'], slot['end']))
+        self.assertEqual(free, slots[1:])
+
+    def test_day_grid_drops_the_short_remainder_and_crosses_midnight(self):
+        grid = intervals.day_grid(date(2024, 6, 1), clock_time(22), clock_time(1, 30), 60, TUNIS)
+        self.assertEqual(grid, [(at(22), at(23)), (at(23), at(0, day=2)), (at(0, day=2), at(1, day=2))])
+
+
+@mock.patch.object(calendar_sync, 'sync_many_if_stale', return_value={})
+class AvailabilityTests(StateTestCase):
+    def setUp(self):
+        super().setUp()
+        self.stadium = self.create_stadium()
+        self.day = timezone.now().astimezone(self.stadium.tzinfo).date() + timedelta(days=1)
+        for hour, event_id in ((10, 'ten'), (11, 'eleven')):
+            start = datetime.combine(self.day, clock_time(hour), tzinfo=self.stadium.tzinfo)
+            Slot.objects.create(calendar_id=CALENDAR_ID, event_id=event_id, start=start, end=start + timedelta(hours=1))
+        self.client = client_for(make_user('frank'))
+        self.params = {
+            'start': self.day.isoformat(),
+            'end': (self.day + timedelta(days=1)).isoformat(),
+            'calendar_ids': CALENDAR_ID,
+        }
+
+    def test_lists_free_slots_per_stadium_and_day(self, _sync):
+        response = self.client.get('/calendar/availability/', self.params)
+        self.assertEqual(response.status_code, 200)
+        [stadium] = response.json()['stadiums']
+        self.assertEqual((stadium['id'], stadium['ok']), (CALENDAR_ID, True))
+        days = stadium['days']
+        self.assertEqual(list(days), [self.day.isoformat(), (self.day + timedelta(days=1)).isoformat()])
+        self.assertEqual([slot[2] for slot in days[self.day.isoformat()]], ['ten', 'eleven'])
+        self.assertEqual(days[(self.day + timedelta(days=1)).isoformat()], [])
+
+    def test_unchanged_availability_answers_304(self, _sync):
+        etag = self.client.get('/calendar/availability/', self.params)['ETag']
+        response = self.client.get('/calendar/availability/', self.params, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], etag)
+
+        Slot.objects.filter(event_id='ten').update(is_booked=True)
+        response = self.client.get('/calendar/availability/', self.params, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertEqual([slot[2] for slot in response.json()['stadiums'][0]['days'][self.day.isoformat()]], ['eleven'])
+
+    def test_rejects_bad_ranges_and_unknown_stadiums(self, _sync):
+        self.assertEqual(self.client.get('/calendar/availability/').status_code, 400)
+        too_long = dict(self.params, end=(self.day + timedelta(days=365)).isoformat())
+        self.assertEqual(self.client.get('/calendar/availability/', too_long).status_code, 400)
+        unknown = dict(self.params, calendar_ids='nope@group.calendar.google.com')
+        self.assertEqual(self.client.get('/calendar/availability/', unknown).status_code, 404)
+
+
+def http_error(status, reason=b''):
+    return HttpError(httplib2.Response({'status': status}), reason)
+
+
+@override_settings(
+    GOOGLE_CALENDAR_QPS=2, GOOGLE_CALENDAR_CALENDAR_QPS=1, GOOGLE_CALENDAR_MAX_RETRIES=0,
+    GOOGLE_CALENDAR_BREAKER_THRESHOLD=2, GOOGLE_CALENDAR_BREAKER_COOLDOWN=30,
+)
+class QuotaTests(SimpleTestCase):
+    def setUp(self):
+        cache.clear()
+        patcher = mock.patch('stadium_api.calendar_quota.time')
+        self.clock = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.clock.time.return_value = 1000.25
+        self.clock.monotonic.return_value = 0
+
+    def test_a_busy_calendar_leaves_the_project_quota_to_others(self):
+        self.assertEqual(calendar_quota._try_acquire('a', 1), 0)
+        self.assertEqual(calendar_quota._try_acquire('a', 1), 0.75)
+        self.assertEqual(calendar_quota._try_acquire('b', 1), 0)
+        self.assertEqual(calendar_quota._try_acquire('c', 1), 0.75)
+
+        self.clock.time.return_value = 1001
+        self.assertEqual(calendar_quota._try_acquire('a', 1), 0)
+
+    def test_quota_errors_are_retried(self):
+        for reason in (b'rateLimitExceeded', b'quotaExceeded', b'dailyLimitExceeded'):
+            self.assertTrue(calendar_quota.is_retryable(http_error(403, b'{"reason": "%s"}' % reason)))
+        self.assertTrue(calendar_quota.is_retryable(http_error(503)))
+        self.assertFalse(calendar_quota.is_retryable(http_error(403, b'{"reason": "forbidden"}')))
+        self.assertFalse(calendar_quota.is_retryable(http_error(404)))
+
+    def test_breaker_opens_after_repeated_failures_and_closes_after_a_probe(self):
+        failing = mock.Mock(side_effect=http_error(500))
+        for _ in range(2):
+            self.clock.time.return_value += 1
+            with self.assertRaises(HttpError):
+                calendar_quota.call(None, failing)
+        self.assertTrue(calendar_quota.breaker_open())
+
+        working = mock.Mock(return_value='ok')
+        with self.assertRaises(calendar_quota.CalendarUnavailable):
+            calendar_quota.call(None, working)
+        working.assert_not_called()
+
+        self.clock.time.return_value += 31
+        self.assertEqual(calendar_quota.call(None, working), 'ok')
+        self.assertFalse(calendar_quota.breaker_open())
+        self.assertIsNone(cache.get(calendar_quota.BREAKER_KEY))
+
+    def test_a_failed_probe_reopens_the_breaker(self):
+        cache.set(calendar_quota.BREAKER_KEY, {'until': 1000}, timeout=None)
+        with self.assertRaises(HttpError):
+            calendar_quota.call(None, mock.Mock(side_effect=http_error(502)))
+        self.assertTrue(calendar_quota.breaker_open())
+
+    def test_a_refused_request_does_not_open_the_breaker(self):
+        for _ in range(3):
+            self.clock.time.return_value += 1
+            with self.assertRaises(HttpError):
+                calendar_quota.call(None, mock.Mock(side_effect=http_error(404)))
+        self.assertFalse(calendar_quota.breaker_open())
+
+
+@override_settings(METRICS_TOKEN='scrape-me')
+class MetricsTests(StateTestCase):
+    series = 'stadium_requests_total{method="GET",route="^users/me/$",status="200"}'
+
+    def setUp(self):
+        super().setUp()
+        # The process entry went with the cache; number the process again
+        metrics.counters.number = None
+        self.client = client_for(make_user('grace'))
+
+    def scrape(self, **headers):
+        return api_client().get('/metrics/', **headers)
+
+    def count(self, series):
+        for line in self.scrape(HTTP_AUTHORIZATION='Bearer scrape-me').content.decode().splitlines():
+            if line.startswith(series + ' '):
+                return float(line.split()[-1])
+        return 0
+
+    def test_response_says_where_the_time_went(self):
+        response = self.client.get('/users/me/')
+        self.assertEqual(response.status_code, 200)
+        spans = {entry.split(';')[0] for entry in response['Server-Timing'].split(', ')}
+        self.assertIn('db', spans)
+        self.assertIn('total', spans)
+
+    def test_requests_are_counted_per_route(self):
+        before = self.count(self.series)
+        self.client.get('/users/me/')
+        self.client.get('/users/me/')
+        self.assertEqual(self.count(self.series), before + 2)
+        self.assertGreater(self.count('stadium_span_calls_total{span="db"}'), 0)
+
+    def test_totals_of_all_processes_are_added(self):
+        self.client.get('/users/me/')
+        before = self.count(self.series)
+        other = cache.incr(metrics.PROCESSES_KEY)
+        key = ('stadium_requests_total', (('method', 'GET'), ('route', '^users/me/$'), ('status', '200')))
+        cache.set(metrics._process_key(other), {key: 5.0}, timeout=None)
+        self.assertEqual(self.count(self.series), before + 5)
+
+    def test_scraping_needs_the_token(self):
+        self.assertEqual(self.scrape().status_code, 401)
+        self.assertEqual(self.scrape(HTTP_AUTHORIZATION='Bearer wrong').status_code, 401)
+        response = self.scrape(HTTP_AUTHORIZATION='Bearer scrape-me')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response['Content-Type'].startswith('text/plain'))
+        with self.settings(METRICS_TOKEN=''):
+            self.assertEqual(self.scrape().status_code, 404)
+
+
+@override_settings(PASSWORD_PBKDF2_ITERATIONS=1000)
+class PasswordHasherTests(StateTestCase):
+    password = 'correct horse battery staple'
+
+    def login(self, user):
+        return api_client().post('/auth/login/', {'username': user.username, 'password': self.password}, format='json')
+
+    def hash_details(self, user):
+        user.refresh_from_db()
+        return identify_hasher(user.password).decode(user.password)
+
+    def test_new_hashes_use_the_configured_iterations(self):
+        self.assertTrue(make_password(self.password).startswith('pbkdf2_sha256$1000$'))
+        with self.settings(PASSWORD_PBKDF2_ITERATIONS=1500):
+            self.assertTrue(make_password(self.password).startswith('pbkdf2_sha256$1500$'))
+
+    def test_login_rehashes_with_the_current_cost(self):
+        user = make_user('heidi')
+        self.assertEqual(self.hash_details(user)['iterations'], 1000)
+        with self.settings(PASSWORD_PBKDF2_ITERATIONS=1500):
+            self.assertEqual(self.login(user).status_code, 200)
+        self.assertEqual(self.hash_details(user)['iterations'], 1500)
+
+    def test_login_moves_older_algorithms_to_the_current_policy(self):
+        user = make_user('ivan')
+        user.password = make_password(self.password, hasher='pbkdf2_sha1')
+        user.save(update_fields=['password'])
+        self.assertEqual(self.login(user).status_code, 200)
+        self.assertEqual(self.hash_details(user)['algorithm'], 'pbkdf2_sha256')
+
+    def test_wrong_password_keeps_the_old_hash(self):
+        user = make_user('judy')
+        old = user.password
+        with self.settings(PASSWORD_PBKDF2_ITERATIONS=1500):
+            response = api_client().post('/auth/login/', {'username': 'judy', 'password': 'wrong'}, format='json')
+        self.assertEqual(response.status_code, 401)
+        user.refresh_from_db()
+        self.assertEqual(user.password, old)
+
+    @skipUnless(find_spec('argon2'), 'argon2-cffi is not installed')
+    def test_argon2_costs_follow_the_settings(self):
+        hashers = ['stadium_api.hashers.Argon2PasswordHasher', 'stadium_api.hashers.PBKDF2PasswordHasher']
+        with self.settings(PASSWORD_HASHERS=hashers, PASSWORD_ARGON2_TIME_COST=1,
+                           PASSWORD_ARGON2_MEMORY_COST=8, PASSWORD_ARGON2_PARALLELISM=1):
+            user = make_user('mallory')
+            self.assertEqual(self.hash_details(user)['time_cost'], 1)
+            with self.settings(PASSWORD_ARGON2_TIME_COST=2):
+                self.assertEqual(self.login(user).status_code, 200)
+            self.assertEqual(self.hash_details(user)['time_cost'], 2)
+
+
+class SlidingWindowTests(SimpleTestCase):
+    key = 'throttle:test'
+
+    def setUp(self):
+        cache.clear()
+
+    def test_previous_window_drains_gradually(self):
+        for _ in range(10):
+            throttling.count(self.key, 60, 6030)
+        self.assertEqual(throttling.check(self.key, 10, 60, 6059), 1)
+        # At the start of the next window the whole previous count still applies
+        self.assertAlmostEqual(throttling.check(self.key, 10, 60, 6060), 6)
+        self.assertEqual(throttling.check(self.key, 10, 60, 6067), 0)
+        self.assertEqual(throttling.check(self.key, 10, 60, 6090), 0)
+
+    def test_checking_does_not_count(self):
+        for _ in range(5):
+            self.assertEqual(throttling.check(self.key, 1, 60, 6000), 0)
+        throttling.count(self.key, 60, 6000)
+        self.assertEqual(throttling.check(self.key, 1, 60, 6000), 60)
+
+
+@override_settings(REST_FRAMEWORK=dict(
+    settings.REST_FRAMEWORK,
+    DEFAULT_THROTTLE_RATES=dict(
+        settings.REST_FRAMEWORK['DEFAULT_THROTTLE_RATES'], verify_code_ip='3/hour', verify_code_account='2/hour'
+    ),
+))
+class ThrottleTests(StateTestCase):
+    def verify(self, user, ip):
+        return api_client().post(
+            '/auth/verify-code/', {'userId': user.id, 'code': '000000'}, format='json', HTTP_X_FORWARDED_FOR=ip
+        )
+
+    def test_account_limit_holds_across_addresses(self):
+        user = make_user('ken')
+        self.assertEqual(self.verify(user, '10.0.0.1').status_code, 400)
+        self.assertEqual(self.verify(user, '10.0.0.2').status_code, 400)
+        response = self.verify(user, '10.0.0.3')
+        self.assertEqual(response.status_code, 429)
+        self.assertGreater(int(response['Retry-After']), 0)
+
+    def test_refused_requests_do_not_use_up_the_address_limit(self):
+        ken, leo = make_user('ken'), make_user('leo')
+        for _ in range(2):
+            self.assertEqual(self.verify(ken, '10.0.0.1').status_code, 400)
+        self.assertEqual(self.verify(ken, '10.0.0.1').status_code, 429)
+        self.assertEqual(self.verify(leo, '10.0.0.1').status_code, 400)
+        self.assertEqual(self.verify(leo, '10.0.0.1').status_code, 429)
+
+
+class IndexPageTests(StateTestCase):
+    def setUp(self):
+        super().setUp()
+        app_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(app_dir.cleanup)
+        self.index_path = os.path.join(app_dir.name, 'index.html')
+        self.write_index(b'<!DOCTYPE html><div id="root"></div>')
+        override = self.settings(DEBUG=False, REACT_APP_DIR=app_dir.name)
+        override.enable()
+        self.addCleanup(override.disable)
+
+    def write_index(self, body):
+        with open(self.index_path, 'wb') as f:
+            f.write(body)
+
+    def get(self, accept_encoding='', **headers):
+        return api_client().get('/stadiums/pitch-1/', HTTP_ACCEPT_ENCODING=accept_encoding, **headers)
+
+    def test_serves_gzip_to_clients_that_accept_it(self):
+        response = self.get('gzip, deflate')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(gzip.decompress(response.content), b'<!DOCTYPE html><div id="root"></div>')
+        self.assertTrue(response['ETag'].endswith('-gz"'))
+        self.assertIn('Accept-Encoding', response['Vary'])
+        self.assertEqual(response['Cache-Control'], 'no-cache')
+
+    def test_q_zero_refuses_an_encoding(self):
+        for header in ('gzip;q=0', 'gzip; q=0.0, identity', '*;q=0', 'identity'):
+            response = self.get(header)
+            self.assertFalse(response.has_header('Content-Encoding'), header)
+            self.assertEqual(response.content, b'<!DOCTYPE html><div id="root"></div>')
+        self.assertEqual(self.get('*')['Content-Encoding'], 'br' if frontend.brotli else 'gzip')
+        self.assertEqual(self.get('br;q=0, gzip;q=0.5')['Content-Encoding'], 'gzip')
+
+    def test_revalidation_and_a_new_build(self):
+        etag = self.get('gzip')['ETag']
+        response = self.get('gzip', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertNotEqual(self.get()['ETag'], etag)
+
+        self.write_index(b'<!DOCTYPE html><div id="root"></div><script src="/static/js/new.js"></script>')
+        os.utime(self.index_path, ns=(0, time.time_ns() + 10**9))
+        response = self.get('gzip', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b'new.js', gzip.decompress(response.content))
+
+
+class UserRefreshTests(StateTestCase):
+    def setUp(self):
+        super().setUp()
+        self.create_stadium()
+        self.user = make_user('olivia')
+
+    @mock.patch.object(calendar_sync, 'fetch_user_events', return_value=[])
+    def test_unsynced_calendar_is_fetched_once_per_max_age(self, fetch):
+        self.assertEqual(calendar_sync.refresh_for_user(CALENDAR_ID, self.user.id), 0)
+        self.assertEqual(calendar_sync.refresh_for_user(CALENDAR_ID, self.user.id), 0)
+        self.assertEqual(fetch.call_count, 1)
+        # Another user's bookings are fetched separately
+        calendar_sync.refresh_for_user(CALENDAR_ID, self.user.id + 1)
+        self.assertEqual(fetch.call_count, 2)
+
+    def test_failed_fetch_is_retried_on_the_next_request(self):
+        with mock.patch.object(calendar_sync, 'fetch_user_events', side_effect=http_error(503)):
+            with self.assertRaises(HttpError):
+                calendar_sync.refresh_for_user(CALENDAR_ID, self.user.id)
+        with mock.patch.object(calendar_sync, 'fetch_user_events', return_value=[]) as fetch:
+            calendar_sync.refresh_for_user(CALENDAR_ID, self.user.id)
+        fetch.assert_called_once()
+
+    def test_synced_calendar_uses_the_incremental_sync(self):
+        CalendarSyncState.objects.create(calendar_id=CALENDAR_ID, sync_token='token', last_synced_at=timezone.now())
+        with mock.patch.object(calendar_sync, 'fetch_events') as fetch, \
+                mock.patch.object(calendar_sync, 'fetch_user_events') as fetch_user:
+            self.assertEqual(calendar_sync.refresh_for_user(CALENDAR_ID, self.user.id), 0)
+        fetch.assert_not_called()
+        fetch_user.assert_not_called()
+
+    async def test_async_refresh_is_fetched_once_per_max_age(self):
+        with mock.patch.object(calendar_sync, '_async_list_events', return_value=([], None)) as list_events:
+            await calendar_sync.async_refresh_for_user(CALENDAR_ID, self.user.id)
+            await calendar_sync.async_refresh_for_user(CALENDAR_ID, self.user.id)
+        self.assertEqual(list_events.await_count, 1)
+
+
+class FullResyncTests(StateTestCase):
+    def setUp(self):
+        super().setUp()
+        self.stadium = self.create_stadium()
+        start = timezone.now() + timedelta(days=1)
+        self.slots = [
+            Slot.objects.create(
+                calendar_id=CALENDAR_ID, event_id=event_id, start=start, end=start + timedelta(hours=1)
+            )
+            for event_id in ('kept', 'gone')
+        ]
+        self.user = make_user('peggy')
+
+    def event(self, slot):
+        return {
+            'id': slot.event_id,
+            'description': 'match',
+            'start': {'dateTime': slot.start.isoformat()},
+            'end': {'dateTime': slot.end.isoformat()},
+            'etag': '"1"',
+        }
+
+    def test_removed_slot_keeps_its_bookings(self):
+        kept, gone = self.slots
+        booking = Booking.objects.create(slot=gone, user=self.user, status='booked')
+        old = Booking.objects.create(slot=gone, user=self.user, status='cancelled')
+        calendar_sync.apply_events(CALENDAR_ID, [self.event(kept)], full=True)
+
+        self.assertEqual(list(Slot.objects.values_list('event_id', flat=True)), ['kept'])
+        booking.refresh_from_db()
+        self.assertEqual((booking.slot, booking.status), (None, 'cancelled'))
+        old.refresh_from_db()
+        self.assertIsNone(old.slot)
+
+        response = client_for(self.user).get(f'/calendar/bookings/{booking.id}/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['booking']['status'], 'cancelled')
+
+    def test_worker_skips_a_calendar_a_request_is_syncing(self):
+        only_this_stadium = mock.patch.object(calendar_sync, 'active_stadiums', return_value=[self.stadium])
+        only_this_stadium.start()
+        self.addCleanup(only_this_stadium.stop)
+        cache.add(calendar_sync._sync_lock_key(CALENDAR_ID), 1)
+        with mock.patch.object(calendar_sync, 'fetch_events') as fetch:
+            self.assertEqual(calendar_sync.sync_all(), 0)
+        fetch.assert_not_called()
+
+        cache.delete(calendar_sync._sync_lock_key(CALENDAR_ID))
+        with mock.patch.object(calendar_sync, 'fetch_events', return_value=([], 'token')) as fetch:
+            calendar_sync.sync_all()
+        fetch.assert_called_once()
+        # The lock is released afterwards
+        self.assertTrue(cache.add(calendar_sync._sync_lock_key(CALENDAR_ID), 1))
+
+
+class EmailOutboxTests(StateTestCase):
+    def test_sent_message_keeps_no_code(self):
+        email = email_outbox.enqueue('Your code', 'Your code is 123456', ['quinn@example.com'])
+        connection = mail.get_connection('django.core.mail.backends.locmem.EmailBackend')
+        self.assertEqual(email_outbox.send_batch(connection), 1)
+        self.assertEqual(mail.outbox[0].body, 'Your code is 123456')
+        email.refresh_from_db()
+        self.assertEqual((email.status, email.body), ('sent', ''))
+
+    def test_purge_keeps_pending_and_recent_messages(self):
+        old = timezone.now() - timedelta(days=8)
+        for status in ('sent', 'failed', 'pending'):
+            email = email_outbox.enqueue(status, 'code', ['quinn@example.com'])
+            OutboxEmail.objects.filter(pk=email.pk).update(status=status, created_at=old)
+        email_outbox.enqueue('recent', 'code', ['quinn@example.com'])
+        OutboxEmail.objects.filter(subject='recent').update(status='sent')
+
+        self.assertEqual(email_outbox.purge_old(days=7), 2)
+        self.assertEqual(set(OutboxEmail.objects.values_list('subject', flat=True)), {'pending', 'recent'})
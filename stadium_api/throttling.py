@@ -0,0 +1,130 @@
+"""Sliding-window rate limits for the auth and booking endpoints.
+
+Each throttle guards one scope with two limits from
+``REST_FRAMEWORK['DEFAULT_THROTTLE_RATES']``: ``<scope>_ip`` per client IP
+and ``<scope>_account`` per account. The account is the authenticated user,
+or otherwise the ``userId`` or ``email`` the request is about, so one account
+cannot be hammered from many addresses.
+
+Counts live in the shared cache as one integer per fixed window, bumped with
+``cache.incr()`` so every worker sees them. The sliding window is estimated
+from the current window's count plus the previous window's count weighted by
+how much of it still overlaps. Both limits are checked before either is
+counted, so refused requests use up neither. DRF answers
+them with 429 and a ``Retry-After`` header before the view runs, so they
+never reach SMTP or Google.
+"""
+import hashlib
+import time
+
+from django.core.cache import cache
+from rest_framework.settings import api_settings
+from rest_framework.throttling import BaseThrottle
+
+DURATIONS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+
+
+def parse_rate(rate):
+    """``'10/hour'`` -> ``(10, 3600)``."""
+    num, period = rate.split('/')
+    return int(num), DURATIONS[period[0]]
+
+
+def _count(key, window, timeout):
+    key = f'{key}:{window}'
+    cache.add(key, 0, timeout=timeout)
+    try:
+        return cache.incr(key)
+    except ValueError:
+        # Expired between add() and incr()
+        cache.set(key, 1, timeout=timeout)
+        return 1
+
+
+def check(key, limit, duration, now):
+    """Seconds until one more request fits under ``limit``; 0 if it fits now.
+
+    Only reads the counts; ``count()`` records the request once every limit
+    it is subject to has allowed it.
+    """
+    window = int(now // duration)
+    elapsed = now - window * duration
+    counts = cache.get_many([f'{key}:{window}', f'{key}:{window - 1}'])
+    current = counts.get(f'{key}:{window}', 0)
+    previous = counts.get(f'{key}:{window - 1}', 0)
+    if previous * (1 - elapsed / duration) + current + 1 <= limit:
+        return 0
+    if previous and current < limit:
+        # Wait for the previous window's share to drain enough
+        return max(duration * (1 - (limit - current - 1) / previous) - elapsed, 1)
+    return duration - elapsed
+
+
+def count(key, duration, now):
+    _count(key, int(now // duration), duration * 2)
+
+
+class SlidingWindowThrottle(BaseThrottle):
+    """Per-IP and per-account limits for ``scope``; subclasses set the scope."""
+    scope = None
+    account_fields = ('userId', 'email')
+
+    def __init__(self):
+        self.wait_time = 0
+
+    def get_account(self, request):
+        user = getattr(request, 'user', None)
+        if user is not None and user.is_authenticated:
+            return f'user:{user.pk}'
+        data = getattr(request, 'data', None)
+        if not hasattr(data, 'get'):
+            return None
+        for field in self.account_fields:
+            value = str(data.get(field) or '').strip().lower()
+            if value:
+                return f'{field}:{value}'
+        return None
+
+    def allow_request(self, request, view):
+        rates = api_settings.DEFAULT_THROTTLE_RATES
+        now = time.time()
+        limits = []
+        for kind, ident in (('ip', self.get_ident(request)), ('account', self.get_account(request))):
+            rate = rates.get(f'{self.scope}_{kind}')
+            if rate is None or not ident:
+                continue
+            digest = hashlib.md5(ident.encode()).hexdigest()
+            limit, duration = parse_rate(rate)
+            limits.append((f'throttle:{self.scope}:{kind}:{digest}', limit, duration))
+
+        # Check every limit before counting, so a request refused by one
+        # limit does not use up the other
+        self.wait_time = max((check(key, limit, duration, now) for key, limit, duration in limits), default=0)
+        if self.wait_time:
+            return False
+        for key, _, duration in limits:
+            count(key, duration, now)
+        return True
+
+    def wait(self):
+        return self.wait_time or None
+
+
+class VerifyCodeThrottle(SlidingWindowThrottle):
+    scope = 'verify_code'
+
+
+class ResendCodeThrottle(SlidingWindowThrottle):
+    scope = 'resend_code'
+
+
+class PasswordResetThrottle(SlidingWindowThrottle):
+    scope = 'password_reset'
+
+
+class PasswordResetConfirmThrottle(SlidingWindowThrottle):
+    scope = 'password_reset_confirm'
+
+
+class BookSlotThrottle(SlidingWindowThrottle):
+    scope = 'book_slot'
@@ -1,3 +1,4 @@
+from django.conf import settings
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
 from .views import (
@@ -5,13 +6,21 @@ from .views import (
     user_login,
     register_user,
     available_slots,
+    availability,
     book_slot,
     cancel_booking,
     my_bookings,
+    booking_status,
+    calendar_notifications,
+    prometheus_metrics,
     request_password_reset,
     reset_password,
 )
 
+if settings.CALENDAR_ASYNC_VIEWS:
+    # Served by an ASGI server; see views/async_calendar_views.py
+    from .views.async_calendar_views import available_slots, book_slot, booking_status, cancel_booking, my_bookings
+
 router = DefaultRouter()
 router.register(r'users', UserViewSet)
 
@@ -24,7 +33,11 @@ urlpatterns = [
     path('auth/password-reset/', request_password_reset, name='request-password-reset'),
     path('auth/password-reset/confirm/', reset_password, name='reset-password'),
     path('calendar/available_slots/', available_slots, name='available-slots'),
+    path('calendar/availability/', availability, name='availability'),
     path('calendar/book_slot/', book_slot, name='book-slot'),
     path('calendar/cancel_booking/', cancel_booking, name='cancel-booking'),
     path('calendar/my_bookings/', my_bookings, name='my-bookings'),
+    path('calendar/bookings/<int:booking_id>/', booking_status, name='booking-status'),
+    path('calendar/notifications/', calendar_notifications, name='calendar-notifications'),
+    path('metrics/', prometheus_metrics, name='metrics'),
 ]
\ No newline at end of file
@@ -2,7 +2,8 @@
 
 from .user_views import UserViewSet, user_login
 from .auth import register_user, request_password_reset, reset_password
-from .calendar_views import available_slots, book_slot, cancel_booking, my_bookings
+from .monitoring import prometheus_metrics
+from .calendar_views import available_slots, availability, book_slot, cancel_booking, my_bookings, booking_status, calendar_notifications
 
 __all__ = [
     'UserViewSet',
@@ -11,7 +12,11 @@ __all__ = [
     'request_password_reset',
     'reset_password',
     'available_slots',
+    'availability',
     'book_slot',
     'cancel_booking',
     'my_bookings',
+    'booking_status',
+    'calendar_notifications',
+    'prometheus_metrics',
 ] 
\ No newline at end of file
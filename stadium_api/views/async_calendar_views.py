@@ -0,0 +1,242 @@
+"""Async versions of the calendar views, for running under an ASGI server.
+
+DRF has no async views, so these are plain Django views that authenticate
+with the same simplejwt backend and answer with the same payloads as their
+counterparts in ``calendar_views``. ``available_slots`` and ``my_bookings``
+sync stale calendars through the pooled async client, so a worker keeps
+serving other requests while Google answers and no thread waits on it. ORM
+work, including the slot-cache read, runs in a thread through
+``sync_to_async``. ``urls.py`` routes to these when ``CALENDAR_ASYNC_VIEWS``
+is on.
+"""
+import asyncio
+import json
+import logging
+from datetime import datetime
+from time import monotonic
+from functools import wraps
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.http import JsonResponse
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_GET, require_POST
+from rest_framework.exceptions import AuthenticationFailed, Throttled
+
+from .. import booking_service, calendar_mirror, calendar_sync, metrics, slot_cache
+from ..models import Booking
+from ..authentication import ClaimsJWTAuthentication
+from ..stadiums import active_stadiums, get_stadium
+from ..throttling import BookSlotThrottle
+from .calendar_views import (
+    BOOKING_POLL_INTERVAL,
+    booking_result,
+    booking_status_result,
+    bookings_payload,
+    query_available_slots,
+    serialize_booking,
+)
+
+logger = logging.getLogger(__name__)
+
+
+def json_response(data, status=200, headers=None):
+    """``JsonResponse`` with the encoding recorded as a ``serialize`` span."""
+    with metrics.span('serialize'):
+        return JsonResponse(data, status=status, headers=headers)
+
+
+def jwt_required(view):
+    """Authenticate the request like the DRF views' authentication + IsAuthenticated."""
+    authentication = ClaimsJWTAuthentication()
+
+    @wraps(view)
+    async def wrapper(request, *args, **kwargs):
+        try:
+            result = await sync_to_async(authentication.authenticate)(request)
+        except AuthenticationFailed as e:
+            detail = e.detail if isinstance(e.detail, dict) else {'detail': e.detail}
+            return json_response(detail, status=401)
+        if result is None:
+            return json_response({'detail': 'Authentication credentials were not provided.'}, status=401)
+        request.user, request.auth = result
+        return await view(request, *args, **kwargs)
+    return wrapper
+
+
+def throttled(throttle_class):
+    """Apply a DRF throttle, answering 429 with Retry-After like DRF does.
+
+    Goes inside ``jwt_required`` so per-account limits see the user.
+    """
+    def decorator(view):
+        @wraps(view)
+        async def wrapper(request, *args, **kwargs):
+            throttle = throttle_class()
+            if not await sync_to_async(throttle.allow_request, thread_sensitive=False)(request, None):
+                exc = Throttled(throttle.wait())
+                response = json_response({'detail': exc.detail}, status=exc.status_code)
+                response['Retry-After'] = '%d' % exc.wait
+                return response
+            return await view(request, *args, **kwargs)
+        return wrapper
+    return decorator
+
+
+async def refresh_calendar(calendar_id):
+    """``calendar_views.refresh_calendar`` over the async client."""
+    try:
+        await calendar_sync.async_sync_if_stale(calendar_id)
+    except Exception as e:
+        logger.warning("calendar.sync_failed calendar=%s error=%s", calendar_id, e)
+
+
+def request_data(request):
+    if request.content_type == 'application/json':
+        try:
+            return json.loads(request.body or b'{}')
+        except ValueError:
+            return {}
+    return request.POST
+
+
+@require_GET
+@jwt_required
+async def available_slots(request):
+    """Get available time slots for a specific date and calendar."""
+    date_str = request.GET.get('date')
+    calendar_id = request.GET.get('calendar_id')
+
+    if not date_str or not calendar_id:
+        return json_response({'error': 'Date and calendar_id are required'}, status=400)
+
+    stadium = await sync_to_async(get_stadium)(calendar_id)
+    if stadium is None:
+        return json_response({'error': 'Unknown stadium calendar'}, status=404)
+
+    try:
+        date = datetime.strptime(date_str, '%Y-%m-%d').date()
+
+        # Sync here rather than in the cache loader, which runs on the
+        # thread shared by all ORM calls and would hold it during Google calls
+        await refresh_calendar(calendar_id)
+        available_slots = await sync_to_async(slot_cache.get_slots)(
+            calendar_id,
+            date.isoformat(),
+            lambda: query_available_slots(stadium, date)
+        )
+
+        return json_response({'slots': available_slots})
+
+    except Exception as e:
+        logger.exception("available_slots.failed")
+        return json_response({'error': str(e)}, status=500)
+
+
+@csrf_exempt
+@require_POST
+@jwt_required
+@throttled(BookSlotThrottle)
+async def book_slot(request):
+    """Book a time slot."""
+    try:
+        data = request_data(request)
+        calendar_id = data.get('calendar_id')
+        event_id = data.get('event_id')
+
+        if not calendar_id or not event_id:
+            return json_response({'error': 'calendar_id and event_id are required'}, status=400)
+
+        try:
+            booking = await sync_to_async(booking_service.reserve_slot)(request.user, calendar_id, event_id)
+        except booking_service.BookingError as e:
+            return json_response({'error': e.message}, status=e.status_code)
+
+        if not settings.BOOKING_ASYNC:
+            # Write to Google now instead of waiting for the calendar worker
+            await calendar_mirror.async_push_pending(slot_ids=[booking.slot_id])
+            await booking.arefresh_from_db()
+
+        data, status_code, headers = await sync_to_async(booking_result)(request, booking)
+        return json_response(data, status=status_code, headers=headers)
+
+    except Exception as e:
+        logger.exception("book_slot.failed")
+        return json_response({'error': str(e)}, status=500)
+
+
+@csrf_exempt
+@require_POST
+@jwt_required
+async def cancel_booking(request):
+    """Cancel a booking."""
+    try:
+        data = request_data(request)
+        calendar_id = data.get('calendar_id')
+        event_id = data.get('event_id')
+
+        if not calendar_id or not event_id:
+            return json_response({'error': 'calendar_id and event_id are required'}, status=400)
+
+        try:
+            booking = await sync_to_async(booking_service.cancel_booking)(request.user, calendar_id, event_id)
+        except booking_service.BookingError as e:
+            return json_response({'error': e.message}, status=e.status_code)
+
+        return json_response({
+            'message': 'Booking cancelled successfully',
+            'booking': await sync_to_async(serialize_booking)(booking)
+        })
+
+    except Exception as e:
+        logger.exception("cancel_booking.failed")
+        return json_response({'error': str(e)}, status=500)
+
+
+@require_GET
+@jwt_required
+async def my_bookings(request):
+    """Get all bookings for the current user."""
+    try:
+        stadiums = await sync_to_async(active_stadiums)()
+        sync_errors = await calendar_sync.async_sync_many_if_stale(
+            [stadium.calendar_id for stadium in stadiums],
+            user_id=request.user.id
+        )
+        return json_response(await sync_to_async(bookings_payload)(request.user, stadiums, sync_errors))
+
+    except Exception as e:
+        return json_response({'error': str(e)}, status=500)
+
+
+@require_GET
+@jwt_required
+async def booking_status(request, booking_id):
+    """Report a booking's status; ``?wait=<seconds>`` long-polls while it is pending.
+
+    Waiting with ``asyncio.sleep`` keeps a long poll from holding a thread.
+    A booking still pending afterwards answers 202 with ``Retry-After``.
+    """
+    try:
+        try:
+            wait = min(float(request.GET.get('wait', 0)), settings.BOOKING_STATUS_MAX_WAIT)
+        except ValueError:
+            return json_response({'error': 'wait must be a number of seconds'}, status=400)
+
+        bookings = Booking.objects.select_related('slot').filter(user_id=request.user.id)
+        booking = await bookings.filter(pk=booking_id).afirst()
+        if booking is None:
+            return json_response({'error': 'Booking not found'}, status=404)
+
+        deadline = monotonic() + wait
+        while booking.status == 'pending' and monotonic() < deadline:
+            await asyncio.sleep(BOOKING_POLL_INTERVAL)
+            booking = await bookings.aget(pk=booking_id)
+
+        # The stadium lookup may reload its index from the database
+        data, status_code, headers = await sync_to_async(booking_status_result)(booking)
+        return json_response(data, status=status_code, headers=headers)
+
+    except Exception as e:
+        logger.exception("booking_status.failed")
+        return json_response({'error': str(e)}, status=500)
@@ -1,24 +1,19 @@
-from rest_framework import status
-from rest_framework.decorators import api_view, permission_classes
+from rest_framework import serializers, status
+from rest_framework.decorators import api_view, authentication_classes, permission_classes, throttle_classes
 from rest_framework.response import Response
 from rest_framework.permissions import AllowAny, IsAuthenticated
 from django.contrib.auth import authenticate
-from rest_framework_simplejwt.tokens import RefreshToken
 from ..serializers import UserSerializer
-from django.contrib.auth.models import User
-from django.db import transaction
-from django.core.mail import send_mail
 from django.conf import settings
-import random
-import string
+from django.contrib.auth.models import User
+from django.db import IntegrityError, transaction
+from .. import email_outbox, state
+from ..authentication import ClaimsRefreshToken, UserJWTAuthentication, revoke_tokens
+from ..throttling import PasswordResetConfirmThrottle, PasswordResetThrottle
 import logging
 
 logger = logging.getLogger(__name__)
 
-def generate_reset_code():
-    """Generate a 6-digit reset code."""
-    return ''.join(random.choices(string.digits, k=6))
-
 @api_view(['POST'])
 @permission_classes([AllowAny])
 def register_user(request):
@@ -31,7 +26,7 @@ def register_user(request):
                 }, status=status.HTTP_400_BAD_REQUEST)
 
             user = serializer.save()
-            refresh = RefreshToken.for_user(user)
+            refresh = ClaimsRefreshToken.for_user(user)
             return Response({
                 'user': UserSerializer(user).data,
                 'refresh': str(refresh),
@@ -42,8 +37,15 @@ def register_user(request):
         return Response({
             'errors': e.detail
         }, status=status.HTTP_400_BAD_REQUEST)
+    except IntegrityError:
+        # A concurrent sign-up took the username, email or phone first
+        serializer = UserSerializer(data=request.data)
+        serializer.is_valid()
+        return Response({
+            'errors': serializer.errors
+        }, status=status.HTTP_400_BAD_REQUEST)
     except Exception as e:
-        logger.exception("Unexpected error during registration")
+        logger.exception("register.failed")
         return Response({
             'error': str(e)
         }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
@@ -56,7 +58,7 @@ def token_obtain_pair(request):
     user = authenticate(username=username, password=password)
     
     if user is not None:
-        refresh = RefreshToken.for_user(user)
+        refresh = ClaimsRefreshToken.for_user(user)
         return Response({
             'refresh': str(refresh),
             'access': str(refresh.access_token),
@@ -69,6 +71,7 @@ def token_obtain_pair(request):
         )
 
 @api_view(['GET'])
+@authentication_classes([UserJWTAuthentication])  # The serializer needs the real User
 @permission_classes([IsAuthenticated])
 def get_user_info(request):
     serializer = UserSerializer(request.user)
@@ -76,6 +79,7 @@ def get_user_info(request):
 
 @api_view(['POST'])
 @permission_classes([AllowAny])
+@throttle_classes([PasswordResetThrottle])
 def request_password_reset(request):
     """Request a password reset code."""
     try:
@@ -91,10 +95,8 @@ def request_password_reset(request):
             # Return success even if user not found to prevent email enumeration
             return Response({'message': 'If an account exists with this email, a reset code will be sent.'})
 
-        # Generate and save reset code
-        reset_code = generate_reset_code()
-        user.profile.verification_code = reset_code
-        user.profile.save()
+        # Generate reset code
+        reset_code = state.issue_code('password_reset', user.id, settings.PASSWORD_RESET_CODE_TTL)
 
         # Send reset code email
         subject = 'Password Reset Code - Tottenham Stadium'
@@ -110,24 +112,19 @@ Best regards,
 Tottenham Stadium Team'''
 
         try:
-            send_mail(
-                subject,
-                message,
-                settings.DEFAULT_FROM_EMAIL,
-                [email],
-                fail_silently=False,
-            )
-            logger.info(f"Password reset code sent to {email}")
+            # Queued for the email worker so SMTP never blocks this request
+            email_outbox.enqueue(subject, message, [email])
+            logger.info("password_reset.queued user=%s", user.id)
             return Response({'message': 'Reset code sent successfully'})
         except Exception as e:
-            logger.error(f"Failed to send password reset code: {str(e)}")
+            logger.exception("password_reset.queue_failed user=%s", user.id)
             return Response(
                 {'error': 'Failed to send reset code'},
                 status=status.HTTP_500_INTERNAL_SERVER_ERROR
             )
 
     except Exception as e:
-        logger.error(f"Password reset request error: {str(e)}")
+        logger.exception("password_reset.failed")
         return Response(
             {'error': 'An error occurred'},
             status=status.HTTP_500_INTERNAL_SERVER_ERROR
@@ -135,6 +132,7 @@ Tottenham Stadium Team'''
 
 @api_view(['POST'])
 @permission_classes([AllowAny])
+@throttle_classes([PasswordResetConfirmThrottle])
 def reset_password(request):
     """Reset password using the verification code."""
     try:
@@ -149,23 +147,24 @@ def reset_password(request):
             )
 
         user = User.objects.filter(email=email).first()
-        if not user or user.profile.verification_code != code:
+        if not user or not state.consume_code('password_reset', user.id, code):
             return Response(
                 {'error': 'Invalid reset code'},
                 status=status.HTTP_400_BAD_REQUEST
             )
 
-        # Update password and clear reset code
+        # Update password; checking the code used it up
         user.set_password(new_password)
-        user.profile.verification_code = None
-        user.save()
-        user.profile.save()
+        with transaction.atomic():
+            user.save(update_fields=['password'])
+            # Sign out every session that used the old password
+            revoke_tokens(user)
 
-        logger.info(f"Password reset successful for user {user.username}")
+        logger.info("password_reset.ok user=%s", user.id)
         return Response({'message': 'Password reset successful'})
 
     except Exception as e:
-        logger.error(f"Password reset error: {str(e)}")
+        logger.exception("password_reset.confirm_failed")
         return Response(
             {'error': 'An error occurred'},
             status=status.HTTP_500_INTERNAL_SERVER_ERROR
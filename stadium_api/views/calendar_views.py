@@ -1,66 +1,196 @@
-from rest_framework.decorators import api_view, permission_classes
-from rest_framework.permissions import IsAuthenticated
+from rest_framework.decorators import api_view, authentication_classes, permission_classes, throttle_classes
+from rest_framework.permissions import AllowAny, IsAuthenticated
 from rest_framework.response import Response
 from rest_framework import status
-from google.oauth2 import service_account
-from googleapiclient.discovery import build
-from datetime import datetime, timedelta
-from django.conf import settings
+import hashlib
 import json
-import os
-from django.db import transaction
-from ..models import UserProfile
+import logging
+import math
+from collections import defaultdict
+from datetime import datetime, time, timedelta
+from django.conf import settings
+from django.urls import reverse
+from django.utils.cache import get_conditional_response
+from .. import booking_service, calendar_mirror, calendar_quota, calendar_sync, calendar_watch, intervals, slot_cache
+from ..models import Booking, Slot
+from ..stadiums import active_stadiums, get_stadium
+from ..throttling import BookSlotThrottle
 from django.utils import timezone
 
-def get_calendar_service():
-    """Helper function to create Google Calendar service."""
+logger = logging.getLogger(__name__)
+
+BOOKING_POLL_INTERVAL = 0.5  # seconds between checks while long-polling
+BOOKING_RETRY_AFTER = 1  # seconds a client should wait before asking about a pending booking again
+
+def refresh_calendar(calendar_id):
+    """Pull recent Google changes for a stadium calendar if ours are stale.
+    
+    Failures are logged and the caller keeps serving the local copy.
+    """
     try:
-        print("\n=== Starting Calendar Service Initialization ===")
-        # Get credentials from environment variable
-        creds_json = os.getenv('GOOGLE_SERVICE_ACCOUNT_CREDENTIALS')
-        if not creds_json:
-            print("ERROR: Google service account credentials not found in environment")
-            raise ValueError("Google service account credentials not found in environment")
-        
-        # Parse credentials from JSON string
-        try:
-            creds_info = json.loads(creds_json)
-            print("Successfully parsed service account credentials")
-            print(f"Service account email: {creds_info.get('client_email')}")
-        except json.JSONDecodeError as e:
-            print(f"ERROR: Failed to parse service account credentials: {str(e)}")
-            raise ValueError("Invalid service account credentials format")
-        
-        try:
-            credentials = service_account.Credentials.from_service_account_info(
-                creds_info,
-                scopes=['https://www.googleapis.com/auth/calendar']
-            )
-            print("Successfully created service account credentials")
-        except Exception as e:
-            print(f"ERROR: Failed to create service account credentials: {str(e)}")
-            raise ValueError("Failed to create service account credentials")
-        
-        try:
-            service = build('calendar', 'v3', credentials=credentials)
-            print("Successfully created calendar service")
-            
-            # Test calendar access
-            calendars = service.calendarList().list().execute()
-            print(f"\nFound {len(calendars.get('items', []))} calendars:")
-            for cal in calendars.get('items', []):
-                print(f"- {cal.get('summary', 'Unnamed')} ({cal.get('id')})")
-                print(f"  Access Role: {cal.get('accessRole', 'unknown')}")
-            
-            print("\n=== Calendar Service Initialization Complete ===")
-            return service
-        except Exception as e:
-            print(f"ERROR: Failed to build calendar service or test access: {str(e)}")
-            raise ValueError("Failed to create or verify calendar service")
-            
+        calendar_sync.sync_if_stale(calendar_id)
     except Exception as e:
-        print(f"ERROR: Calendar service initialization failed: {str(e)}")
-        raise ValueError(f"Calendar service initialization failed: {str(e)}")
+        logger.warning("calendar.sync_failed calendar=%s error=%s", calendar_id, e)
+
+def local_available_slots(stadium, date):
+    """List the free slots of one stadium day from the local mirror."""
+    refresh_calendar(stadium.calendar_id)
+    return query_available_slots(stadium, date)
+
+def query_available_slots(stadium, date):
+    """Read one stadium day's free slots from the Slot table."""
+    return query_availability([stadium], [date])[stadium.calendar_id][date.isoformat()]
+
+def query_availability(stadiums, dates):
+    """Read the free slots of several stadiums and days with one Slot query.
+
+    Returns ``{calendar_id: {'YYYY-MM-DD': [slot, ...]}}``. Days run from
+    midnight to midnight in each stadium's time zone, and a slot crossing
+    midnight is listed on both days. Free slots overlapping a booked one
+    (e.g. a longer booked event that covers them) are left out.
+    """
+    dates = sorted(dates)
+    result = {stadium.calendar_id: {date.isoformat(): [] for date in dates} for stadium in stadiums}
+    if not stadiums or not dates:
+        return result
+    
+    day_bounds = [
+        (datetime.combine(dates[0], time.min, tzinfo=stadium.tzinfo),
+         datetime.combine(dates[-1] + timedelta(days=1), time.min, tzinfo=stadium.tzinfo))
+        for stadium in stadiums
+    ]
+    rows = defaultdict(list)
+    slots = Slot.objects.filter(
+        calendar_id__in=list(result),
+        start__lt=max(end for _, end in day_bounds),
+        end__gt=min(start for start, _ in day_bounds)
+    ).order_by('start').values_list('calendar_id', 'event_id', 'start', 'end', 'is_booked')
+    for calendar_id, *row in slots:
+        rows[calendar_id].append(row)
+    
+    for stadium in stadiums:
+        tz = stadium.tzinfo
+        days = result[stadium.calendar_id]
+        stadium_rows = rows[stadium.calendar_id]
+        busy = intervals.BusyIntervals((start, end) for _, start, end, is_booked in stadium_rows if is_booked)
+        for event_id, start, end, is_booked in stadium_rows:
+            if is_booked or busy.overlaps(start, end):
+                continue
+            local_start = start.astimezone(tz)
+            local_end = end.astimezone(tz)
+            slot = {
+                'start': local_start.strftime('%H:%M'),
+                'end': local_end.strftime('%H:%M'),
+                'event_id': event_id
+            }
+            # Every local day the slot overlaps; ``end`` itself is exclusive
+            day = local_start.date()
+            while day <= (local_end - timedelta(microseconds=1)).date():
+                if day.isoformat() in days:
+                    days[day.isoformat()].append(slot)
+                day += timedelta(days=1)
+    return result
+
+def serialize_booking(booking):
+    """Shape a booking the way the frontend's bookings list expects it."""
+    slot = booking.slot
+    if slot is None:
+        # The slot's event was deleted from the calendar
+        return {
+            'booking_id': booking.id,
+            'status': booking.status,
+            'failure_reason': booking.failure_reason or None,
+        }
+    stadium = get_stadium(slot.calendar_id)
+    stadium_name = stadium.name if stadium else slot.calendar_id
+    tz = stadium.tzinfo if stadium else timezone.get_current_timezone()
+    start_dt = slot.start.astimezone(tz)
+    end_dt = slot.end.astimezone(tz)
+    
+    # Format date for display
+    formatted_date = start_dt.strftime('%A, %B %d, %Y')  # e.g., "Monday, January 15, 2024"
+    
+    return {
+        'booking_id': booking.id,
+        'date': start_dt.date().isoformat(),  # YYYY-MM-DD for sorting
+        'formatted_date': formatted_date,  # Human-readable date
+        'start_time': start_dt.isoformat(),  # Full ISO timestamp
+        'end_time': end_dt.isoformat(),  # Full ISO timestamp
+        'start': start_dt.strftime('%H:%M'),  # HH:MM for display
+        'end': end_dt.strftime('%H:%M'),  # HH:MM for display
+        'event_id': slot.event_id,
+        'stadiumId': slot.calendar_id,
+        'stadiumName': stadium_name,
+        'calendar_id': slot.calendar_id,
+        'status': booking.status,
+        'failure_reason': booking.failure_reason or None,  # 'conflict' or 'unavailable' when failed
+        'display_text': f"{stadium_name} - {formatted_date} ({start_dt.strftime('%H:%M')} - {end_dt.strftime('%H:%M')})"
+    }
+
+def booking_result(request, booking):
+    """Build the ``(data, status, headers)`` answer to a booking request.
+
+    A booking that lost its slot to a Google booking gets 409. Failures that
+    may clear up (Google unreachable after every retry, or the circuit
+    breaker open while the booking waits) get 503 with ``Retry-After``.
+    """
+    if booking.status == 'booked':
+        logger.info("booking.confirmed booking=%s user=%s", booking.id, request.user.id)
+        return {
+            'message': 'Slot booked successfully',
+            'booking': serialize_booking(booking)
+        }, status.HTTP_200_OK, {}
+    if booking.status == 'failed':
+        if booking.failure_reason == 'unavailable':
+            return {
+                'error': 'Google Calendar could not be updated, please try again later'
+            }, status.HTTP_503_SERVICE_UNAVAILABLE, {'Retry-After': str(settings.GOOGLE_CALENDAR_BREAKER_COOLDOWN)}
+        return {'error': 'This slot is already booked'}, status.HTTP_409_CONFLICT, {}
+    # Still pending: the calendar worker confirms it in the background
+    data = {
+        'message': 'Booking received and awaiting calendar confirmation',
+        'booking': serialize_booking(booking),
+        'status_url': request.build_absolute_uri(reverse('booking-status', args=[booking.id]))
+    }
+    unavailable_for = calendar_quota.breaker_remaining()
+    if unavailable_for:
+        data['message'] = 'Google Calendar is unavailable; the booking will be confirmed once it recovers'
+        return data, status.HTTP_503_SERVICE_UNAVAILABLE, {'Retry-After': str(math.ceil(unavailable_for))}
+    return data, status.HTTP_202_ACCEPTED, {'Retry-After': str(BOOKING_RETRY_AFTER)}
+
+def booking_status_result(booking):
+    """Build the ``(data, status, headers)`` answer to a booking status request.
+
+    A pending booking gets 202 with ``Retry-After`` so clients poll again
+    instead of holding the request open.
+    """
+    data = {'booking': serialize_booking(booking)}
+    if booking.status == 'pending':
+        return data, status.HTTP_202_ACCEPTED, {'Retry-After': str(BOOKING_RETRY_AFTER)}
+    return data, status.HTTP_200_OK, {}
+
+def bookings_payload(user, stadiums, sync_errors):
+    """List a user's upcoming bookings along with each stadium's sync status."""
+    stadium_status = [
+        {
+            'id': stadium.calendar_id,
+            'name': stadium.name,
+            'ok': sync_errors.get(stadium.calendar_id) is None,
+            'error': sync_errors.get(stadium.calendar_id)
+        }
+        for stadium in stadiums
+    ]
+    
+    bookings = Booking.objects.select_related('slot').filter(
+        user_id=user.id,
+        status__in=Booking.ACTIVE_STATUSES,
+        slot__end__gt=timezone.now()
+    ).order_by('slot__start')
+    
+    return {
+        'bookings': [serialize_booking(booking) for booking in bookings],
+        'stadiums': stadium_status
+    }
 
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
@@ -75,68 +205,104 @@ def available_slots(request):
             status=status.HTTP_400_BAD_REQUEST
         )
     
+    stadium = get_stadium(calendar_id)
+    if stadium is None:
+        return Response(
+            {'error': 'Unknown stadium calendar'},
+            status=status.HTTP_404_NOT_FOUND
+        )
+    
     try:
         # Parse the date
-        date = datetime.strptime(date_str, '%Y-%m-%d')
-        start_time = date.replace(hour=0, minute=0, second=0).isoformat() + 'Z'
-        end_time = date.replace(hour=23, minute=59, second=59).isoformat() + 'Z'
+        date = datetime.strptime(date_str, '%Y-%m-%d').date()
         
-        print(f"Fetching slots for calendar: {calendar_id}")
-        print(f"Time range: {start_time} to {end_time}")
-        
-        # Get calendar service
-        service = get_calendar_service()
+        # Serve from the shared slot cache; only one caller reloads a stale day
+        available_slots = slot_cache.get_slots(
+            calendar_id,
+            date.isoformat(),
+            lambda: local_available_slots(stadium, date)
+        )
         
-        # Get events for the day
+        logger.debug("available_slots.listed calendar=%s date=%s slots=%d", calendar_id, date, len(available_slots))
+        return Response({'slots': available_slots})
+    
+    except Exception as e:
+        logger.exception("available_slots.failed")
+        return Response(
+            {'error': str(e)},
+            status=status.HTTP_500_INTERNAL_SERVER_ERROR
+        )
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def availability(request):
+    """Get the free slots of several stadiums over a range of days.
+    
+    ``start`` and ``end`` (inclusive, default ``start`` + 6 days) are
+    YYYY-MM-DD dates; ``calendar_ids`` is a comma-separated list and
+    defaults to every active stadium. Each slot is ``[start, end, event_id]``.
+    Responses carry an ETag, so clients can revalidate with If-None-Match.
+    """
+    try:
         try:
-            events_result = service.events().list(
-                calendarId=calendar_id,
-                timeMin=start_time,
-                timeMax=end_time,
-                singleEvents=True,
-                orderBy='startTime'
-            ).execute()
-            print(f"Successfully fetched {len(events_result.get('items', []))} events")
-        except Exception as e:
-            print(f"Error fetching events: {str(e)}")
-            raise ValueError(f"Failed to fetch events: {str(e)}")
+            start = datetime.strptime(request.GET['start'], '%Y-%m-%d').date()
+            end_str = request.GET.get('end')
+            end = datetime.strptime(end_str, '%Y-%m-%d').date() if end_str else start + timedelta(days=6)
+        except (KeyError, ValueError):
+            return Response(
+                {'error': 'start (and optional end) must be YYYY-MM-DD dates'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
         
-        events = events_result.get('items', [])
+        days = (end - start).days + 1
+        if not 1 <= days <= settings.AVAILABILITY_MAX_DAYS:
+            return Response(
+                {'error': f'The range must cover 1 to {settings.AVAILABILITY_MAX_DAYS} days'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
         
-        # Process events into available slots
-        available_slots = []
-        for event in events:
-            # Only include events that have 'match' in their description
-            description = event.get('description', '').lower()
-            summary = event.get('summary', '').lower()
-            
-            # Skip if not a match event or if already booked
-            if 'match' not in description:
-                continue
-                
-            if '🏟️ booked match' in summary:
-                print(f"Skipping booked slot with summary: {event.get('summary')}")
-                continue
-                
-            start = event['start'].get('dateTime', event['start'].get('date'))
-            end = event['end'].get('dateTime', event['end'].get('date'))
-            
-            # Convert to datetime objects
-            start_dt = datetime.fromisoformat(start.replace('Z', '+00:00'))
-            end_dt = datetime.fromisoformat(end.replace('Z', '+00:00'))
-            
-            # Add available slot
-            available_slots.append({
-                'start': start_dt.strftime('%H:%M'),
-                'end': end_dt.strftime('%H:%M'),
-                'event_id': event['id']
-            })
+        calendar_ids = [c for c in request.GET.get('calendar_ids', '').split(',') if c]
+        if calendar_ids:
+            stadiums = [get_stadium(calendar_id) for calendar_id in dict.fromkeys(calendar_ids)]
+            if None in stadiums:
+                return Response(
+                    {'error': 'Unknown stadium calendar'},
+                    status=status.HTTP_404_NOT_FOUND
+                )
+        else:
+            stadiums = active_stadiums()
+        
+        # Refresh the stadiums concurrently, then read everything in one query
+        sync_errors = calendar_sync.sync_many_if_stale([stadium.calendar_id for stadium in stadiums])
+        dates = [start + timedelta(days=i) for i in range(days)]
+        grid = query_availability(stadiums, dates)
+        
+        data = {
+            'start': start.isoformat(),
+            'end': end.isoformat(),
+            'stadiums': [
+                {
+                    'id': stadium.calendar_id,
+                    'name': stadium.name,
+                    'ok': sync_errors.get(stadium.calendar_id) is None,
+                    'days': {
+                        date: [[slot['start'], slot['end'], slot['event_id']] for slot in slots]
+                        for date, slots in grid[stadium.calendar_id].items()
+                    }
+                }
+                for stadium in stadiums
+            ]
+        }
         
-        print(f"Returning {len(available_slots)} available slots")
-        return Response({'slots': available_slots})
+        etag = '"%s"' % hashlib.md5(json.dumps(data, sort_keys=True).encode()).hexdigest()
+        response = get_conditional_response(request, etag=etag) or Response(data)
+        response['ETag'] = etag
+        # Let browsers keep the copy but revalidate it every time
+        response['Cache-Control'] = 'private, no-cache'
+        return response
     
     except Exception as e:
-        print(f"Error in available_slots: {str(e)}")
+        logger.exception("availability.failed")
         return Response(
             {'error': str(e)},
             status=status.HTTP_500_INTERNAL_SERVER_ERROR
@@ -144,6 +310,7 @@ def available_slots(request):
 
 @api_view(['POST'])
 @permission_classes([IsAuthenticated])
+@throttle_classes([BookSlotThrottle])
 def book_slot(request):
     """Book a time slot."""
     try:
@@ -157,82 +324,21 @@ def book_slot(request):
                 status=status.HTTP_400_BAD_REQUEST
             )
         
-        # Check if user is in cooldown period
-        user_profile = UserProfile.objects.get(user=request.user)
-        if user_profile.last_cancellation:
-            current_time = datetime.utcnow()
-            time_since_cancel = current_time - user_profile.last_cancellation.replace(tzinfo=None)
-            if time_since_cancel < timedelta(hours=1):
-                minutes_left = int((timedelta(hours=1) - time_since_cancel).total_seconds() / 60)
-                return Response(
-                    {'error': f'You recently cancelled a booking. Please wait {minutes_left} minutes before booking again.'},
-                    status=status.HTTP_400_BAD_REQUEST
-                )
-        
-        # Get calendar service
-        service = get_calendar_service()
-        
-        # Get the event
-        event = service.events().get(
-            calendarId=calendar_id,
-            eventId=event_id
-        ).execute()
-        
-        # Check if already booked
-        if event.get('extendedProperties', {}).get('private', {}).get('user_id'):
-            return Response(
-                {'error': 'This slot is already booked'},
-                status=status.HTTP_400_BAD_REQUEST
-            )
-        
-        # Get user details
-        user_name = f"{request.user.first_name} {request.user.last_name}".strip() or "Anonymous"
-        user_phone = user_profile.phone if hasattr(user_profile, 'phone') else "No phone"
-        
-        # Store original event properties
-        original_color = event.get('colorId', '0')  # Store original color
-        
-        # Update event with booking information
-        event['extendedProperties'] = event.get('extendedProperties', {})
-        event['extendedProperties']['private'] = {
-            'user_id': str(request.user.id),
-            'booking_time': datetime.utcnow().isoformat() + 'Z',
-            'user_name': user_name,
-            'user_phone': user_phone,
-            'original_color': original_color  # Store original color in private properties
-        }
-        
-        # Update event details to show it's booked
-        booking_time = datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S UTC')
-        event.update({
-            'summary': '🏟️ BOOKED MATCH',
-            'description': (
-                f"📋 BOOKING DETAILS\n"
-                f"───────────────\n"
-                f"👤 Name: {user_name}\n"
-                f"📱 Phone: {user_phone}\n"
-                f"🆔 User ID: {request.user.id}\n"
-                f"⏰ Booked on: {booking_time}"
-            ),
-            'colorId': '2',  # Green color for booked events
-            'transparency': 'opaque'  # Show as busy
-        })
+        try:
+            booking = booking_service.reserve_slot(request.user, calendar_id, event_id)
+        except booking_service.BookingError as e:
+            return Response({'error': e.message}, status=e.status_code)
         
-        # Update the event
-        updated_event = service.events().update(
-            calendarId=calendar_id,
-            eventId=event_id,
-            body=event
-        ).execute()
+        if not settings.BOOKING_ASYNC:
+            # Write to Google now instead of waiting for the calendar worker
+            calendar_mirror.push_pending(slot_ids=[booking.slot_id])
+            booking.refresh_from_db()
         
-        print(f"Successfully booked slot for user {request.user.id} ({user_name})")
-        return Response({
-            'message': 'Slot booked successfully',
-            'event': updated_event
-        })
+        data, status_code, headers = booking_result(request, booking)
+        return Response(data, status=status_code, headers=headers)
     
     except Exception as e:
-        print(f"Error in book_slot: {str(e)}")
+        logger.exception("book_slot.failed")
         return Response(
             {'error': str(e)},
             status=status.HTTP_500_INTERNAL_SERVER_ERROR
@@ -253,59 +359,18 @@ def cancel_booking(request):
                 status=status.HTTP_400_BAD_REQUEST
             )
         
-        # Get calendar service
-        service = get_calendar_service()
-        
-        # Get the event
-        event = service.events().get(
-            calendarId=calendar_id,
-            eventId=event_id
-        ).execute()
-        
-        # Check if booked by this user
-        if event.get('extendedProperties', {}).get('private', {}).get('user_id') != str(request.user.id):
-            return Response(
-                {'error': 'You can only cancel your own bookings'},
-                status=status.HTTP_403_FORBIDDEN
-            )
-        
-        # Update user's last cancellation time
-        with transaction.atomic():
-            user_profile = UserProfile.objects.select_for_update().get(user=request.user)
-            user_profile.last_cancellation = timezone.now()
-            user_profile.save()
-            print(f"Updated last_cancellation for user {request.user.id} to {user_profile.last_cancellation}")
-        
-        # Get original color from private properties
-        original_color = event.get('extendedProperties', {}).get('private', {}).get('original_color', '0')
-        
-        # Reset event to default state
-        event.update({
-            'summary': 'match',
-            'description': 'match',
-            'colorId': original_color,  # Restore original color
-            'transparency': 'transparent'  # Show as free
-        })
-        
-        # Clear booking information
-        event['extendedProperties'] = event.get('extendedProperties', {})
-        event['extendedProperties']['private'] = {}
-        
-        # Update the event
-        updated_event = service.events().update(
-            calendarId=calendar_id,
-            eventId=event_id,
-            body=event
-        ).execute()
+        try:
+            booking = booking_service.cancel_booking(request.user, calendar_id, event_id)
+        except booking_service.BookingError as e:
+            return Response({'error': e.message}, status=e.status_code)
         
-        print(f"Successfully cancelled booking for user {request.user.id}")
         return Response({
             'message': 'Booking cancelled successfully',
-            'event': updated_event
+            'booking': serialize_booking(booking)
         })
     
     except Exception as e:
-        print(f"Error in cancel_booking: {str(e)}")
+        logger.exception("cancel_booking.failed")
         return Response(
             {'error': str(e)},
             status=status.HTTP_500_INTERNAL_SERVER_ERROR
@@ -316,87 +381,59 @@ def cancel_booking(request):
 def my_bookings(request):
     """Get all bookings for the current user."""
     try:
-        # Get calendar service
-        service = get_calendar_service()
-        
-        # Define stadium calendars with more descriptive names
-        stadiums = [
-            {
-                'id': '433adde78c577df19c67e7d18b2e932c8aa5b60b05098687a13a227712510f5d@group.calendar.google.com',
-                'name': 'Main Field'
-            },
-            {
-                'id': 'c0981f9f07e185a73808a13deb4e2648915ff7f9a28cfe35bb212ff87115a435@group.calendar.google.com',
-                'name': 'Academy Stadium'
-            },
-            {
-                'id': 'a233987f0f4b9c95f17c3abf7055ab3287b7765b2c24c02968360fe68a3f2071@group.calendar.google.com',
-                'name': 'FG Field'
-        }
-        ]
-        
-        all_slots = []
-        now = datetime.utcnow().isoformat() + 'Z'
-        user_id_str = str(request.user.id)
+        # Refresh every stadium concurrently; a slow or failing calendar only
+        # flags its own entry and the local bookings are returned regardless
+        stadiums = active_stadiums()
+        sync_errors = calendar_sync.sync_many_if_stale(
+            [stadium.calendar_id for stadium in stadiums],
+            user_id=request.user.id
+        )
+        return Response(bookings_payload(request.user, stadiums, sync_errors))
         
-        for stadium in stadiums:
-            calendar_id = stadium['id']
-            try:
-                events_result = service.events().list(
-                    calendarId=calendar_id,
-                    timeMin=now,
-                    singleEvents=True,
-                    orderBy='startTime'
-                ).execute()
-            
-                events = events_result.get('items', [])
-            
-                for event in events:
-                    # Check if this event is booked by the current user
-                    description = event.get('description', '')
-                    if '🏟️ BOOKED MATCH' not in event.get('summary', ''):
-                        continue
-                        
-                    user_id_pattern = f"🆔 User ID: {user_id_str}"
-                    if user_id_pattern not in description:
-                        continue
-                    
-                    start = event['start'].get('dateTime', event['start'].get('date'))
-                    end = event['end'].get('dateTime', event['end'].get('date'))
-                    
-                    # Convert to datetime objects
-                    start_dt = datetime.fromisoformat(start.replace('Z', '+00:00'))
-                    end_dt = datetime.fromisoformat(end.replace('Z', '+00:00'))
-                    
-                    # Format date for display
-                    formatted_date = start_dt.strftime('%A, %B %d, %Y')  # e.g., "Monday, January 15, 2024"
-                    
-                    # Add slot with ISO formatted dates and enhanced display information
-                    slot = {
-                        'date': start_dt.date().isoformat(),  # YYYY-MM-DD for sorting
-                        'formatted_date': formatted_date,  # Human-readable date
-                        'start_time': start_dt.isoformat() + 'Z',  # Full ISO timestamp
-                        'end_time': end_dt.isoformat() + 'Z',  # Full ISO timestamp
-                        'start': start_dt.strftime('%H:%M'),  # HH:MM for display
-                        'end': end_dt.strftime('%H:%M'),  # HH:MM for display
-                        'event_id': event['id'],
-                        'stadiumId': stadium['id'],
-                        'stadiumName': stadium['name'],
-                        'calendar_id': calendar_id,
-                        'status': 'booked',
-                        'display_text': f"{stadium['name']} - {formatted_date} ({start_dt.strftime('%H:%M')} - {end_dt.strftime('%H:%M')})"
-                    }
-                    all_slots.append(slot)
-            except Exception as e:
-                print(f"Error processing calendar {calendar_id}: {str(e)}")
-                continue
+    except Exception as e:
+        return Response(
+            {'error': str(e)},
+            status=status.HTTP_500_INTERNAL_SERVER_ERROR
+        )
 
-        # Sort slots by date and time
-        all_slots.sort(key=lambda x: (x['date'], x['start']))
-        return Response({'bookings': all_slots})
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def booking_status(request, booking_id):
+    """Report a booking's status.
+    
+    A pending booking answers 202 with ``Retry-After`` at once; only the
+    async view long-polls (``?wait=``), since here a wait would hold a
+    worker thread.
+    """
+    try:
+        booking = Booking.objects.select_related('slot').filter(user_id=request.user.id, pk=booking_id).first()
+        if booking is None:
+            return Response(
+                {'error': 'Booking not found'},
+                status=status.HTTP_404_NOT_FOUND
+            )
         
+        data, status_code, headers = booking_status_result(booking)
+        return Response(data, status=status_code, headers=headers)
+    
     except Exception as e:
+        logger.exception("booking_status.failed")
         return Response(
             {'error': str(e)},
             status=status.HTTP_500_INTERNAL_SERVER_ERROR
-        )
\ No newline at end of file
+        )
+
+@api_view(['POST'])
+@authentication_classes([])
+@permission_classes([AllowAny])
+def calendar_notifications(request):
+    """Receive Google Calendar push notifications for watched stadium calendars."""
+    accepted = calendar_watch.handle_notification(
+        channel_id=request.headers.get('X-Goog-Channel-ID'),
+        token=request.headers.get('X-Goog-Channel-Token'),
+        resource_id=request.headers.get('X-Goog-Resource-ID'),
+        resource_state=request.headers.get('X-Goog-Resource-State')
+    )
+    if not accepted:
+        return Response(status=status.HTTP_403_FORBIDDEN)
+    return Response(status=status.HTTP_200_OK)
@@ -1,24 +1,18 @@
 from django.views.generic import TemplateView
-from django.views.decorators.cache import never_cache
 from django.conf import settings
 from django.http import HttpResponse
+from django.utils.cache import add_never_cache_headers, get_conditional_response, patch_vary_headers
+import gzip
+import hashlib
 import os
+import threading
 
-@never_cache
-def index(request):
-    """Serve the React app's index.html for all non-API routes."""
-    try:
-        # In production, let whitenoise handle static files
-        if not settings.DEBUG:
-            with open(os.path.join(settings.REACT_APP_DIR, 'index.html'), 'r') as f:
-                return HttpResponse(f.read())
-        # In development, serve from template
-        else:
-            return TemplateView.as_view(template_name='index.html')(request)
-    except Exception as e:
-        # If index.html is not found, return a basic HTML response
-        return HttpResponse(
-            '''
+try:
+    import brotli
+except ImportError:  # Optional; gzip is always available
+    brotli = None
+
+FALLBACK_INDEX = b'''
             <!DOCTYPE html>
             <html>
                 <head>
@@ -29,6 +23,103 @@ def index(request):
                     <script src="/static/js/main.js"></script>
                 </body>
             </html>
-            ''',
-            content_type='text/html'
-        ) 
\ No newline at end of file
+            '''
+
+
+class IndexPage:
+    """index.html kept in memory with its gzip and brotli encodings.
+
+    The file is read again only when its mtime or size changes, so a
+    navigation costs one stat() instead of a read. Each encoding has its
+    own strong ETag.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stamp = None
+        self.variants = {}
+
+    def _load(self, body):
+        digest = hashlib.sha256(body).hexdigest()[:32]
+        variants = {None: (body, f'"{digest}"')}
+        variants['gzip'] = (gzip.compress(body, compresslevel=9, mtime=0), f'"{digest}-gz"')
+        if brotli is not None:
+            variants['br'] = (brotli.compress(body), f'"{digest}-br"')
+        self.variants = variants
+
+    def refresh(self):
+        path = os.path.join(settings.REACT_APP_DIR, 'index.html')
+        try:
+            stat = os.stat(path)
+            stamp = (path, stat.st_mtime_ns, stat.st_size)
+        except OSError:
+            stamp = None
+        if stamp == self._stamp and self.variants:
+            return
+        with self._lock:
+            if stamp == self._stamp and self.variants:
+                return
+            try:
+                with open(path, 'rb') as f:
+                    body = f.read()
+            except OSError:
+                # If index.html is not found, serve a basic page
+                body, stamp = FALLBACK_INDEX, None
+            self._load(body)
+            self._stamp = stamp
+
+    def variant(self, accept_encoding):
+        """``(encoding, body, etag)`` for a client's Accept-Encoding header."""
+        self.refresh()
+        variants = self.variants
+        qualities = accepted_encodings(accept_encoding)
+        for encoding in ('br', 'gzip'):
+            # ``q=0`` means the client refuses the encoding
+            if encoding in variants and qualities.get(encoding, qualities.get('*', 0)) > 0:
+                return (encoding,) + variants[encoding]
+        return (None,) + variants[None]
+
+
+def accepted_encodings(accept_encoding):
+    """Map the codings in an Accept-Encoding header to their q-values."""
+    qualities = {}
+    for token in accept_encoding.lower().split(','):
+        name, *params = [part.strip() for part in token.split(';')]
+        if not name:
+            continue
+        quality = 1.0
+        for param in params:
+            key, _, value = param.partition('=')
+            if key.strip() == 'q':
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        qualities[name] = quality
+    return qualities
+
+
+index_page = IndexPage()
+
+
+def index(request):
+    """Serve the React app's index.html for all non-API routes."""
+    # In development, serve from template
+    if settings.DEBUG:
+        response = TemplateView.as_view(template_name='index.html')(request)
+        add_never_cache_headers(response)
+        return response
+
+    # In production, static files come from whitenoise and index.html from memory
+    encoding, body, etag = index_page.variant(request.META.get('HTTP_ACCEPT_ENCODING', ''))
+    response = get_conditional_response(request, etag=etag)
+    if response is None:
+        response = HttpResponse(body, content_type='text/html; charset=utf-8')
+        if encoding:
+            response['Content-Encoding'] = encoding
+        response['Content-Length'] = str(len(body))
+    response['ETag'] = etag
+    # Browsers keep the page but revalidate it, so a new build shows up at once
+    response['Cache-Control'] = 'no-cache'
+    patch_vary_headers(response, ('Accept-Encoding',))
+    return response
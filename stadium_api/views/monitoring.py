@@ -0,0 +1,20 @@
+from django.conf import settings
+from django.http import HttpResponse, HttpResponseNotFound
+from django.utils.crypto import constant_time_compare
+
+from .. import metrics
+
+
+def prometheus_metrics(request):
+    """Request and span counters for Prometheus.
+
+    Requires ``Authorization: Bearer <METRICS_TOKEN>``; without a token
+    configured the endpoint only exists in DEBUG.
+    """
+    token = settings.METRICS_TOKEN
+    if token:
+        if not constant_time_compare(request.headers.get('Authorization', ''), f'Bearer {token}'):
+            return HttpResponse(status=401)
+    elif not settings.DEBUG:
+        return HttpResponseNotFound()
+    return HttpResponse(metrics.render_prometheus(), content_type='text/plain; version=0.0.4')
@@ -2,46 +2,23 @@ from rest_framework import viewsets, status
 from rest_framework.decorators import api_view, permission_classes, action
 from rest_framework.permissions import AllowAny, IsAuthenticated
 from rest_framework.response import Response
-from rest_framework_simplejwt.tokens import RefreshToken
-from rest_framework_simplejwt.authentication import JWTAuthentication
+from django.conf import settings
 from django.contrib.auth import authenticate
 from django.contrib.auth.models import User
+from django.db import IntegrityError
 from ..serializers import UserSerializer
 from ..models import UserProfile
-from django.core.mail import send_mail, get_connection
-from django.conf import settings
-import random
+from .. import email_outbox, state
+from ..authentication import ClaimsRefreshToken, UserJWTAuthentication
+from ..throttling import ResendCodeThrottle, VerifyCodeThrottle
 import logging
-import traceback
-import socket
 
 logger = logging.getLogger(__name__)
 
 def send_verification_email(user, verification_code, is_resend=False):
-    """Helper function to send verification email with enhanced error handling"""
-    try:
-        # Test email settings
-        logger.info("Testing email settings...")
-        logger.info(f"EMAIL_HOST: {settings.EMAIL_HOST}")
-        logger.info(f"EMAIL_PORT: {settings.EMAIL_PORT}")
-        logger.info(f"EMAIL_HOST_USER: {settings.EMAIL_HOST_USER}")
-        logger.info(f"EMAIL_USE_TLS: {settings.EMAIL_USE_TLS}")
-        logger.info(f"DEFAULT_FROM_EMAIL: {settings.DEFAULT_FROM_EMAIL}")
-
-        # Test SMTP connection
-        logger.info("Testing SMTP connection...")
-        connection = get_connection()
-        try:
-            connection.open()
-            logger.info("SMTP connection successful")
-        except socket.error as e:
-            logger.error(f"SMTP connection failed: {str(e)}")
-            raise
-        finally:
-            connection.close()
-
-        subject = 'Your New Verification Code' if is_resend else 'Verify your email address'
-        message = f'''
+    """Queue the verification email; the email worker delivers it."""
+    subject = 'Your New Verification Code' if is_resend else 'Verify your email address'
+    message = f'''
 Hi {user.first_name or 'there'},
 
 {'Here is your new verification code' if is_resend else 'Thank you for signing up! Your verification code is'}:
@@ -55,24 +32,19 @@ If you didn't create this account, you can safely ignore this email.
 Best regards,
 Tottenham Stadium Team
 '''
-        logger.info(f"Sending email to {user.email}")
-        logger.info(f"Subject: {subject}")
-        logger.info(f"From: {settings.DEFAULT_FROM_EMAIL}")
-
-        send_mail(
-            subject,
-            message,
-            settings.DEFAULT_FROM_EMAIL,
-            [user.email],
-            fail_silently=False,
-        )
-        logger.info(f"Email sent successfully to {user.email}")
-        return True
-    except Exception as e:
-        logger.error(f"Failed to send email: {str(e)}")
-        logger.error(f"Error type: {type(e)}")
-        logger.error(f"Traceback: {traceback.format_exc()}")
-        raise
+    email_outbox.enqueue(subject, message, [user.email])
+    logger.info("verification_email.queued user=%s resend=%s", user.id, is_resend)
+    return True
+
+def first_error(errors):
+    """Return the first message in a (possibly nested) serializer error dict."""
+    if isinstance(errors, dict):
+        errors = list(errors.values())
+    for error in errors:
+        message = first_error(error) if isinstance(error, (dict, list)) else str(error)
+        if message:
+            return message
+    return None
 
 class UserViewSet(viewsets.ModelViewSet):
     queryset = User.objects.all()
@@ -86,46 +58,41 @@ class UserViewSet(viewsets.ModelViewSet):
             permission_classes = [AllowAny]
         return [permission() for permission in permission_classes]
 
+    def get_throttles(self):
+        # Set here rather than on the actions, since urls.py also routes to
+        # them through as_view() without the action's options
+        if self.action == 'verify_code':
+            return [VerifyCodeThrottle()]
+        if self.action == 'resend_code':
+            return [ResendCodeThrottle()]
+        return super().get_throttles()
+
     def create(self, request):
         try:
-            logger.info("=== Starting User Registration ===")
-            logger.info(f"Request data: {request.data}")
-
-            # Validate unique fields first
-            if User.objects.filter(username=request.data.get('username')).exists():
-                return Response(
-                    {"error": "Username already exists"},
-                    status=status.HTTP_400_BAD_REQUEST
-                )
-
-            if User.objects.filter(email=request.data.get('email')).exists():
-                return Response(
-                    {"error": "Email already exists"},
-                    status=status.HTTP_400_BAD_REQUEST
-                )
+            # One validation pass checks username, email and phone together
+            serializer = self.get_serializer(data=request.data)
+            if not serializer.is_valid():
+                logger.info("register.invalid fields=%s", ','.join(serializer.errors))
+                return Response({
+                    "error": first_error(serializer.errors),
+                    "errors": serializer.errors
+                }, status=status.HTTP_400_BAD_REQUEST)
 
-            phone = request.data.get('phone')
-            if phone and UserProfile.objects.filter(phone=phone).exists():
-                return Response(
-                    {"error": "Phone number already exists"},
-                    status=status.HTTP_400_BAD_REQUEST
-                )
+            # Create the user and its profile
+            try:
+                user = serializer.save(is_active=False)
+            except IntegrityError:
+                # A concurrent sign-up took one of the values; validate again to say which
+                serializer = self.get_serializer(data=request.data)
+                serializer.is_valid()
+                return Response({
+                    "error": first_error(serializer.errors) or "Account already exists",
+                    "errors": serializer.errors
+                }, status=status.HTTP_400_BAD_REQUEST)
+            logger.info("register.created user=%s", user.id)
 
             # Generate verification code
-            verification_code = ''.join([str(random.randint(0, 9)) for _ in range(6)])
-            logger.info(f"Generated verification code: {verification_code}")
-
-            # Create user first
-            serializer = self.get_serializer(data=request.data)
-            serializer.is_valid(raise_exception=True)
-            user = serializer.save(is_active=False)
-            logger.info(f"Created user with ID: {user.id}")
-
-            # Update profile with verification code
-            user.profile.verification_code = verification_code
-            user.profile.is_verified = False
-            user.profile.save()
-            logger.info("Updated user profile with verification code")
+            verification_code = state.issue_code('verify', user.id, settings.VERIFICATION_CODE_TTL)
 
             # Send verification email
             try:
@@ -139,7 +106,7 @@ class UserViewSet(viewsets.ModelViewSet):
                 }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
             # Generate tokens
-            refresh = RefreshToken.for_user(user)
+            refresh = ClaimsRefreshToken.for_user(user)
             
             return Response({
                 "user": UserSerializer(user).data,
@@ -148,9 +115,7 @@ class UserViewSet(viewsets.ModelViewSet):
             }, status=status.HTTP_201_CREATED)
 
         except Exception as e:
-            logger.error("=== Registration Failed ===")
-            logger.error(f"Error: {str(e)}")
-            logger.error(f"Traceback: {traceback.format_exc()}")
+            logger.exception("register.failed")
             return Response({
                 "error": "Registration failed. Please try again.",
                 "details": str(e)
@@ -159,19 +124,11 @@ class UserViewSet(viewsets.ModelViewSet):
     @action(detail=False, methods=['post'], url_path='verify-code', permission_classes=[AllowAny], authentication_classes=[])
     def verify_code(self, request):
         try:
-            logger.info("=== Starting Verification Process ===")
-            logger.info(f"Raw request data: {request.data}")
-            logger.info(f"Request headers: {request.headers}")
-
             code = str(request.data.get('code', '')).strip()
             user_id = request.data.get('userId')
-            
-            logger.info(f"Parsed data - user_id: {user_id}, code: {code}")
 
             if not code or not user_id:
-                logger.error("Missing required fields")
-                logger.error(f"Code present: {bool(code)}")
-                logger.error(f"User ID present: {bool(user_id)}")
+                logger.info("verify.missing_fields code=%s user=%s", bool(code), bool(user_id))
                 return Response(
                     {"error": "Verification code and user ID are required"},
                     status=status.HTTP_400_BAD_REQUEST
@@ -180,44 +137,35 @@ class UserViewSet(viewsets.ModelViewSet):
             try:
                 # First find the profile
                 profile = UserProfile.objects.select_related('user').get(user_id=user_id)
-                logger.info(f"Found profile - user_id: {user_id}")
-                logger.info(f"Profile data:")
-                logger.info(f"- Verification code: {profile.verification_code}")
-                logger.info(f"- Is verified: {profile.is_verified}")
-                logger.info(f"- User active: {profile.user.is_active}")
                 
                 # Check if already verified
                 if profile.is_verified:
-                    logger.info("Profile is already verified")
+                    logger.info("verify.already_verified user=%s", user_id)
                     return Response(
                         {"error": "Email is already verified"},
                         status=status.HTTP_400_BAD_REQUEST
                     )
 
-                # Verify the code
-                if code != profile.verification_code:
-                    logger.error("Invalid verification code")
-                    logger.error(f"Received: {code}")
-                    logger.error(f"Expected: {profile.verification_code}")
+                # Verify the code; a valid code is used up by this check
+                if not state.consume_code('verify', profile.user_id, code):
+                    logger.info("verify.invalid_code user=%s", user_id)
                     return Response(
                         {"error": "Invalid verification code"},
                         status=status.HTTP_400_BAD_REQUEST
                     )
 
                 # Code is valid, update profile and user
-                profile.is_verified = True
-                profile.verification_code = None  # Clear the code
-                profile.save()
+                profile.set_fields(is_verified=True)
 
                 # Activate the user
                 user = profile.user
                 user.is_active = True
-                user.save()
+                user.save(update_fields=['is_active'])
 
-                logger.info(f"Successfully verified user {user_id}")
+                logger.info("verify.ok user=%s", user_id)
 
                 # Generate tokens for automatic login
-                refresh = RefreshToken.for_user(user)
+                refresh = ClaimsRefreshToken.for_user(user)
                 
                 return Response({
                     "message": "Email verified successfully",
@@ -229,16 +177,14 @@ class UserViewSet(viewsets.ModelViewSet):
                 })
 
             except UserProfile.DoesNotExist:
-                logger.error(f"Profile not found for user_id: {user_id}")
+                logger.info("verify.unknown_user user=%s", user_id)
                 return Response(
                     {"error": "User not found"},
                     status=status.HTTP_400_BAD_REQUEST
                 )
 
         except Exception as e:
-            logger.error("=== Verification Failed ===")
-            logger.error(f"Error: {str(e)}")
-            logger.exception(e)
+            logger.exception("verify.failed")
             return Response({
                 "error": "Verification failed. Please try again.",
                 "details": str(e)
@@ -248,7 +194,6 @@ class UserViewSet(viewsets.ModelViewSet):
     def resend_code(self, request):
         try:
             user_id = request.data.get('userId')
-            logger.info(f"Resending code for user ID: {user_id}")
 
             if not user_id:
                 return Response(
@@ -267,35 +212,28 @@ class UserViewSet(viewsets.ModelViewSet):
                     status=status.HTTP_400_BAD_REQUEST
                 )
 
-            # Generate new verification code
-            verification_code = ''.join([str(random.randint(0, 9)) for _ in range(6)])
-            logger.info(f"Generated new code: {verification_code}")
-
-            # Save new code
-            profile.verification_code = verification_code
-            profile.save()
+            # Generate new verification code; the previous one stops working
+            verification_code = state.issue_code('verify', profile.user_id, settings.VERIFICATION_CODE_TTL)
 
             # Send new verification email
             try:
                 send_verification_email(profile.user, verification_code, is_resend=True)
                 return Response({"message": "Verification code resent successfully"})
             except Exception as email_error:
-                logger.error(f"Failed to resend verification email: {str(email_error)}")
+                logger.exception("resend_code.email_failed user=%s", user_id)
                 return Response({
                     "error": "Failed to send verification email. Please try again.",
                     "details": str(email_error)
                 }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
         except Exception as e:
-            logger.error("=== Resend Code Failed ===")
-            logger.error(f"Error: {str(e)}")
-            logger.error(f"Traceback: {traceback.format_exc()}")
+            logger.exception("resend_code.failed")
             return Response({
                 "error": "Failed to resend code. Please try again.",
                 "details": str(e)
             }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
-    @action(detail=False, methods=['get'], permission_classes=[IsAuthenticated], authentication_classes=[JWTAuthentication])
+    @action(detail=False, methods=['get'], permission_classes=[IsAuthenticated], authentication_classes=[UserJWTAuthentication])
     def me(self, request):
         serializer = self.get_serializer(request.user)
         return Response(serializer.data)
@@ -308,7 +246,7 @@ def user_login(request):
     
     user = authenticate(username=username, password=password)
     if user:
-        refresh = RefreshToken.for_user(user)
+        refresh = ClaimsRefreshToken.for_user(user)
         return Response({
             'user': {
                 'id': user.id,